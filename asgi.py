@@ -0,0 +1,6 @@
+"""ASGI entry point: ``uvicorn asgi:app`` serves the async API and the Flask pages."""
+
+from async_api import create_asgi_app
+from server import app as flask_app
+
+app = create_asgi_app(flask_app)
@@ -0,0 +1,274 @@
+"""
+Async JSON API served over ASGI.
+
+``create_asgi_app(flask_app)`` serves the busiest JSON endpoints
+(``/api/members``, ``/api/settlements`` and ``GET``/``POST /api/transactions``)
+from coroutines with async SQLAlchemy sessions (``aiosqlite`` on SQLite,
+``asyncpg`` on PostgreSQL), so a slow query no longer holds up the worker.
+Every other path, the HTML pages and the remaining ``/api/*`` endpoints,
+goes to the unchanged Flask app through a WSGI adapter.
+
+Both sides share the models, validation, ledger updates and per-app caches,
+and answer with the same JSON, status codes and ETags; async requests also
+get a ``Server-Timing`` header, count in ``/metrics`` and are written to the
+access log. The room is resolved
+as in ``rooms.py`` (header, query argument, then the Flask session cookie),
+except that a ``room`` argument is not remembered. ``asgi.py`` builds the app
+for ``uvicorn asgi:app``.
+"""
+
+from __future__ import annotations
+
+from decimal import Decimal
+import asyncio
+import contextlib
+import time
+from functools import wraps
+from typing import Dict
+
+from a2wsgi import WSGIMiddleware
+from flask import g
+from itsdangerous import BadSignature
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+
+from engine_profiles import apply_sqlite_pragmas, engine_options, engine_profile
+from ledger import record_transaction
+from logger_setup import log_access
+from metrics import RequestTimings, record_request
+from models import DEFAULT_ROOM_ID, LedgerState, MemberBalance, Person, Room, use_room
+from money import from_cents
+from rooms import ROOM_ARG, ROOM_HEADER, SESSION_ROOM_KEY, parse_room_id
+from routes import (
+    LEDGER_VARY,
+    page_size,
+    ledger_etag_value,
+    resolve_sort,
+    serialize_transaction,
+    split_page,
+    transaction_page_query,
+)
+from utils import payload_to_form, plan_settlements, transaction_from_data, validate_transaction_form
+
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+
+def async_database_uri(database_uri: str):
+    """The async driver URL for a sync SQLAlchemy database URI."""
+    url = make_url(database_uri)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(f"No async driver for {url.get_backend_name()!r} databases.")
+    return url.set(drivername=driver)
+
+
+def _error(message: str, status: int = 400) -> JSONResponse:
+    return JSONResponse({"error": message}, status_code=status)
+
+
+async def _member_names(session, room_id: int) -> Dict[int, str]:
+    rows = await session.execute(
+        select(Person.id, Person.name).where(Person.room_id == room_id).order_by(Person.name)
+    )
+    return dict(rows.all())
+
+
+def create_asgi_app(flask_app) -> Starlette:
+    """Serve the async API endpoints and mount ``flask_app`` for everything else."""
+    config = flask_app.config
+    profile = engine_profile(config.get("DB_ENGINE_PROFILE"))
+    engine = create_async_engine(
+        async_database_uri(config["SQLALCHEMY_DATABASE_URI"]),
+        **engine_options(profile, config["SQLALCHEMY_DATABASE_URI"]),
+    )
+    apply_sqlite_pragmas(engine.sync_engine, profile)
+    # Serializing after commit must not trigger lazy loads.
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    # SQLite takes one writer at a time: queue writers here instead of
+    # letting them spin on the busy timeout in driver threads.
+    write_lock = asyncio.Lock() if engine.dialect.name == "sqlite" else None
+
+    def session_room(request: Request):
+        cookie = request.cookies.get(config.get("SESSION_COOKIE_NAME", "session"))
+        serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+        if not cookie or serializer is None:
+            return None
+        try:
+            data = serializer.loads(
+                cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds())
+            )
+        except BadSignature:
+            return None
+        return data.get(SESSION_ROOM_KEY)
+
+    async def resolve_room(request: Request, session) -> int:
+        explicit = parse_room_id(request.headers.get(ROOM_HEADER)) or parse_room_id(
+            request.query_params.get(ROOM_ARG)
+        )
+        room_id = explicit or session_room(request) or DEFAULT_ROOM_ID
+        if await session.get(Room, room_id) is None:
+            if explicit is not None:
+                raise LookupError(f"Room {explicit} does not exist.")
+            room_id = DEFAULT_ROOM_ID
+        return room_id
+
+    def endpoint(view):
+        """
+        Run ``view(request, session, room_id)`` inside a Flask app context
+        scoped to the request's room and an async session, recording its
+        metrics and access log line like the Flask app does.
+        """
+
+        async def handle(request: Request) -> Response:
+            async with sessions() as session:
+                try:
+                    room_id = await resolve_room(request, session)
+                except (LookupError, ValueError) as exc:
+                    return _error(str(exc), 404)
+                with use_room(room_id):
+                    try:
+                        return await view(request, session, room_id)
+                    except ValueError as exc:
+                        return _error(str(exc))
+
+        @wraps(view)
+        async def wrapper(request: Request) -> Response:
+            # The app context gives access to config and the shared caches;
+            # no I/O goes through the sync ``db.session``.
+            with flask_app.app_context():
+                started = time.perf_counter()
+                if config.get("METRICS_ENABLED"):
+                    g.request_timings = RequestTimings()
+                response = await handle(request)
+                timings = g.pop("request_timings", None)
+                if timings is not None:
+                    response.headers["Server-Timing"] = record_request(
+                        request.method, request.url.path, response.status_code, timings
+                    )
+                log_access(
+                    request.method,
+                    request.url.path,
+                    response.status_code,
+                    request.client.host if request.client else None,
+                    started,
+                )
+                return response
+
+        return wrapper
+
+    def ledger_etag(view):
+        """Async twin of ``routes.ledger_etag`` for read endpoints."""
+
+        @wraps(view)
+        async def wrapper(request: Request, session, room_id: int) -> Response:
+            if request.method not in ("GET", "HEAD"):
+                return await view(request, session, room_id)
+            version = await session.scalar(
+                select(LedgerState.version).where(LedgerState.id == room_id)
+            )
+            etag = f'W/"{ledger_etag_value(room_id, version or 0)}"'
+            sent = {tag.strip() for tag in request.headers.get("if-none-match", "").split(",")}
+            if sent & {etag, etag[2:], "*"}:
+                response = Response(status_code=304)
+            else:
+                response = await view(request, session, room_id)
+                if response.status_code != 200:
+                    return response
+            response.headers["ETag"] = etag
+            response.headers["Cache-Control"] = "no-cache"
+            response.headers["Vary"] = ", ".join(LEDGER_VARY)
+            return response
+
+        return wrapper
+
+    @endpoint
+    @ledger_etag
+    async def api_members(request: Request, session, room_id: int) -> Response:
+        names = await _member_names(session, room_id)
+        return JSONResponse([{"id": person_id, "name": name} for person_id, name in names.items()])
+
+    @endpoint
+    @ledger_etag
+    async def api_settlements(request: Request, session, room_id: int) -> Response:
+        names = await _member_names(session, room_id)
+        balances = {person_id: Decimal("0.00") for person_id in names}
+        stored = await session.execute(
+            select(MemberBalance.person_id, MemberBalance.balance_cents).where(
+                MemberBalance.room_id == room_id
+            )
+        )
+        for person_id, cents in stored:
+            if person_id in balances:
+                balances[person_id] = from_cents(cents)
+        return JSONResponse(
+            [
+                {
+                    "from": {"id": debtor_id, "name": names[debtor_id]},
+                    "to": {"id": creditor_id, "name": names[creditor_id]},
+                    "amount": float(amount),
+                }
+                for debtor_id, creditor_id, amount in plan_settlements(balances)
+            ]
+        )
+
+    @endpoint
+    @ledger_etag
+    async def api_transactions(request: Request, session, room_id: int) -> Response:
+        if request.method == "POST":
+            try:
+                payload = await request.json()
+            except ValueError:
+                payload = None
+            names = await _member_names(session, room_id)
+            data = validate_transaction_form(
+                payload_to_form(payload if isinstance(payload, dict) else {}), names
+            )
+            transaction = transaction_from_data(data)
+            async with write_lock or contextlib.nullcontext():
+                session.add(transaction)
+                await session.flush()
+                await session.run_sync(
+                    lambda sync_session: record_transaction(transaction, sync_session)
+                )
+                await session.commit()
+            return JSONResponse(serialize_transaction(transaction, names), status_code=201)
+
+        params = request.query_params
+        search = params.get("q")
+        sort = resolve_sort(params.get("sort"), search)
+        limit = page_size(params.get("limit"))
+        query = transaction_page_query(
+            sort, params.get("member_id"), limit, params.get("cursor"), search
+        )
+        rows = (await session.execute(query.statement)).all()
+        transactions, next_cursor = split_page(rows, sort, limit)
+        names = await _member_names(session, room_id)
+        return JSONResponse(
+            {
+                "transactions": [serialize_transaction(txn, names) for txn in transactions],
+                "next_cursor": next_cursor,
+            }
+        )
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        yield
+        await engine.dispose()
+
+    app = Starlette(
+        routes=[
+            Route("/api/members", api_members),
+            Route("/api/settlements", api_settlements),
+            Route("/api/transactions", api_transactions, methods=["GET", "POST"]),
+            Mount("/", app=WSGIMiddleware(flask_app)),
+        ],
+        lifespan=lifespan,
+    )
+    app.state.engine = engine
+    return app
+
@@ -0,0 +1,165 @@
+"""
+Load test the WSGI deployment against the ASGI entry point.
+
+Run with ``python -m benchmarks.bench_async``. A SQLite ledger is seeded once
+with ``generate_ledger``; then each server runs in turn on a copy of it, as
+a subprocess with one worker:
+
+- ``wsgi``: ``gunicorn server:app --workers 1`` (the Docker/Railway setup);
+- ``asgi``: ``uvicorn asgi:app --workers 1``.
+
+``--concurrency`` clients send ``GET /api/transactions`` pages and, with
+probability ``--write-ratio``, ``POST /api/transactions`` for ``--seconds``.
+Reported are requests per second and the p50/p95 latency.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import httpx
+
+from benchmarks.ledger_factory import ROOT, create_benchmark_app, generate_ledger
+from models import Person
+
+SERVERS = {
+    "wsgi": ["gunicorn", "server:app", "--workers", "1", "--bind", "127.0.0.1:{port}"],
+    "asgi": ["uvicorn", "asgi:app", "--workers", "1", "--port", "{port}", "--log-level", "warning"],
+}
+
+
+def _start(name: str, database: str, port: int, workdir: str) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{database}",
+        "LOG_DIR": os.path.join(workdir, f"logs-{name}"),
+        "PYTHONPATH": ROOT,
+    }
+    command = [part.format(port=port) for part in SERVERS[name]]
+    return subprocess.Popen(
+        [sys.executable, "-m", *command], cwd=ROOT, env=env, stdout=subprocess.DEVNULL
+    )
+
+
+async def _wait_until_ready(base_url: str, timeout: float = 30.0) -> None:
+    deadline = time.perf_counter() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.perf_counter() < deadline:
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"server at {base_url} did not start")
+
+
+async def _client(client, member_ids, args, seed, deadline, latencies, failures) -> None:
+    rng = random.Random(seed)
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            if rng.random() < args.write_ratio:
+                response = await client.post(
+                    "/api/transactions",
+                    json={
+                        "description": "Load test",
+                        "date": "2025-01-01",
+                        "amount": f"{rng.randint(100, 50_000) / 100:.2f}",
+                        "payer_id": rng.choice(member_ids),
+                        "participant_ids": rng.sample(member_ids, 3),
+                    },
+                )
+            else:
+                response = await client.get(
+                    "/api/transactions", params={"sort": rng.choice(["-date", "-amount"])}
+                )
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            ok = False
+        if ok:
+            latencies.append((time.perf_counter() - started) * 1000)
+        else:
+            failures.append(1)
+
+
+async def _load(base_url: str, member_ids: List[int], args) -> Dict[str, object]:
+    latencies: List[float] = []
+    failures: List[int] = []
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        deadline = time.perf_counter() + args.seconds
+        await asyncio.gather(
+            *(
+                _client(client, member_ids, args, args.seed + number, deadline, latencies, failures)
+                for number in range(args.concurrency)
+            )
+        )
+    latencies.sort()
+    return {
+        "requests_per_second": len(latencies) / args.seconds,
+        "p50_ms": statistics.median(latencies) if latencies else None,
+        "p95_ms": latencies[int(len(latencies) * 0.95)] if latencies else None,
+        "failures": len(failures),
+    }
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Load test the WSGI and ASGI servers.")
+    parser.add_argument("--servers", nargs="+", choices=list(SERVERS), default=list(SERVERS))
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    parser.add_argument("--transactions", type=int, default=50_000)
+    parser.add_argument("--members", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        seeded = os.path.join(workdir, "seed.db")
+        app = create_benchmark_app(f"sqlite:///{seeded}")
+        with app.app_context():
+            generate_ledger(args.transactions, members=args.members, seed=args.seed)
+            member_ids = [person.id for person in Person.query]
+
+        for name in args.servers:
+            database = os.path.join(workdir, f"{name}.db")
+            shutil.copyfile(seeded, database)
+            base_url = f"http://127.0.0.1:{args.port}"
+            server = _start(name, database, args.port, workdir)
+            try:
+                asyncio.run(_wait_until_ready(base_url))
+                result = {"server": name, **asyncio.run(_load(base_url, member_ids, args))}
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+            results.append(result)
+            print(
+                f"{name:<5} {result['requests_per_second']:8.1f} req/s"
+                f" p50 {result['p50_ms'] or 0:8.2f} ms p95 {result['p95_ms'] or 0:8.2f} ms"
+                f" failures {result['failures']}",
+                flush=True,
+            )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump({"config": vars(args), "results": results}, handle, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
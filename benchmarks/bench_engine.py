@@ -0,0 +1,128 @@
+"""
+Compare engine profiles under concurrent load.
+
+Run with ``python -m benchmarks.bench_engine``. For every profile a fresh
+SQLite database is seeded by ``generate_ledger``, then ``--threads`` workers
+send a mix of expense writes and page reads through the app for
+``--seconds``. Reported are requests per second, the read and write medians
+and how many requests failed (for example with ``database is locked``).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+from benchmarks.ledger_factory import create_benchmark_app, generate_ledger
+from engine_profiles import ENGINE_PROFILES, engine_report
+from models import Person
+
+READ_PATHS = ["/api/transactions", "/balances", "/api/stats?bucket=month"]
+
+
+def _worker(app, member_ids, args, seed, deadline, results) -> None:
+    rng = random.Random(seed)
+    client = app.test_client()
+    timings: Dict[str, List[float]] = {"read": [], "write": []}
+    failures = 0
+    while time.perf_counter() < deadline:
+        write = rng.random() < args.write_ratio
+        started = time.perf_counter()
+        try:
+            if write:
+                response = client.post(
+                    "/api/transactions",
+                    json={
+                        "description": "Load test",
+                        "date": "2025-01-01",
+                        "amount": f"{rng.randint(100, 50_000) / 100:.2f}",
+                        "payer_id": rng.choice(member_ids),
+                        "participant_ids": rng.sample(member_ids, 3),
+                    },
+                )
+            else:
+                response = client.get(rng.choice(READ_PATHS))
+            ok = response.status_code < 400
+        except Exception:  # noqa: BLE001 - count, keep the load going
+            ok = False
+        if ok:
+            timings["write" if write else "read"].append((time.perf_counter() - started) * 1000)
+        else:
+            failures += 1
+    results.append((timings, failures))
+
+
+def bench_profile(name: str, args: argparse.Namespace, workdir: str) -> Dict[str, object]:
+    app = create_benchmark_app(f"sqlite:///{os.path.join(workdir, name)}.db", name)
+    with app.app_context():
+        generate_ledger(args.transactions, members=args.members, seed=args.seed)
+        member_ids = [person.id for person in Person.query]
+        settings = engine_report()
+
+    results: List = []
+    deadline = time.perf_counter() + args.seconds
+    threads = [
+        threading.Thread(
+            target=_worker, args=(app, member_ids, args, args.seed + number, deadline, results)
+        )
+        for number in range(args.threads)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    reads = [ms for timings, _ in results for ms in timings["read"]]
+    writes = [ms for timings, _ in results for ms in timings["write"]]
+    return {
+        "profile": name,
+        "settings": settings,
+        "requests_per_second": (len(reads) + len(writes)) / args.seconds,
+        "writes_per_second": len(writes) / args.seconds,
+        "read_median_ms": statistics.median(reads) if reads else None,
+        "write_median_ms": statistics.median(writes) if writes else None,
+        "failures": sum(failures for _, failures in results),
+    }
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare engine profiles under concurrent load.")
+    parser.add_argument("--profiles", nargs="+", choices=list(ENGINE_PROFILES), default=list(ENGINE_PROFILES))
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--write-ratio", type=float, default=0.3)
+    parser.add_argument("--transactions", type=int, default=20_000)
+    parser.add_argument("--members", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in args.profiles:
+            result = bench_profile(name, args, workdir)
+            results.append(result)
+            print(
+                f"{name:<8} {result['requests_per_second']:8.1f} req/s"
+                f" {result['writes_per_second']:7.1f} writes/s"
+                f" read p50 {result['read_median_ms'] or 0:7.2f} ms"
+                f" write p50 {result['write_median_ms'] or 0:7.2f} ms"
+                f" failures {result['failures']}",
+                flush=True,
+            )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump({"config": vars(args), "results": results}, handle, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,189 @@
+"""
+Benchmark the balance engines and the main pages on synthetic ledgers.
+
+Run with ``python -m benchmarks.bench_ledger``. For every size a fresh SQLite
+database is filled by ``generate_ledger`` and each case is timed ``--repeat``
+times with cold caches. Results are written as JSON (``--output``); pass an
+earlier file as ``--compare`` to report cases whose median got slower by more
+than ``--threshold`` and exit with status 1.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Callable, Dict, List
+
+import analytics
+from benchmarks.ledger_factory import create_benchmark_app, generate_ledger
+from utils import compute_balances, compute_person_to_person_debts, split_amount
+
+DEFAULT_SIZES = [1_000, 100_000, 1_000_000]
+ROUTES = [
+    "/transactions",
+    "/balances",
+    "/diagrams",
+    "/api/transactions",
+    # Every generated description contains "expense"; "42" is one row's number.
+    "/api/transactions?q=expense+42",
+]
+SPLITS_PER_RUN = 10_000
+
+
+def _time(run: Callable[[], object], repeat: int, before: Callable[[], None]) -> Dict[str, float]:
+    timings: List[float] = []
+    for _ in range(repeat):
+        before()
+        started = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - started) * 1000)
+    return {
+        "median_ms": statistics.median(timings),
+        "min_ms": min(timings),
+        "max_ms": max(timings),
+        "runs": repeat,
+    }
+
+
+def _split_batch() -> None:
+    for cents in range(100, 100 + SPLITS_PER_RUN):
+        split_amount(Decimal(cents) / 100, cents % 7 + 1)
+
+
+def _with_engine(app, engine: str, run: Callable[[], object]) -> Callable[[], object]:
+    def wrapped():
+        app.config["BALANCE_ENGINE"] = engine
+        try:
+            return run()
+        finally:
+            app.config["BALANCE_ENGINE"] = "sql"
+
+    return wrapped
+
+
+def _get(client, path: str) -> Callable[[], object]:
+    def run():
+        response = client.get(path)
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {path} returned {response.status_code}")
+
+    return run
+
+
+def bench_size(size: int, args: argparse.Namespace, workdir: str) -> Dict[str, object]:
+    """Generate a ledger of ``size`` transactions and time every case on it."""
+    path = os.path.join(workdir, f"ledger-{size}.db")
+    app = create_benchmark_app(f"sqlite:///{path}")
+    app.config["COMPACT_EVEN_SPLITS"] = args.compact
+
+    with app.app_context():
+        started = time.perf_counter()
+        generated = generate_ledger(
+            size,
+            members=args.members,
+            participants=(args.min_participants, args.max_participants),
+            seed=args.seed,
+        )
+        generated["seconds"] = time.perf_counter() - started
+
+        def cold() -> None:
+            app.extensions.pop("stats_cache", None)
+            app.extensions.pop("member_directory", None)
+
+        cases = {
+            "compute_balances": compute_balances,
+            "compute_person_to_person_debts": compute_person_to_person_debts,
+            f"split_amount x{SPLITS_PER_RUN}": _split_batch,
+        }
+        if analytics.numpy_available():
+            cases["compute_balances [numpy]"] = _with_engine(app, "numpy", compute_balances)
+            cases["compute_person_to_person_debts [numpy]"] = _with_engine(
+                app, "numpy", compute_person_to_person_debts
+            )
+        client = app.test_client()
+        cases.update({f"GET {route}": _get(client, route) for route in ROUTES})
+
+        results = {}
+        for name, run in cases.items():
+            results[name] = _time(run, args.repeat, cold)
+            print(f"{size:>9} {name:<42} median {results[name]['median_ms']:9.2f} ms", flush=True)
+
+    return {"size": size, "generated": generated, "cases": results}
+
+
+def compare(current: Dict[str, object], baseline: Dict[str, object], threshold: float) -> List[str]:
+    """Return one message per case whose median is ``threshold`` slower than the baseline."""
+    previous = {
+        (entry["size"], name): case["median_ms"]
+        for entry in baseline["results"]
+        for name, case in entry["cases"].items()
+    }
+    regressions = []
+    for entry in current["results"]:
+        for name, case in entry["cases"].items():
+            before = previous.get((entry["size"], name))
+            if before and case["median_ms"] > before * (1 + threshold):
+                regressions.append(
+                    f"{entry['size']} {name}: {before:.2f} ms -> {case['median_ms']:.2f} ms"
+                )
+    return regressions
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark balances and pages on synthetic ledgers.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--members", type=int, default=20)
+    parser.add_argument("--min-participants", type=int, default=2)
+    parser.add_argument("--max-participants", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--compact", action="store_true", help="store even splits without share rows"
+    )
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--compare", help="earlier JSON results to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "config": {
+            "members": args.members,
+            "participants": [args.min_participants, args.max_participants],
+            "repeat": args.repeat,
+            "seed": args.seed,
+            "compact": args.compact,
+        },
+        "results": [],
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            report["results"].append(bench_size(size, args, workdir))
+
+    with open(args.output, "w", encoding="utf-8") as handle:
+        json.dump(report, handle, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as handle:
+            regressions = compare(report, json.load(handle), args.threshold)
+        for message in regressions:
+            print(f"REGRESSION {message}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,59 @@
+"""
+Benchmark for the settlement planner.
+
+Run with ``python -m benchmarks.bench_settlements``; it prints the median time
+to plan settlements for random ledgers of increasing size.
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import statistics
+import time
+from decimal import Decimal
+from typing import Dict, List
+
+from utils import from_cents, plan_settlements
+
+
+def random_balances(members: int, seed: int = 0) -> Dict[int, Decimal]:
+    """Random net balances (in whole cents) that sum to zero."""
+    rng = random.Random(seed)
+    cents = [rng.randint(-500_000, 500_000) for _ in range(members - 1)]
+    cents.append(-sum(cents))
+    return {person_id: from_cents(value) for person_id, value in enumerate(cents, 1)}
+
+
+def time_plan(members: int, repeat: int) -> Dict[str, float]:
+    balances = random_balances(members)
+    timings: List[float] = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        transfers = plan_settlements(balances)
+        timings.append((time.perf_counter() - started) * 1000)
+    return {
+        "members": members,
+        "transfers": len(transfers),
+        "median_ms": statistics.median(timings),
+        "max_ms": max(timings),
+    }
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark plan_settlements().")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    for size in args.sizes:
+        result = time_plan(size, args.repeat)
+        print(
+            f"{result['members']:>6} members: {result['transfers']:>5} transfers, "
+            f"median {result['median_ms']:.2f} ms, max {result['max_ms']:.2f} ms"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
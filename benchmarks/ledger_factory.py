@@ -0,0 +1,114 @@
+"""
+Synthetic ledgers for benchmarks.
+
+``create_benchmark_app`` builds the same Flask app as ``server.py`` against a
+throwaway database, and ``generate_ledger`` fills it with members and random
+even-split expenses written through the models in batches, then rebuilds the
+balance ledger once so the stored tables match the history.
+"""
+
+from __future__ import annotations
+
+import os
+import random
+from datetime import date, timedelta
+from typing import Callable, Dict, Optional, Tuple
+
+from flask import Flask
+
+from bulk import insert_transactions
+from commands import register_commands
+from engine_profiles import DEFAULT_ENGINE_PROFILE, init_engine
+from ledger import rebuild_ledger, sync_ledger
+from metrics import register_metrics
+from models import Person, db
+from rooms import register_rooms
+from routes import register_routes
+from money import split_cents
+from utils import TransactionData, initialize_database
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GENERATE_BATCH_SIZE = 5000
+
+
+def create_benchmark_app(database_uri: str, engine_profile: str = DEFAULT_ENGINE_PROFILE) -> Flask:
+    """Return an app with routes registered and an initialised schema."""
+    app = Flask(
+        __name__,
+        root_path=ROOT,
+        instance_relative_config=True,
+        template_folder=os.path.join(ROOT, "templates"),
+    )
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_uri
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SECRET_KEY"] = "benchmark"
+    app.config["DB_ENGINE_PROFILE"] = engine_profile
+    init_engine(app)
+    register_metrics(app)
+    register_rooms(app)
+    register_routes(app)
+    register_commands(app)
+    with app.app_context():
+        initialize_database()
+        sync_ledger()
+    return app
+
+
+def generate_ledger(
+    transactions: int,
+    members: int = 20,
+    participants: Tuple[int, int] = (2, 5),
+    seed: int = 0,
+    start: date = date(2022, 1, 1),
+    days: int = 730,
+    progress: Optional[Callable[[int], None]] = None,
+) -> Dict[str, int]:
+    """
+    Add ``members`` members and ``transactions`` random expenses to the
+    database of the current app context.
+
+    Each expense picks a random payer, between ``participants[0]`` and
+    ``participants[1]`` participants (inclusive, capped at ``members``) and an
+    amount between 1.00 and 500.00, split evenly with ``split_cents``.
+    """
+    low, high = participants
+    if members <= 0 or transactions < 0 or not 1 <= low <= high:
+        raise ValueError("members, transactions and participants must be positive")
+    high = min(high, members)
+    low = min(low, high)
+
+    rng = random.Random(seed)
+    existing = Person.query.count()
+    people = [Person(name=f"Member {existing + i:05d}") for i in range(members)]
+    db.session.add_all(people)
+    db.session.commit()
+    member_ids = [person.id for person in people]
+
+    shares = 0
+    batch = []
+    for number in range(transactions):
+        amount_cents = rng.randint(100, 50_000)
+        chosen = rng.sample(member_ids, rng.randint(low, high))
+        batch.append(
+            TransactionData(
+                description=f"Expense {number}",
+                date=start + timedelta(days=rng.randrange(days)),
+                amount_cents=amount_cents,
+                comment="",
+                payer_id=rng.choice(member_ids),
+                shares=list(zip(chosen, split_cents(amount_cents, len(chosen)))),
+            )
+        )
+        shares += len(chosen)
+        if len(batch) >= GENERATE_BATCH_SIZE:
+            insert_transactions(batch)
+            db.session.commit()
+            batch.clear()
+            if progress:
+                progress(number + 1)
+    if batch:
+        insert_transactions(batch)
+        db.session.commit()
+
+    rebuild_ledger()
+    return {"members": members, "transactions": transactions, "shares": shares}
@@ -0,0 +1,250 @@
+"""
+Bulk create, update and delete of transactions.
+
+Items are validated against one preloaded member map (each chunk's splits
+allocated in one ``allocate_cents_batch`` call), written with batched
+``executemany`` statements and committed in chunks, so importers can send
+thousands of expenses in a single request. Each chunk also applies its
+ledger deltas with one update per affected member and pair.
+"""
+
+from __future__ import annotations
+
+from collections import defaultdict
+from datetime import date
+from typing import Dict, List, Mapping, Sequence, Tuple
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from compact import compact_columns
+from directory import member_directory
+from ledger import BalanceDeltas, PairDeltas, accumulate_deltas, apply_deltas
+from models import Transaction, TransactionShare, current_room_id, db, unpack_member_ids
+from money import split_cents
+from utils import TransactionData, payload_to_form, validate_transaction_forms
+
+DEFAULT_BULK_CHUNK_SIZE = 500
+BULK_ACTIONS = ("create", "update", "delete")
+
+
+def _item_error(index: int, message: str) -> Dict[str, object]:
+    return {"index": index, "status": "error", "error": message}
+
+
+def _transaction_id(item: Mapping[str, object]) -> int:
+    try:
+        return int(item["id"])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("A valid transaction id is required.") from None
+
+
+def _transaction_row(data: TransactionData) -> Dict[str, object]:
+    participant_ids, participant_count = compact_columns(data.split_mode, data.shares)
+    return {
+        "room_id": current_room_id(),
+        "description": data.description,
+        "date": data.date,
+        "amount_cents": data.amount_cents,
+        "comment": data.comment,
+        "payer_id": data.payer_id,
+        "participant_ids": participant_ids,
+        "participant_count": participant_count,
+    }
+
+
+def _load_existing(
+    transaction_ids: Sequence[int],
+) -> Dict[int, Tuple[int, object, List[Tuple[int, object]], date]]:
+    """
+    Return ``id -> (payer_id, amount_cents, shares, date)`` for the given
+    transactions of the current room.
+    """
+    if not transaction_ids:
+        return {}
+    existing = {}
+    for txn_id, payer_id, amount_cents, participant_ids, txn_date in db.session.execute(
+        select(
+            Transaction.id,
+            Transaction.payer_id,
+            Transaction.amount_cents,
+            Transaction.participant_ids,
+            Transaction.date,
+        ).where(Transaction.room_id == current_room_id(), Transaction.id.in_(transaction_ids))
+    ):
+        shares = []
+        if participant_ids is not None:
+            member_ids = unpack_member_ids(participant_ids)
+            shares = list(zip(member_ids, split_cents(amount_cents, len(member_ids))))
+        existing[txn_id] = (payer_id, amount_cents, shares, txn_date)
+    for txn_id, person_id, amount_cents in db.session.execute(
+        select(
+            TransactionShare.transaction_id,
+            TransactionShare.person_id,
+            TransactionShare.amount_cents,
+        ).where(TransactionShare.transaction_id.in_(list(existing)))
+    ):
+        existing[txn_id][2].append((person_id, amount_cents))
+    return existing
+
+
+def insert_transactions(data_list: Sequence[TransactionData]) -> List[int]:
+    """
+    Insert transactions and their shares with batched statements and return
+    the new ids in input order. The ledger is not touched.
+    """
+    if not data_list:
+        return []
+    created_ids = list(
+        db.session.scalars(
+            insert(Transaction).returning(Transaction.id, sort_by_parameter_order=True),
+            [_transaction_row(data) for data in data_list],
+        )
+    )
+    _insert_shares(dict(zip(created_ids, data_list)))
+    return created_ids
+
+
+def _insert_shares(shares_by_transaction: Dict[int, TransactionData]) -> None:
+    room_id = current_room_id()
+    share_rows = [
+        {
+            "transaction_id": txn_id,
+            "room_id": room_id,
+            "person_id": person_id,
+            "amount_cents": amount_cents,
+        }
+        for txn_id, data in shares_by_transaction.items()
+        if compact_columns(data.split_mode, data.shares)[0] is None
+        for person_id, amount_cents in data.shares
+    ]
+    if share_rows:
+        db.session.execute(insert(TransactionShare), share_rows)
+
+
+def _write_chunk(
+    creates: List[Tuple[int, TransactionData]],
+    updates: List[Tuple[int, int, TransactionData]],
+    deletes: List[Tuple[int, int]],
+    results: List[Dict[str, object]],
+) -> None:
+    balance_deltas: BalanceDeltas = defaultdict(int)
+    pair_deltas: PairDeltas = defaultdict(int)
+
+    existing = _load_existing(
+        [txn_id for _, txn_id, _ in updates] + [txn_id for _, txn_id in deletes]
+    )
+    for index, txn_id, *_ in updates + deletes:
+        if txn_id not in existing:
+            results[index] = _item_error(index, f"Transaction {txn_id} does not exist.")
+    updates = [entry for entry in updates if entry[1] in existing]
+    deletes = [entry for entry in deletes if entry[1] in existing]
+
+    touched_dates = []
+    for txn_id in [entry[1] for entry in updates + deletes]:
+        payer_id, amount_cents, shares, txn_date = existing[txn_id]
+        touched_dates.append(txn_date)
+        accumulate_deltas(balance_deltas, pair_deltas, payer_id, amount_cents, shares, sign=-1)
+
+    stale_ids = [entry[1] for entry in updates + deletes]
+    if stale_ids:
+        db.session.execute(
+            delete(TransactionShare).where(TransactionShare.transaction_id.in_(stale_ids))
+        )
+    if deletes:
+        db.session.execute(
+            delete(Transaction).where(Transaction.id.in_([txn_id for _, txn_id in deletes]))
+        )
+    if updates:
+        db.session.execute(
+            update(Transaction),
+            [{"id": txn_id, **_transaction_row(data)} for _, txn_id, data in updates],
+        )
+
+    created_ids = insert_transactions([data for _, data in creates])
+    _insert_shares({txn_id: data for _, txn_id, data in updates})
+
+    written = [data for _, data in creates] + [data for _, _, data in updates]
+    for data in written:
+        accumulate_deltas(balance_deltas, pair_deltas, data.payer_id, data.amount_cents, data.shares)
+        touched_dates.append(data.date)
+    apply_deltas(balance_deltas, pair_deltas, since=min(touched_dates, default=None))
+
+    for (index, _), txn_id in zip(creates, created_ids):
+        results[index] = {"index": index, "status": "created", "id": txn_id}
+    for index, txn_id, _ in updates:
+        results[index] = {"index": index, "status": "updated", "id": txn_id}
+    for index, txn_id in deletes:
+        results[index] = {"index": index, "status": "deleted", "id": txn_id}
+
+
+def apply_bulk_operations(
+    items: Sequence[object], chunk_size: int = DEFAULT_BULK_CHUNK_SIZE
+) -> List[Dict[str, object]]:
+    """
+    Create, update or delete transactions described by ``items`` and return one
+    result per item, in order.
+
+    Each item is a JSON object with an ``action`` (``create`` by default,
+    ``update`` or ``delete``), an ``id`` for updates and deletes, and the same
+    fields as ``POST /api/transactions`` for creates and updates. Invalid items
+    are reported and skipped; a database error rolls back and fails only its
+    own chunk.
+    """
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be a positive integer")
+
+    members_by_id = member_directory().names
+    results: List[Dict[str, object]] = [None] * len(items)
+
+    for start in range(0, len(items), chunk_size):
+        creates: List[Tuple[int, TransactionData]] = []
+        updates: List[Tuple[int, int, TransactionData]] = []
+        deletes: List[Tuple[int, int]] = []
+        # (index, transaction id or None for creates, form) awaiting validation
+        forms: List[Tuple[int, int | None, Dict]] = []
+        seen_ids = set()
+
+        for index in range(start, min(start + chunk_size, len(items))):
+            item = items[index]
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError("Each item must be a JSON object.")
+                action = item.get("action", "create")
+                if action not in BULK_ACTIONS:
+                    raise ValueError(f"Unknown action {action!r}.")
+                if action != "create":
+                    txn_id = _transaction_id(item)
+                    if txn_id in seen_ids:
+                        raise ValueError(
+                            f"Transaction {txn_id} appears more than once in this chunk."
+                        )
+                    seen_ids.add(txn_id)
+                if action == "delete":
+                    deletes.append((index, txn_id))
+                    continue
+                forms.append((index, txn_id if action == "update" else None, payload_to_form(item)))
+            except ValueError as exc:
+                results[index] = _item_error(index, str(exc))
+
+        validated = validate_transaction_forms([form for _, _, form in forms], members_by_id)
+        for (index, txn_id, _), data in zip(forms, validated):
+            if isinstance(data, ValueError):
+                results[index] = _item_error(index, str(data))
+            elif txn_id is None:
+                creates.append((index, data))
+            else:
+                updates.append((index, txn_id, data))
+
+        try:
+            _write_chunk(creates, updates, deletes, results)
+            db.session.commit()
+        except SQLAlchemyError as exc:
+            db.session.rollback()
+            pending = [entry[0] for entry in creates + updates + deletes]
+            for index in pending:
+                results[index] = _item_error(
+                    index, f"Chunk could not be written: {exc.__class__.__name__}"
+                )
+
+    return results
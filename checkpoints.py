@@ -0,0 +1,262 @@
+"""
+Balance checkpoints for point-in-time queries.
+
+``ledger_as_of(day)`` returns the balances and pairwise debts after every
+expense dated up to ``day`` from the latest checkpoint on or before ``day``
+plus grouped sums over the transactions after it, so an as-of query reads
+one period of history instead of all of it.
+
+A checkpoint is taken at the end of every ``LEDGER_CHECKPOINT_INTERVAL``
+(``day``, ``week`` or ``month``, ``month`` by default) that had expenses,
+once the period is over. Missing checkpoints are built on demand from the
+previous one in a single grouped pass, or ahead of time with
+``flask ledger checkpoint``. Every ledger write drops the checkpoints at or
+after the earliest date it touches (``ledger.invalidate_checkpoints``), so a
+back-dated edit never leaves a stale snapshot behind; checkpoints built while
+a write lands are discarded (the room's ledger version changed meanwhile).
+"""
+
+from __future__ import annotations
+
+import itertools
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from flask import current_app, has_app_context
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from compact import compact_pair_totals_by_date
+from ledger import BalanceDeltas, PairDeltas, current_ledger_version
+from models import (
+    CheckpointBalance,
+    CheckpointPairDebt,
+    LedgerCheckpoint,
+    LedgerState,
+    Transaction,
+    TransactionShare,
+    current_room_id,
+    db,
+)
+from money import from_cents
+from stats import bucket_start
+
+CHECKPOINT_INTERVALS = ("day", "week", "month")
+DEFAULT_CHECKPOINT_INTERVAL = "month"
+
+
+class LedgerSnapshot(NamedTuple):
+    """Balances and gross pairwise debts in cents after every expense up to ``through``."""
+
+    through: date
+    balances: BalanceDeltas
+    pair_debts: PairDeltas
+
+    def net_debts(self) -> List[Tuple[int, int, Decimal]]:
+        """``(debtor_id, creditor_id, amount)`` for every pair with a positive net debt."""
+        debts = []
+        for (debtor_id, creditor_id), cents in sorted(self.pair_debts.items()):
+            net = cents - self.pair_debts.get((creditor_id, debtor_id), 0)
+            if net > 0:
+                debts.append((debtor_id, creditor_id, from_cents(net)))
+        return debts
+
+
+def checkpoint_interval() -> str:
+    interval = (
+        current_app.config.get("LEDGER_CHECKPOINT_INTERVAL", DEFAULT_CHECKPOINT_INTERVAL)
+        if has_app_context()
+        else DEFAULT_CHECKPOINT_INTERVAL
+    )
+    if interval not in CHECKPOINT_INTERVALS:
+        raise ValueError(
+            f"LEDGER_CHECKPOINT_INTERVAL must be one of {', '.join(CHECKPOINT_INTERVALS)}"
+        )
+    return interval
+
+
+def period_end(day: date, interval: str) -> date:
+    """Last day of the day/week/month period containing ``day``."""
+    try:
+        if interval == "month":
+            next_month = (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+            return next_month - timedelta(days=1)
+        return bucket_start(day, interval) + timedelta(days=6 if interval == "week" else 0)
+    except OverflowError:
+        # The period runs past the last representable day.
+        return date.max
+
+
+def last_closed_period_end(day: date, interval: str) -> Optional[date]:
+    """Latest period end on or before ``day``; ``None`` before the first one."""
+    end = period_end(day, interval)
+    if end == day:
+        return end
+    start = bucket_start(day, interval)
+    return start - timedelta(days=1) if start > date.min else None
+
+
+def _deltas_by_day(
+    after: Optional[date], through: date
+) -> Dict[date, Tuple[BalanceDeltas, PairDeltas]]:
+    """
+    Ledger change per transaction date in ``(after, through]`` for the current
+    room, from grouped sums instead of individual transactions.
+    """
+    conditions = [Transaction.room_id == current_room_id(), Transaction.date <= through]
+    if after is not None:
+        conditions.append(Transaction.date > after)
+
+    days: Dict[date, Tuple[BalanceDeltas, PairDeltas]] = {}
+
+    def deltas(day: date) -> Tuple[BalanceDeltas, PairDeltas]:
+        if day not in days:
+            days[day] = (defaultdict(int), defaultdict(int))
+        return days[day]
+
+    paid = (
+        db.session.query(Transaction.date, Transaction.payer_id, func.sum(Transaction.amount_cents))
+        .filter(*conditions)
+        .group_by(Transaction.date, Transaction.payer_id)
+    )
+    for day, payer_id, cents in paid:
+        deltas(day)[0][payer_id] += int(cents)
+
+    owed = (
+        db.session.query(
+            Transaction.date,
+            TransactionShare.person_id,
+            Transaction.payer_id,
+            func.sum(TransactionShare.amount_cents),
+        )
+        .join(Transaction, TransactionShare.transaction_id == Transaction.id)
+        # Shares are reached from the room's transactions by transaction id.
+        .filter(*conditions)
+        .group_by(Transaction.date, TransactionShare.person_id, Transaction.payer_id)
+    )
+    for day, person_id, payer_id, cents in itertools.chain(
+        owed, compact_pair_totals_by_date(*conditions)
+    ):
+        cents = int(cents)
+        balance_deltas, pair_deltas = deltas(day)
+        balance_deltas[person_id] -= cents
+        if person_id != payer_id:
+            pair_deltas[(person_id, payer_id)] += cents
+    return days
+
+
+def _add(snapshot_balances: BalanceDeltas, snapshot_pairs: PairDeltas, deltas) -> None:
+    balance_deltas, pair_deltas = deltas
+    for person_id, cents in balance_deltas.items():
+        snapshot_balances[person_id] += cents
+    for pair, cents in pair_deltas.items():
+        snapshot_pairs[pair] += cents
+
+
+def _latest_checkpoint(day: date) -> Optional[LedgerCheckpoint]:
+    return (
+        LedgerCheckpoint.query.filter(
+            LedgerCheckpoint.room_id == current_room_id(), LedgerCheckpoint.through <= day
+        )
+        .order_by(LedgerCheckpoint.through.desc())
+        .first()
+    )
+
+
+def _load(checkpoint: Optional[LedgerCheckpoint]) -> Tuple[BalanceDeltas, PairDeltas]:
+    balances: BalanceDeltas = defaultdict(int)
+    pairs: PairDeltas = defaultdict(int)
+    if checkpoint is not None:
+        for row in checkpoint.balances:
+            balances[row.person_id] = row.balance_cents
+        for row in checkpoint.pair_debts:
+            pairs[(row.debtor_id, row.creditor_id)] = row.amount_cents
+    return balances, pairs
+
+
+def create_checkpoints(until: Optional[date] = None) -> List[date]:
+    """
+    Create the current room's missing checkpoints for periods that ended on
+    or before ``until`` (and before today). Returns the new checkpoint dates.
+    """
+    interval = checkpoint_interval()
+    limits = [last_closed_period_end(date.today() - timedelta(days=1), interval)]
+    if until is not None:
+        limits.append(last_closed_period_end(until, interval))
+    if None in limits:
+        return []
+    limit = min(limits)
+
+    room_id = current_room_id()
+    version = current_ledger_version(room_id)
+    latest = _latest_checkpoint(limit)
+    if latest is not None and latest.through == limit:
+        return []
+    balances, pairs = _load(latest)
+    by_period: Dict[date, List[Tuple[BalanceDeltas, PairDeltas]]] = defaultdict(list)
+    for day, deltas in _deltas_by_day(latest.through if latest else None, limit).items():
+        by_period[period_end(day, interval)].append(deltas)
+
+    created = []
+    for through in sorted(by_period):
+        for deltas in by_period[through]:
+            _add(balances, pairs, deltas)
+        checkpoint = LedgerCheckpoint(room_id=room_id, through=through)
+        checkpoint.balances = [
+            CheckpointBalance(person_id=person_id, balance_cents=cents)
+            for person_id, cents in balances.items()
+            if cents
+        ]
+        checkpoint.pair_debts = [
+            CheckpointPairDebt(debtor_id=debtor_id, creditor_id=creditor_id, amount_cents=cents)
+            for (debtor_id, creditor_id), cents in pairs.items()
+            if cents
+        ]
+        db.session.add(checkpoint)
+        created.append(through)
+    if not created:
+        # Nothing to write: reads must not take the writers' lock or commit.
+        return []
+    try:
+        db.session.flush()
+        # A write that landed while the checkpoints were built bumped the
+        # version; the lock keeps new writes out until the commit.
+        latest_version = db.session.execute(
+            select(LedgerState.version).where(LedgerState.id == room_id).with_for_update()
+        ).scalar()
+        if (latest_version or 0) != version:
+            db.session.rollback()
+            return []
+        db.session.commit()
+    except (IntegrityError, OperationalError):
+        # Another worker created the same checkpoints first, or a concurrent
+        # write holds the database.
+        db.session.rollback()
+        return []
+    return created
+
+
+def ledger_before(day: date) -> LedgerSnapshot:
+    """The current room's ledger after every expense dated before ``day``."""
+    if day == date.min:
+        return LedgerSnapshot(day, {}, {})
+    return ledger_as_of(day - timedelta(days=1))
+
+
+def ledger_as_of(day: date) -> LedgerSnapshot:
+    """
+    Balances and pairwise debts of the current room after every expense
+    dated up to ``day``: the latest checkpoint plus the transactions after it.
+    """
+    create_checkpoints(day)
+    checkpoint = _latest_checkpoint(day)
+    balances, pairs = _load(checkpoint)
+    for deltas in _deltas_by_day(checkpoint.through if checkpoint else None, day).values():
+        _add(balances, pairs, deltas)
+    return LedgerSnapshot(
+        day,
+        {person_id: cents for person_id, cents in balances.items() if cents},
+        {pair: cents for pair, cents in pairs.items() if cents},
+    )
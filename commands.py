@@ -0,0 +1,160 @@
+"""Flask CLI commands for ledger maintenance, imports and schema upgrades."""
+
+from __future__ import annotations
+
+import functools
+import os
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from checkpoints import create_checkpoints
+from engine_profiles import engine_report
+from importer import DEFAULT_IMPORT_BATCH_SIZE, IMPORT_FORMATS, import_transactions, read_records
+from ledger import check_consistency, rebuild_ledger
+from migrations import applied_versions, pending_migrations, upgrade_database
+from models import DEFAULT_ROOM_ID, Room, db, use_room
+
+ledger_cli = AppGroup("ledger", help="Inspect and maintain the balance ledger.")
+schema_cli = AppGroup("schema", help="Inspect and upgrade the database schema.")
+engine_cli = AppGroup("engine", help="Inspect the database engine configuration.")
+
+
+def in_room(command):
+    """Add a ``--room`` option and run ``command`` with that room selected."""
+
+    @click.option(
+        "--room",
+        "room_id",
+        type=int,
+        default=DEFAULT_ROOM_ID,
+        show_default=True,
+        help="Id of the room to work on.",
+    )
+    @functools.wraps(command)
+    def wrapper(room_id, **kwargs):
+        if db.session.get(Room, room_id) is None:
+            raise click.BadParameter(f"Room {room_id} does not exist.", param_hint="--room")
+        with use_room(room_id):
+            return command(**kwargs)
+
+    return wrapper
+
+
+@ledger_cli.command("check")
+@in_room
+def check_command():
+    """Recompute balances from history and report any drift."""
+    drift = check_consistency()
+    if not drift:
+        click.echo("Ledger is consistent.")
+        return
+    for entry in drift:
+        if entry["kind"] == "balance":
+            subject = f"person {entry['person_id']}"
+        else:
+            subject = f"debt {entry['debtor_id']} -> {entry['creditor_id']}"
+        click.echo(
+            f"{subject}: stored {entry['stored']} "
+            f"expected {entry['expected']} (off by {entry['difference']})"
+        )
+    raise SystemExit(1)
+
+
+@ledger_cli.command("rebuild")
+@in_room
+def rebuild_command():
+    """Recompute the stored ledger from the transaction history."""
+    rebuild_ledger()
+    click.echo("Ledger rebuilt.")
+
+
+@ledger_cli.command("checkpoint")
+@click.option(
+    "--through",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    help="Last day to cover (defaults to the last finished period).",
+)
+@in_room
+def checkpoint_command(through):
+    """Create the missing balance checkpoints for finished periods."""
+    created = create_checkpoints(through.date() if through else None)
+    click.echo(f"Created {len(created)} checkpoints.")
+    if created:
+        click.echo(f"Latest covers expenses up to {created[-1].isoformat()}.")
+
+
+@ledger_cli.command("import")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--format",
+    "file_format",
+    type=click.Choice(IMPORT_FORMATS),
+    help="Input format (defaults to the file extension).",
+)
+@click.option(
+    "--batch-size",
+    default=DEFAULT_IMPORT_BATCH_SIZE,
+    show_default=True,
+    help="Rows written per batch.",
+)
+@in_room
+def import_command(path, file_format, batch_size):
+    """Import historical expenses from a CSV or NDJSON file."""
+    if file_format is None:
+        extension = os.path.splitext(path)[1].lstrip(".").lower()
+        file_format = "ndjson" if extension in ("ndjson", "jsonl") else "csv"
+
+    def report(stats):
+        click.echo(
+            f"  {stats['imported']} rows imported "
+            f"({stats['rows_per_second']:,.0f} rows/sec)"
+        )
+
+    with open(path, newline="", encoding="utf-8") as stream:
+        stats = import_transactions(
+            read_records(stream, file_format), batch_size=batch_size, progress=report
+        )
+
+    for line_number, message in stats["errors"][:20]:
+        click.echo(f"line {line_number}: {message}", err=True)
+    if len(stats["errors"]) > 20:
+        click.echo(f"... and {len(stats['errors']) - 20} more errors", err=True)
+    click.echo(
+        f"Imported {stats['imported']} of {stats['read']} rows "
+        f"({stats['shares']} shares) via {stats['method']} in {stats['seconds']:.2f}s "
+        f"- {stats['rows_per_second']:,.0f} rows/sec, {len(stats['errors'])} rejected."
+    )
+
+
+@schema_cli.command("status")
+def schema_status_command():
+    """Show applied and pending schema migrations."""
+    applied = applied_versions()
+    click.echo(f"Applied migrations: {', '.join(map(str, applied)) or 'none'}")
+    for item in pending_migrations():
+        click.echo(f"Pending {item.version}: {item.description}")
+
+
+@schema_cli.command("upgrade")
+def schema_upgrade_command():
+    """Create missing tables and apply pending migrations."""
+    ran = upgrade_database()
+    for item in ran:
+        click.echo(f"Applied {item.version}: {item.description}")
+    click.echo("Schema is up to date.")
+
+
+@engine_cli.command("report")
+def engine_report_command():
+    """Show the engine profile and the settings the database reports."""
+    click.echo(f"Profile: {current_app.config.get('DB_ENGINE_PROFILE', 'default')}")
+    for name, value in engine_report().items():
+        click.echo(f"  {name}: {value}")
+
+
+def register_commands(app):
+    app.cli.add_command(ledger_cli)
+    app.cli.add_command(schema_cli)
+    app.cli.add_command(engine_cli)
@@ -0,0 +1,125 @@
+"""
+Compact storage for even splits.
+
+With ``COMPACT_EVEN_SPLITS`` enabled, an evenly split expense stores its
+participants as a packed id list on ``Transaction`` (``participant_ids`` and
+``participant_count``) instead of one ``TransactionShare`` row each. Shares
+are derived on read with the usual even-split rule (``money.split_cents``:
+floor share, the leftover cents go one each to the first participants).
+
+The balance engines do not need to expand anything: one ``GROUP BY
+participant_ids`` and leftover-cent count (plus ``payer_id`` for pairwise
+debts) returns the summed floor shares and the number of expenses, from
+which every participant's total follows. That pays off when the same groups
+of people keep sharing expenses, as in a household; with mostly distinct
+participant lists it costs about as much as reading share rows. Existing share rows keep working side by side.
+"""
+
+from __future__ import annotations
+
+from datetime import date
+from typing import Iterator, List, Optional, Tuple
+
+from flask import current_app, has_app_context
+from sqlalchemy import case, func
+
+from models import Transaction, current_room_id, db, pack_member_ids, unpack_member_ids
+
+
+def compact_splits_enabled() -> bool:
+    return has_app_context() and bool(current_app.config.get("COMPACT_EVEN_SPLITS", False))
+
+
+def compact_columns(
+    split_mode: str, shares: List[Tuple[int, int]]
+) -> Tuple[Optional[str], Optional[int]]:
+    """
+    Return ``(participant_ids, participant_count)`` for a new expense: packed
+    values for even splits when compact storage is on, ``(None, None)`` when
+    share rows should be written.
+    """
+    if split_mode != "even" or not compact_splits_enabled():
+        return None, None
+    return pack_member_ids(person_id for person_id, _ in shares), len(shares)
+
+
+def _floor_share():
+    """SQL for the floor of the even share of one compact transaction."""
+    return Transaction.amount_cents // Transaction.participant_count
+
+
+def _leftover_cents():
+    """SQL for the cents of one compact transaction that the floor shares leave over."""
+    return Transaction.amount_cents % Transaction.participant_count
+
+
+def _member_position(person_id: int):
+    """SQL for the 0-based position of ``person_id`` in a packed list that contains them."""
+    packed = Transaction.participant_ids
+    locate = func.strpos if db.engine.dialect.name == "postgresql" else func.instr
+    prefix = func.substr(packed, 1, locate(packed, f",{int(person_id)},"))
+    # Every member is preceded by one comma.
+    return func.length(prefix) - func.length(func.replace(prefix, ",", "")) - 1
+
+
+def compact_share_cents(person_id: int):
+    """SQL for ``person_id``'s share of a compact transaction that lists them."""
+    return _floor_share() + case((_member_position(person_id) < _leftover_cents(), 1), else_=0)
+
+
+def _grouped_totals(columns=(), conditions=()):
+    """
+    Summed floor shares and expense counts of the room's compact rows
+    (matching ``conditions``) per participant set, leftover cents and
+    ``columns``.
+    """
+    leftover = _leftover_cents()
+    return (
+        db.session.query(
+            Transaction.participant_ids,
+            leftover,
+            *columns,
+            func.sum(_floor_share()),
+            func.count(),
+        )
+        .filter(
+            Transaction.room_id == current_room_id(),
+            Transaction.participant_ids.isnot(None),
+            *conditions,
+        )
+        .group_by(Transaction.participant_ids, leftover, *columns)
+    )
+
+
+def _participant_totals(packed: str, leftover, floor_total, expenses) -> Iterator[Tuple[int, int]]:
+    leftover, floor_total, expenses = int(leftover), int(floor_total), int(expenses)
+    for position, person_id in enumerate(unpack_member_ids(packed)):
+        yield person_id, floor_total + (expenses if position < leftover else 0)
+
+
+def compact_share_totals(*conditions) -> Iterator[Tuple[int, int]]:
+    """Yield ``(person_id, cents)`` owed across all compact even splits matching ``conditions``."""
+    for packed, leftover, floor_total, expenses in _grouped_totals(conditions=conditions):
+        yield from _participant_totals(packed, leftover, floor_total, expenses)
+
+
+def compact_pair_totals(*conditions) -> Iterator[Tuple[int, int, int]]:
+    """
+    Yield ``(person_id, payer_id, cents)``: the total each participant owes
+    each payer across all compact even splits matching ``conditions`` (the
+    payer's own share included).
+    """
+    for packed, leftover, payer_id, floor_total, expenses in _grouped_totals(
+        (Transaction.payer_id,), conditions
+    ):
+        for person_id, cents in _participant_totals(packed, leftover, floor_total, expenses):
+            yield person_id, payer_id, cents
+
+
+def compact_pair_totals_by_date(*conditions) -> Iterator[Tuple[date, int, int, int]]:
+    """Like :func:`compact_pair_totals`, per transaction date: ``(date, person_id, payer_id, cents)``."""
+    for packed, leftover, day, payer_id, floor_total, expenses in _grouped_totals(
+        (Transaction.date, Transaction.payer_id), conditions
+    ):
+        for person_id, cents in _participant_totals(packed, leftover, floor_total, expenses):
+            yield day, person_id, payer_id, cents
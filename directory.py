@@ -0,0 +1,111 @@
+"""
+Member directory cache.
+
+Most pages and API calls need the list of members sorted by name, and some
+need it more than once per request. The directory keeps a compact id -> name
+map plus the sorted list for each room, shared within a request through ``g``
+and across requests in a worker through ``app.extensions``. A room's copy is
+dropped whenever a commit adds, renames or deletes one of its members, and
+the worker-wide copy is keyed on the room's ledger version, which every
+member write bumps, so a change made by another worker is seen on the next
+request.
+"""
+
+from __future__ import annotations
+
+import threading
+from typing import Dict, List, NamedTuple, Optional
+
+from flask import current_app, g, has_app_context
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from models import LedgerState, Person, current_room_id, db
+
+_MEMBERS_CHANGED = "members_changed"
+_directory_lock = threading.Lock()
+
+
+class MemberEntry(NamedTuple):
+    """Lightweight stand-in for ``Person`` exposing ``id`` and ``name``."""
+
+    id: int
+    name: str
+
+
+class MemberDirectory(NamedTuple):
+    members: List[MemberEntry]
+    names: Dict[int, str]
+
+    def get(self, person_id: int) -> MemberEntry | None:
+        name = self.names.get(person_id)
+        return MemberEntry(person_id, name) if name is not None else None
+
+
+def _load_directory(room_id: int) -> MemberDirectory:
+    members = [
+        MemberEntry(person_id, name)
+        for person_id, name in db.session.query(Person.id, Person.name)
+        .filter(Person.room_id == room_id)
+        .order_by(Person.name)
+    ]
+    return MemberDirectory(members, {member.id: member.name for member in members})
+
+
+def member_directory() -> MemberDirectory:
+    """Return the current room's member directory, loading it at most once per request."""
+    room_id = current_room_id()
+    per_request = g.setdefault("member_directory", {})
+    directory = per_request.get(room_id)
+    if directory is not None:
+        return directory
+
+    # Same lookup as ``ledger.current_ledger_version``; ledger imports this module.
+    version = (
+        db.session.execute(select(LedgerState.version).where(LedgerState.id == room_id)).scalar()
+        or 0
+    )
+    with _directory_lock:
+        cached = current_app.extensions.get("member_directory", {}).get(room_id)
+    if cached is not None and cached[0] == version:
+        directory = cached[1]
+    else:
+        directory = _load_directory(room_id)
+        with _directory_lock:
+            current_app.extensions.setdefault("member_directory", {})[room_id] = (
+                version,
+                directory,
+            )
+
+    per_request[room_id] = directory
+    return directory
+
+
+def invalidate_member_directory(room_id: Optional[int] = None) -> None:
+    """Drop the cached directory of ``room_id`` (the current room by default)."""
+    if not has_app_context():
+        return
+    room_id = room_id or current_room_id()
+    with _directory_lock:
+        current_app.extensions.get("member_directory", {}).pop(room_id, None)
+    g.get("member_directory", {}).pop(room_id, None)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_member_changes(session, flush_context) -> None:
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Person):
+            session.info.setdefault(_MEMBERS_CHANGED, set()).add(
+                obj.room_id or current_room_id()
+            )
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session) -> None:
+    for room_id in session.info.pop(_MEMBERS_CHANGED, ()):
+        invalidate_member_directory(room_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_member_changes(session) -> None:
+    session.info.pop(_MEMBERS_CHANGED, None)
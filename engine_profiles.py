@@ -0,0 +1,154 @@
+"""
+Database engine profiles.
+
+``DB_ENGINE_PROFILE`` picks one of the named profiles below. On SQLite a
+profile is a set of pragmas run on every new connection (WAL journal,
+``synchronous``, ``mmap_size``, ``cache_size``, ``busy_timeout``); on
+PostgreSQL it is the connection pool configuration (size, overflow, recycle
+and pre-ping). ``default`` leaves the driver and library defaults alone.
+
+Use ``init_engine(app)`` in place of ``db.init_app(app)`` so pool options are
+set before the engine exists; ``engine_report()`` returns the settings the
+engine actually ended up with.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, NamedTuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from models import db
+
+DEFAULT_ENGINE_PROFILE = "web"
+SQLITE_SYNCHRONOUS = {0: "OFF", 1: "NORMAL", 2: "FULL", 3: "EXTRA"}
+REPORTED_PRAGMAS = ("journal_mode", "synchronous", "mmap_size", "cache_size", "busy_timeout")
+
+
+class EngineProfile(NamedTuple):
+    name: str
+    description: str
+    sqlite_pragmas: Dict[str, object]
+    postgresql_pool: Dict[str, object]
+
+
+ENGINE_PROFILES = {
+    profile.name: profile
+    for profile in (
+        EngineProfile(
+            "default",
+            "Driver defaults: rollback journal, default pool.",
+            {},
+            {},
+        ),
+        EngineProfile(
+            "web",
+            "Concurrent readers and one writer: WAL, fsync at checkpoints only.",
+            {
+                "journal_mode": "WAL",
+                "synchronous": "NORMAL",
+                "mmap_size": 256 * 1024 * 1024,
+                "cache_size": -64 * 1024,  # negative means KiB
+                "busy_timeout": 5000,
+            },
+            {
+                "pool_size": 10,
+                "max_overflow": 20,
+                "pool_recycle": 1800,
+                "pool_pre_ping": True,
+                "pool_timeout": 10,
+            },
+        ),
+        EngineProfile(
+            "durable",
+            "WAL with an fsync on every commit; a small pool.",
+            {
+                "journal_mode": "WAL",
+                "synchronous": "FULL",
+                "cache_size": -16 * 1024,
+                "busy_timeout": 10000,
+            },
+            {
+                "pool_size": 5,
+                "max_overflow": 5,
+                "pool_recycle": 900,
+                "pool_pre_ping": True,
+                "pool_timeout": 30,
+            },
+        ),
+    )
+}
+
+
+def engine_profile(name: str | None) -> EngineProfile:
+    profile = ENGINE_PROFILES.get((name or DEFAULT_ENGINE_PROFILE).strip().lower())
+    if profile is None:
+        raise ValueError(
+            f"Unknown engine profile {name!r}; choose one of {', '.join(ENGINE_PROFILES)}."
+        )
+    return profile
+
+
+def engine_options(profile: EngineProfile, database_uri: str) -> Dict[str, object]:
+    """Keyword arguments for ``create_engine`` under ``profile``."""
+    if make_url(database_uri).get_backend_name() == "postgresql":
+        return dict(profile.postgresql_pool)
+    return {}
+
+
+def apply_sqlite_pragmas(engine, profile: EngineProfile) -> None:
+    """Run the profile's pragmas on every new connection of a SQLite ``engine``."""
+    if engine.dialect.name != "sqlite" or not profile.sqlite_pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in profile.sqlite_pragmas.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+        finally:
+            cursor.close()
+
+
+def init_engine(app) -> EngineProfile:
+    """
+    Set up ``db`` for ``app`` with the profile named by ``DB_ENGINE_PROFILE``.
+    Explicit ``SQLALCHEMY_ENGINE_OPTIONS`` win over the profile's pool options.
+    """
+    profile = engine_profile(app.config.get("DB_ENGINE_PROFILE"))
+    app.config["DB_ENGINE_PROFILE"] = profile.name
+    options = engine_options(profile, app.config["SQLALCHEMY_DATABASE_URI"])
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        **options,
+        **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}),
+    }
+    db.init_app(app)
+
+    with app.app_context():
+        apply_sqlite_pragmas(db.engine, profile)
+    return profile
+
+
+def engine_report() -> Dict[str, object]:
+    """Effective settings of the current app's engine, read back from the database."""
+    engine = db.engine
+    report: Dict[str, object] = {"backend": engine.dialect.name, "pool": type(engine.pool).__name__}
+    if engine.dialect.name == "sqlite":
+        with engine.connect() as connection:
+            for name in REPORTED_PRAGMAS:
+                value = connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+                if name == "synchronous":
+                    value = SQLITE_SYNCHRONOUS.get(value, value)
+                report[name] = value
+    else:
+        pool = engine.pool
+        report.update(
+            pool_size=getattr(pool, "size", lambda: None)(),
+            max_overflow=getattr(pool, "_max_overflow", None),
+            pool_recycle=getattr(pool, "_recycle", None),
+            pool_pre_ping=getattr(pool, "_pre_ping", None),
+            pool_timeout=getattr(pool, "_timeout", None),
+        )
+    return report
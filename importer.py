@@ -0,0 +1,276 @@
+"""
+Import historical expenses from CSV or NDJSON files.
+
+Every record goes through the same validation and splitting rules as the
+expense form (``validate_transaction_forms``, which splits a whole batch in
+one ``allocate_cents_batch`` call). Valid rows are written in
+batches inside one database transaction: on PostgreSQL through ``COPY`` into
+temporary staging tables followed by set-based inserts, elsewhere through
+batched ``executemany``. The balance ledger is updated once at the end.
+
+CSV files need the columns ``date``, ``description``, ``amount``, ``payer``
+and ``participants`` (``;``-separated), plus an optional ``comment``,
+``split_mode`` and ``split_values`` (``;``-separated, in participant order).
+Members can be given by id or by (case-insensitive) name. NDJSON lines use
+the same fields, or the ``POST /api/transactions`` names (``payer_id``,
+``participant_ids``), with participants as a JSON list.
+"""
+
+from __future__ import annotations
+
+import csv
+import io
+import json
+import time
+from collections import defaultdict
+from datetime import date
+from typing import Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+from bulk import insert_transactions
+from compact import compact_columns
+from directory import member_directory
+from ledger import BalanceDeltas, PairDeltas, accumulate_deltas, apply_deltas
+from models import current_room_id, db
+from utils import TransactionData, require_text_fields, validate_transaction_forms
+
+DEFAULT_IMPORT_BATCH_SIZE = 5000
+IMPORT_FORMATS = ("csv", "ndjson")
+
+
+def read_records(stream: Iterable[str], file_format: str) -> Iterator[Tuple[int, Dict]]:
+    """Yield ``(line_number, record)`` pairs from a CSV or NDJSON text stream."""
+    if file_format == "csv":
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif file_format == "ndjson":
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as exc:
+                yield line_number, {"_error": f"Invalid JSON: {exc.msg}"}
+                continue
+            yield line_number, record
+    else:
+        raise ValueError(f"Unsupported format {file_format!r}.")
+
+
+def _resolve_member(raw, ids_by_name: Mapping[str, int]) -> str:
+    value = str(raw).strip()
+    if value.isdigit():
+        return value
+    try:
+        return str(ids_by_name[value.lower()])
+    except KeyError:
+        raise ValueError(f"Unknown member {value!r}.") from None
+
+
+def record_to_form(record: Mapping[str, object], ids_by_name: Mapping[str, int]) -> Dict:
+    """
+    Map an import record onto the fields ``validate_transaction_form`` expects.
+    Records or fields of the wrong JSON type raise ``ValueError``.
+    """
+    if not isinstance(record, dict):
+        raise ValueError("Each record must be a JSON object.")
+    if "_error" in record:
+        raise ValueError(record["_error"])
+    require_text_fields(record, ("description", "date", "comment", "split_mode"))
+
+    payer = record.get("payer_id") or record.get("payer")
+    participants = record.get("participant_ids") or record.get("participants") or []
+    if isinstance(participants, str):
+        participants = [part for part in participants.split(";") if part.strip()]
+    elif not isinstance(participants, list):
+        participants = [participants]
+
+    form = {
+        "description": record.get("description") or "",
+        "date": record.get("date") or "",
+        "amount": str(record.get("amount") or ""),
+        "comment": record.get("comment") or "",
+        "payer_id": _resolve_member(payer, ids_by_name) if payer else "",
+        "participants": [_resolve_member(member, ids_by_name) for member in participants],
+        "split_mode": record.get("split_mode") or "",
+    }
+
+    split_values = record.get("split_values") or []
+    if isinstance(split_values, str):
+        split_values = [value for value in split_values.split(";") if value.strip()]
+    elif not isinstance(split_values, (list, dict)):
+        raise ValueError("split_values must be a list, an object or a ';'-separated string.")
+    if isinstance(split_values, dict):
+        pairs = [
+            (_resolve_member(member, ids_by_name), value)
+            for member, value in split_values.items()
+        ]
+    else:
+        pairs = zip(form["participants"], split_values)
+    for member_id, value in pairs:
+        form[f"split_value_{member_id}"] = str(value)
+    return form
+
+
+def _copy_batch(batch: List[TransactionData]) -> None:
+    """Write a batch into the current room on PostgreSQL via COPY into staging tables."""
+    room_id = current_room_id()
+    connection = db.session.connection()
+    raw = connection.connection.dbapi_connection
+    cursor = raw.cursor()
+    try:
+        cursor.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS import_transactions ("
+            " seq bigint, id bigint, date date, description text,"
+            " amount_cents bigint, comment text, payer_id integer,"
+            " participant_ids text, participant_count integer"
+            ") ON COMMIT DROP"
+        )
+        cursor.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS import_shares ("
+            " seq bigint, person_id integer, amount_cents bigint"
+            ") ON COMMIT DROP"
+        )
+
+        transactions_buffer = io.StringIO()
+        shares_buffer = io.StringIO()
+        transactions_writer = csv.writer(transactions_buffer)
+        shares_writer = csv.writer(shares_buffer)
+        for seq, data in enumerate(batch):
+            participant_ids, participant_count = compact_columns(data.split_mode, data.shares)
+            transactions_writer.writerow(
+                [
+                    seq,
+                    data.date.isoformat(),
+                    data.description,
+                    data.amount_cents,
+                    data.comment,
+                    data.payer_id,
+                    participant_ids,
+                    participant_count,
+                ]
+            )
+            if participant_ids is not None:
+                continue
+            for person_id, amount_cents in data.shares:
+                shares_writer.writerow([seq, person_id, amount_cents])
+        transactions_buffer.seek(0)
+        shares_buffer.seek(0)
+
+        cursor.copy_expert(
+            "COPY import_transactions"
+            " (seq, date, description, amount_cents, comment, payer_id,"
+            " participant_ids, participant_count)"
+            " FROM STDIN WITH (FORMAT csv)",
+            transactions_buffer,
+        )
+        cursor.copy_expert(
+            "COPY import_shares (seq, person_id, amount_cents) FROM STDIN WITH (FORMAT csv)",
+            shares_buffer,
+        )
+        cursor.execute(
+            "UPDATE import_transactions"
+            " SET id = nextval(pg_get_serial_sequence('transactions', 'id'))"
+        )
+        cursor.execute(
+            "INSERT INTO transactions"
+            " (id, room_id, date, description, amount_cents, comment, payer_id,"
+            " participant_ids, participant_count)"
+            " SELECT id, %s, date, description, amount_cents, comment, payer_id,"
+            " participant_ids, participant_count"
+            " FROM import_transactions ORDER BY seq",
+            (room_id,),
+        )
+        cursor.execute(
+            "INSERT INTO transaction_shares (transaction_id, room_id, person_id, amount_cents)"
+            " SELECT t.id, %s, s.person_id, s.amount_cents"
+            " FROM import_shares s JOIN import_transactions t ON t.seq = s.seq",
+            (room_id,),
+        )
+        cursor.execute("TRUNCATE import_transactions, import_shares")
+    finally:
+        cursor.close()
+
+
+def import_transactions(
+    records: Iterable[Tuple[int, Mapping[str, object]]],
+    batch_size: int = DEFAULT_IMPORT_BATCH_SIZE,
+    progress: Optional[Callable[[Dict[str, object]], None]] = None,
+) -> Dict[str, object]:
+    """
+    Validate and insert ``records`` into the current room in one database
+    transaction.
+
+    Invalid records are skipped and reported in ``errors`` as
+    ``(line_number, message)``. ``progress`` is called after every batch with
+    the running statistics.
+    """
+    if batch_size <= 0:
+        raise ValueError("batch_size must be a positive integer")
+
+    members_by_id = member_directory().names
+    ids_by_name = {name.lower(): person_id for person_id, name in members_by_id.items()}
+    use_copy = db.engine.dialect.name == "postgresql"
+    write_batch = _copy_batch if use_copy else insert_transactions
+
+    balance_deltas: BalanceDeltas = defaultdict(int)
+    pair_deltas: PairDeltas = defaultdict(int)
+    stats: Dict[str, object] = {
+        "read": 0,
+        "imported": 0,
+        "shares": 0,
+        "errors": [],
+        "method": "copy" if use_copy else "executemany",
+        "seconds": 0.0,
+        "rows_per_second": 0.0,
+    }
+    since: Optional[date] = None  # earliest imported date
+    started = time.perf_counter()
+
+    def flush(pending: List[Tuple[int, Dict | ValueError]]) -> None:
+        nonlocal since
+        forms = [form for _, form in pending if not isinstance(form, ValueError)]
+        validated = iter(validate_transaction_forms(forms, members_by_id))
+        batch: List[TransactionData] = []
+        for line_number, form in pending:
+            result = form if isinstance(form, ValueError) else next(validated)
+            if isinstance(result, ValueError):
+                stats["errors"].append((line_number, str(result)))
+            else:
+                batch.append(result)
+        pending.clear()
+        if not batch:
+            return
+        write_batch(batch)
+        for data in batch:
+            accumulate_deltas(balance_deltas, pair_deltas, data.payer_id, data.amount_cents, data.shares)
+        since = min([data.date for data in batch] + ([since] if since else []))
+        stats["imported"] += len(batch)
+        stats["shares"] += sum(len(data.shares) for data in batch)
+        stats["seconds"] = time.perf_counter() - started
+        stats["rows_per_second"] = stats["imported"] / stats["seconds"] if stats["seconds"] else 0.0
+        if progress:
+            progress(stats)
+
+    # Records read since the last flush, with their form or mapping error.
+    pending: List[Tuple[int, Dict | ValueError]] = []
+    try:
+        for line_number, record in records:
+            stats["read"] += 1
+            try:
+                pending.append((line_number, record_to_form(record, ids_by_name)))
+            except ValueError as exc:
+                pending.append((line_number, exc))
+            if len(pending) >= batch_size:
+                flush(pending)
+        if pending:
+            flush(pending)
+        apply_deltas(balance_deltas, pair_deltas, since=since)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    stats["seconds"] = time.perf_counter() - started
+    stats["rows_per_second"] = stats["imported"] / stats["seconds"] if stats["seconds"] else 0.0
+    return stats
@@ -0,0 +1,416 @@
+"""
+Incrementally maintained balance ledger.
+
+Every write path (form create, edit, delete and the JSON API) applies the
+effect of a transaction to ``member_balances`` and ``pair_debts`` inside the
+same database transaction, so balance reads are O(members) and debt reads
+only touch non-zero pairs instead of scanning the whole history.
+``check_consistency`` recomputes from scratch to detect drift. Writes also
+drop the balance checkpoints (see ``checkpoints.py``) that cover the dates
+they touch.
+"""
+
+from __future__ import annotations
+
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from sqlalchemy import and_, delete, event, func, insert, select, update
+from sqlalchemy.orm import Session, aliased
+
+from directory import member_directory
+from models import (
+    CheckpointBalance,
+    CheckpointPairDebt,
+    LedgerCheckpoint,
+    LedgerState,
+    MemberBalance,
+    PairDebt,
+    Person,
+    Room,
+    Transaction,
+    TransactionShare,
+    current_room_id,
+    db,
+    use_room,
+)
+from money import from_cents
+from utils import (
+    compute_balance_cents,
+    compute_balances,
+    compute_pair_debt_cents,
+    compute_person_to_person_debts,
+)
+
+BalanceDeltas = Dict[int, int]
+PairDeltas = Dict[Tuple[int, int], int]
+
+_LEDGER_CHANGED = "ledger_changed"
+_commit_listeners: List[Callable[[], None]] = []
+
+
+def on_ledger_commit(listener: Callable[[int], None]) -> Callable[[int], None]:
+    """
+    Register ``listener(room_id)`` to run after every commit that changed the
+    ledger of that room, e.g. to drop caches derived from transactions.
+    Usable as a decorator.
+    """
+    _commit_listeners.append(listener)
+    return listener
+
+
+def _mark_ledger_changed(session, room_id: int) -> None:
+    session.info.setdefault(_LEDGER_CHANGED, set()).add(room_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _notify_ledger_commit(session) -> None:
+    for room_id in session.info.pop(_LEDGER_CHANGED, ()):
+        for listener in _commit_listeners:
+            listener(room_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_ledger_change(session) -> None:
+    session.info.pop(_LEDGER_CHANGED, None)
+
+
+def bump_ledger_version(session=None, room_id: int | None = None) -> None:
+    """Increase the room's ledger version inside the current database transaction."""
+    session = session or db.session
+    room_id = room_id or current_room_id()
+    updated = session.execute(
+        update(LedgerState)
+        .where(LedgerState.id == room_id)
+        .values(version=LedgerState.version + 1)
+    ).rowcount
+    if not updated:
+        session.execute(insert(LedgerState).values(id=room_id, version=1))
+
+
+def current_ledger_version(room_id: int | None = None) -> int:
+    """Return the room's ledger version; it changes whenever anything readable changes."""
+    version = db.session.execute(
+        select(LedgerState.version).where(LedgerState.id == (room_id or current_room_id()))
+    ).scalar()
+    return version or 0
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_version_for_members(session, flush_context) -> None:
+    room_ids = {
+        obj.room_id or current_room_id()
+        for obj in (*session.new, *session.dirty, *session.deleted)
+        if isinstance(obj, Person)
+    }
+    for room_id in room_ids:
+        bump_ledger_version(session, room_id)
+
+
+def accumulate_deltas(
+    balance_deltas: BalanceDeltas,
+    pair_deltas: PairDeltas,
+    payer_id: int,
+    amount_cents: int,
+    shares: Iterable[Tuple[int, int]],
+    sign: int = 1,
+) -> None:
+    """
+    Add the ledger change of one expense (``shares`` as ``(person_id, cents)``)
+    to the running delta maps, negated when ``sign`` is -1.
+    """
+    balance_deltas[payer_id] += sign * amount_cents
+    for person_id, share_cents in shares:
+        share_cents *= sign
+        balance_deltas[person_id] -= share_cents
+        if person_id != payer_id:
+            pair_deltas[(person_id, payer_id)] += share_cents
+
+
+def transaction_deltas(txn: Transaction) -> Tuple[BalanceDeltas, PairDeltas]:
+    """
+    Return the ledger change caused by ``txn``: cents per member balance and
+    cents per (debtor, creditor) pair.
+    """
+    balance_deltas: BalanceDeltas = defaultdict(int)
+    pair_deltas: PairDeltas = defaultdict(int)
+    payer_id = txn.payer_id if txn.payer_id is not None else txn.payer.id
+    accumulate_deltas(
+        balance_deltas,
+        pair_deltas,
+        payer_id,
+        txn.amount_cents,
+        txn.split(),
+    )
+    return balance_deltas, pair_deltas
+
+
+def _negate(deltas):
+    return {key: -delta for key, delta in deltas.items()}
+
+
+def invalidate_checkpoints(
+    since: date, session: Session | None = None, room_id: int | None = None
+) -> None:
+    """Drop the room's checkpoints that cover transactions dated ``since`` or later."""
+    session = session or db.session
+    room_id = room_id or current_room_id()
+    stale = select(LedgerCheckpoint.id).where(
+        LedgerCheckpoint.room_id == room_id, LedgerCheckpoint.through >= since
+    )
+    if session.execute(stale.limit(1)).first() is None:
+        return
+    for model in (CheckpointBalance, CheckpointPairDebt):
+        session.execute(
+            delete(model)
+            .where(model.checkpoint_id.in_(stale))
+            .execution_options(synchronize_session=False)
+        )
+    session.execute(
+        delete(LedgerCheckpoint)
+        .where(LedgerCheckpoint.room_id == room_id, LedgerCheckpoint.through >= since)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def apply_deltas(
+    balance_deltas: BalanceDeltas,
+    pair_deltas: PairDeltas,
+    session: Session | None = None,
+    since: date | None = None,
+) -> None:
+    """
+    Add the given deltas (in cents) to the stored ledger rows, through
+    ``session`` when given (e.g. the sync side of an ``AsyncSession``).
+    ``since`` is the earliest transaction date the deltas come from; the
+    checkpoints from that date on are dropped.
+    """
+    session = session or db.session
+    room_id = current_room_id()
+    _mark_ledger_changed(session, room_id)
+    bump_ledger_version(session, room_id)
+    if since is not None:
+        invalidate_checkpoints(since, session, room_id)
+    for person_id, delta in balance_deltas.items():
+        if not delta:
+            continue
+        updated = session.execute(
+            update(MemberBalance)
+            .where(MemberBalance.person_id == person_id)
+            .values(balance_cents=MemberBalance.balance_cents + delta)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not updated:
+            session.add(
+                MemberBalance(person_id=person_id, room_id=room_id, balance_cents=delta)
+            )
+            session.flush()
+
+    for (debtor_id, creditor_id), delta in pair_deltas.items():
+        if not delta:
+            continue
+        pair = and_(PairDebt.debtor_id == debtor_id, PairDebt.creditor_id == creditor_id)
+        updated = session.execute(
+            update(PairDebt)
+            .where(pair)
+            .values(amount_cents=PairDebt.amount_cents + delta)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not updated:
+            session.add(
+                PairDebt(
+                    debtor_id=debtor_id,
+                    creditor_id=creditor_id,
+                    room_id=room_id,
+                    amount_cents=delta,
+                )
+            )
+            session.flush()
+        elif delta < 0:
+            # Keep the table sparse: drop pairs that have been paid back to zero.
+            session.execute(
+                delete(PairDebt)
+                .where(pair, PairDebt.amount_cents == 0)
+                .execution_options(synchronize_session=False)
+            )
+
+
+def record_transaction(txn: Transaction, session: Session | None = None) -> None:
+    """Apply a newly created (or updated) transaction to the ledger."""
+    apply_deltas(*transaction_deltas(txn), session=session, since=txn.date)
+
+
+def reverse_transaction(txn: Transaction) -> None:
+    """Remove the effect of ``txn`` from the ledger before it changes or goes away."""
+    balance_deltas, pair_deltas = transaction_deltas(txn)
+    apply_deltas(_negate(balance_deltas), _negate(pair_deltas), since=txn.date)
+
+
+def record_transactions(transactions: Iterable[Transaction]) -> None:
+    """Apply many transactions with one update per affected member and pair."""
+    balance_totals: BalanceDeltas = defaultdict(int)
+    pair_totals: PairDeltas = defaultdict(int)
+    since = None
+    for txn in transactions:
+        since = txn.date if since is None else min(since, txn.date)
+        balance_deltas, pair_deltas = transaction_deltas(txn)
+        for person_id, delta in balance_deltas.items():
+            balance_totals[person_id] += delta
+        for pair, delta in pair_deltas.items():
+            pair_totals[pair] += delta
+    apply_deltas(balance_totals, pair_totals, since=since)
+
+
+def forget_member(person_id: int, room_id: int | None = None) -> None:
+    """Drop the stored ledger rows of a member of ``room_id`` that is being deleted."""
+    room_id = room_id or current_room_id()
+    MemberBalance.query.filter_by(room_id=room_id, person_id=person_id).delete(
+        synchronize_session=False
+    )
+    PairDebt.query.filter(
+        PairDebt.room_id == room_id,
+        (PairDebt.debtor_id == person_id) | (PairDebt.creditor_id == person_id),
+    ).delete(synchronize_session=False)
+
+
+def read_balances() -> Dict[int, Decimal]:
+    """Return the stored net balance per person in a single O(members) read."""
+    balances = {person_id: Decimal("0.00") for person_id in member_directory().names}
+    for person_id, cents in db.session.query(
+        MemberBalance.person_id, MemberBalance.balance_cents
+    ).filter(MemberBalance.room_id == current_room_id()):
+        if person_id in balances:
+            balances[person_id] = from_cents(cents)
+    return balances
+
+
+def read_net_debts() -> List[Tuple[int, int, Decimal]]:
+    """
+    Return ``(debtor_id, creditor_id, amount)`` for every pair with a positive
+    net debt, netting both directions of a pair in the database.
+    """
+    reverse = aliased(PairDebt)
+    net = PairDebt.amount_cents - func.coalesce(reverse.amount_cents, 0)
+    rows = (
+        db.session.query(PairDebt.debtor_id, PairDebt.creditor_id, net)
+        .outerjoin(
+            reverse,
+            and_(
+                reverse.debtor_id == PairDebt.creditor_id,
+                reverse.creditor_id == PairDebt.debtor_id,
+            ),
+        )
+        .filter(PairDebt.room_id == current_room_id(), net > 0)
+    )
+    return [(debtor_id, creditor_id, from_cents(cents)) for debtor_id, creditor_id, cents in rows]
+
+
+def _stored_pair_debts() -> Dict[Tuple[int, int], Decimal]:
+    return {
+        (pair.debtor_id, pair.creditor_id): from_cents(pair.amount_cents)
+        for pair in PairDebt.query.filter(
+            PairDebt.room_id == current_room_id(), PairDebt.amount_cents != 0
+        )
+    }
+
+
+def check_consistency() -> List[Dict[str, object]]:
+    """
+    Recompute balances and pairwise debts from the transaction history and
+    compare them with the stored ledger of the current room. Returns one entry
+    per member balance or debt pair that drifted.
+    """
+    drift = []
+
+    expected = compute_balances()
+    stored = read_balances()
+    for person_id in sorted(set(expected) | set(stored)):
+        expected_amount = expected.get(person_id, Decimal("0.00"))
+        stored_amount = stored.get(person_id, Decimal("0.00"))
+        if expected_amount != stored_amount:
+            drift.append(
+                {
+                    "kind": "balance",
+                    "person_id": person_id,
+                    "stored": stored_amount,
+                    "expected": expected_amount,
+                    "difference": stored_amount - expected_amount,
+                }
+            )
+
+    expected_pairs = {
+        (debtor_id, creditor_id): amount
+        for debtor_id, row in compute_person_to_person_debts().items()
+        for creditor_id, amount in row.items()
+    }
+    stored_pairs = _stored_pair_debts()
+    for pair in sorted(set(expected_pairs) | set(stored_pairs)):
+        expected_amount = expected_pairs.get(pair, Decimal("0.00"))
+        stored_amount = stored_pairs.get(pair, Decimal("0.00"))
+        if expected_amount != stored_amount:
+            drift.append(
+                {
+                    "kind": "debt",
+                    "debtor_id": pair[0],
+                    "creditor_id": pair[1],
+                    "stored": stored_amount,
+                    "expected": expected_amount,
+                    "difference": stored_amount - expected_amount,
+                }
+            )
+    return drift
+
+
+def rebuild_ledger() -> None:
+    """Recompute the current room's stored balances and pairwise debts from scratch."""
+    room_id = current_room_id()
+    _mark_ledger_changed(db.session, room_id)
+    bump_ledger_version(room_id=room_id)
+    MemberBalance.query.filter_by(room_id=room_id).delete(synchronize_session=False)
+    PairDebt.query.filter_by(room_id=room_id).delete(synchronize_session=False)
+    invalidate_checkpoints(date.min, room_id=room_id)
+    for person_id, cents in compute_balance_cents().items():
+        db.session.add(MemberBalance(person_id=person_id, room_id=room_id, balance_cents=cents))
+    for debtor_id, row in compute_pair_debt_cents().items():
+        for creditor_id, cents in row.items():
+            db.session.add(
+                PairDebt(
+                    debtor_id=debtor_id,
+                    creditor_id=creditor_id,
+                    room_id=room_id,
+                    amount_cents=cents,
+                )
+            )
+    db.session.commit()
+
+
+def sync_ledger() -> None:
+    """Build the ledger tables of every room for databases that predate them."""
+    room_ids = [room_id for (room_id,) in db.session.query(Room.id)] or [current_room_id()]
+    for room_id in room_ids:
+        with use_room(room_id):
+            _sync_room_ledger(room_id)
+
+
+def _sync_room_ledger(room_id: int) -> None:
+    if db.session.get(LedgerState, room_id) is None:
+        db.session.add(LedgerState(id=room_id, version=0))
+        db.session.commit()
+    transactions = Transaction.query.filter_by(room_id=room_id)
+    if transactions.first() is None:
+        return
+    missing_balances = MemberBalance.query.filter_by(room_id=room_id).first() is None
+    missing_debts = PairDebt.query.filter_by(room_id=room_id).first() is None and (
+        TransactionShare.query.join(Transaction)
+        .filter(
+            TransactionShare.room_id == room_id,
+            TransactionShare.person_id != Transaction.payer_id,
+        )
+        .first()
+        is not None
+        or transactions.filter(Transaction.participant_count > 1).first() is not None
+    )
+    if missing_balances or missing_debts:
+        rebuild_ledger()
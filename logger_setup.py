@@ -1,33 +1,176 @@
+"""
+Logging pipeline.
+
+Loggers only put records on an in-memory queue; a background
+``QueueListener`` thread formats them as JSON lines and writes the rotating
+files, so request threads never wait on disk I/O. SQL statements and access
+log lines can be sampled before they are queued:
+
+- ``LOG_DIR`` (default ``logs``) – where ``app.log`` and ``db.log`` go.
+- ``LOG_SQL_SAMPLE_RATE`` (default ``0.1``) – share of SQL statements kept;
+  ``0`` turns SQL logging off entirely.
+- ``LOG_ACCESS_SAMPLE_RATE`` (default ``1.0``) – share of requests logged.
+
+Warnings and errors are never sampled out. Each setting is read from the app
+config first and then from the environment.
+"""
+
+import atexit
+import json
 import logging
-from logging.handlers import RotatingFileHandler
 import os
+import queue
+import random
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+ACCESS_LOGGER = "room_expenses.access"
+SQL_LOGGER = "sqlalchemy.engine"
+
+# Attributes every LogRecord has; anything else was passed through ``extra``.
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message",
+    "asctime",
+    "taskName",
+}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, including any ``extra`` fields."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep roughly ``rate`` of the records below WARNING."""
+
+    def __init__(self, rate, name=""):
+        super().__init__(name)
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate >= 1:
+            return True
+        return self.rate > 0 and random.random() < self.rate
+
+
+class LoggerNameFilter(logging.Filter):
+    """Accept (or, with ``exclude``, reject) records from the ``prefix`` logger tree."""
+
+    def __init__(self, prefix, exclude=False):
+        super().__init__()
+        self.prefix = prefix
+        self.exclude = exclude
+
+    def filter(self, record):
+        matches = record.name == self.prefix or record.name.startswith(self.prefix + ".")
+        return matches != self.exclude
+
+
+def _setting(app, name, default):
+    return app.config.get(name, os.getenv(name, default))
+
+
+def _queue_handler(log_queue, sample_rate=None):
+    handler = QueueHandler(log_queue)
+    if sample_rate is not None:
+        handler.addFilter(SamplingFilter(sample_rate))
+    return handler
+
+
+def log_access(method, path, status, client_ip, started=None):
+    """Write one access log line; ``started`` is the request's ``perf_counter`` start."""
+    access_logger = logging.getLogger(ACCESS_LOGGER)
+    if not access_logger.isEnabledFor(logging.INFO):
+        return
+    access_logger.info(
+        "%s %s %s",
+        method,
+        path,
+        status,
+        extra={
+            "method": method,
+            "path": path,
+            "status": status,
+            "client_ip": client_ip,
+            "duration_ms": (
+                round((time.perf_counter() - started) * 1000, 2) if started is not None else None
+            ),
+        },
+    )
+
 
 def setup_logger(app):
-    os.makedirs("logs", exist_ok=True)
+    if "log_listener" in app.extensions:
+        return app
+
+    log_dir = _setting(app, "LOG_DIR", "logs")
+    sql_rate = float(_setting(app, "LOG_SQL_SAMPLE_RATE", 0.1))
+    access_rate = float(_setting(app, "LOG_ACCESS_SAMPLE_RATE", 1.0))
+    os.makedirs(log_dir, exist_ok=True)
 
-    handler = RotatingFileHandler("logs/app.log", maxBytes=1_000_000, backupCount=5)
-    handler.setLevel(logging.INFO)
+    formatter = JsonFormatter()
+    app_handler = RotatingFileHandler(
+        os.path.join(log_dir, "app.log"), maxBytes=1_000_000, backupCount=5
+    )
+    app_handler.setLevel(logging.INFO)
+    app_handler.setFormatter(formatter)
+    app_handler.addFilter(LoggerNameFilter(SQL_LOGGER, exclude=True))
 
-    formatter = logging.Formatter(
-        "[%(asctime)s] %(levelname)s in %(module)s: %(message)s"
+    db_handler = RotatingFileHandler(
+        os.path.join(log_dir, "db.log"), maxBytes=1_000_000, backupCount=3
     )
-    handler.setFormatter(formatter)
+    db_handler.setFormatter(formatter)
+    db_handler.addFilter(LoggerNameFilter(SQL_LOGGER))
 
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, app_handler, db_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(shutdown_logger, app)
+    app.extensions["log_listener"] = listener
 
-    app.logger.addHandler(handler)
+    app.logger.addHandler(_queue_handler(log_queue))
     app.logger.setLevel(logging.INFO)
 
+    access_logger = logging.getLogger(ACCESS_LOGGER)
+    access_logger.addHandler(_queue_handler(log_queue, access_rate))
+    access_logger.setLevel(logging.INFO)
+    access_logger.propagate = False
+
     # Werkzeug
     werkzeug_logger = logging.getLogger("werkzeug")
     werkzeug_logger.setLevel(logging.WARNING)
-    werkzeug_logger.addHandler(handler)
+    werkzeug_logger.addHandler(_queue_handler(log_queue))
 
-    # SQLAlchemy 
-    db_logger = logging.getLogger("sqlalchemy.engine")
-    db_logger.setLevel(logging.INFO)
-    db_handler = RotatingFileHandler("logs/db.log", maxBytes=1_000_000, backupCount=3)
-    db_handler.setFormatter(formatter)
-    db_logger.addHandler(db_handler)
+    # SQLAlchemy: at WARNING the engine skips building statement log lines.
+    db_logger = logging.getLogger(SQL_LOGGER)
+    db_logger.setLevel(logging.INFO if sql_rate > 0 else logging.WARNING)
+    db_logger.addHandler(_queue_handler(log_queue, sql_rate))
 
     app.logger.info("Logging system initialized.")
     return app
+
+
+def shutdown_logger(app):
+    """Flush queued records and stop the writer thread (runs at exit)."""
+    listener = app.extensions.pop("log_listener", None)
+    if listener is not None:
+        listener.stop()
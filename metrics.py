@@ -0,0 +1,207 @@
+"""
+Per-request performance metrics.
+
+Every request records its duration, the number and total time of SQL
+statements (from SQLAlchemy engine events) and the time spent rendering
+templates. The figures of the current request are returned in a
+``Server-Timing`` header; aggregates broken down by route are kept per worker
+process and served in the Prometheus text format at ``GET /metrics``. The
+async API (``async_api.py``) records its requests through ``record_request``.
+Set ``METRICS_ENABLED = False`` to turn both off.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from flask import (
+    Response,
+    before_render_template,
+    current_app,
+    g,
+    has_app_context,
+    request,
+    template_rendered,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNMATCHED_ROUTE = "<unmatched>"
+
+_QUERY_STARTS = "metrics_query_starts"
+_COUNTERS = (
+    ("db_queries_total", "SQL statements executed while handling requests.", "queries"),
+    ("db_query_seconds_total", "Time spent in SQL statements while handling requests.", "query_seconds"),
+    ("template_render_seconds_total", "Time spent rendering templates.", "render_seconds"),
+)
+
+
+class RequestTimings:
+    """Figures collected while one request is being handled."""
+
+    __slots__ = ("started", "queries", "query_seconds", "render_seconds", "render_started")
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.render_seconds = 0.0
+        self.render_started: List[float] = []
+
+
+class RouteStats:
+    """Cumulative figures for one ``(method, route)`` pair."""
+
+    __slots__ = ("bucket_counts", "count", "seconds", "queries", "query_seconds", "render_seconds", "statuses")
+
+    def __init__(self) -> None:
+        self.bucket_counts = [0] * len(DURATION_BUCKETS)
+        self.count = 0
+        self.seconds = 0.0
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.render_seconds = 0.0
+        self.statuses: Dict[int, int] = defaultdict(int)
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.routes: Dict[Tuple[str, str], RouteStats] = defaultdict(RouteStats)
+
+    def observe(self, method: str, route: str, status: int, seconds: float, timings: RequestTimings) -> None:
+        with self.lock:
+            stats = self.routes[(method, route)]
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    stats.bucket_counts[index] += 1
+            stats.count += 1
+            stats.seconds += seconds
+            stats.queries += timings.queries
+            stats.query_seconds += timings.query_seconds
+            stats.render_seconds += timings.render_seconds
+            stats.statuses[status] += 1
+
+    def render(self) -> str:
+        """Return every metric in the Prometheus text exposition format."""
+        lines = [
+            "# HELP http_request_duration_seconds Time spent handling requests.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        with self.lock:
+            routes = sorted(self.routes.items())
+            for (method, route), stats in routes:
+                labels = f'method="{method}",route="{_escape(route)}"'
+                for bound, count in zip(DURATION_BUCKETS, stats.bucket_counts):
+                    lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {stats.count}')
+                lines.append(f"http_request_duration_seconds_sum{{{labels}}} {stats.seconds:.6f}")
+                lines.append(f"http_request_duration_seconds_count{{{labels}}} {stats.count}")
+
+            lines.append("# HELP http_requests_total Requests handled, by response status.")
+            lines.append("# TYPE http_requests_total counter")
+            for (method, route), stats in routes:
+                labels = f'method="{method}",route="{_escape(route)}"'
+                for status, count in sorted(stats.statuses.items()):
+                    lines.append(f'http_requests_total{{{labels},status="{status}"}} {count}')
+
+            for name, help_text, attribute in _COUNTERS:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} counter")
+                for (method, route), stats in routes:
+                    labels = f'method="{method}",route="{_escape(route)}"'
+                    lines.append(f"{name}{{{labels}}} {getattr(stats, attribute):g}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _current_timings() -> RequestTimings | None:
+    # The async API handles each request in its own app context.
+    if not has_app_context():
+        return None
+    return g.get("request_timings")
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_query(conn, cursor, statement, parameters, context, executemany) -> None:
+    if _current_timings() is not None:
+        conn.info.setdefault(_QUERY_STARTS, []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _finish_query(conn, cursor, statement, parameters, context, executemany) -> None:
+    timings = _current_timings()
+    starts = conn.info.get(_QUERY_STARTS)
+    if timings is None or not starts:
+        return
+    timings.queries += 1
+    timings.query_seconds += time.perf_counter() - starts.pop()
+
+
+def _start_render(sender, template, context, **extra) -> None:
+    timings = _current_timings()
+    if timings is not None:
+        timings.render_started.append(time.perf_counter())
+
+
+def _finish_render(sender, template, context, **extra) -> None:
+    timings = _current_timings()
+    if timings is not None and timings.render_started:
+        timings.render_seconds += time.perf_counter() - timings.render_started.pop()
+
+
+def server_timing(timings: RequestTimings, seconds: float) -> str:
+    """Format the figures of one request as a ``Server-Timing`` header value."""
+    return (
+        f"app;dur={seconds * 1000:.1f}, "
+        f'db;dur={timings.query_seconds * 1000:.1f};desc="{timings.queries} queries", '
+        f"render;dur={timings.render_seconds * 1000:.1f}"
+    )
+
+
+def metrics_registry() -> MetricsRegistry:
+    return current_app.extensions.setdefault("metrics", MetricsRegistry())
+
+
+def record_request(method: str, route: str, status: int, timings: RequestTimings) -> str:
+    """Add a finished request to the registry and return its ``Server-Timing`` value."""
+    seconds = time.perf_counter() - timings.started
+    metrics_registry().observe(method, route, status, seconds, timings)
+    return server_timing(timings, seconds)
+
+
+def register_metrics(app) -> None:
+    """Collect per-request metrics for ``app`` and expose ``GET /metrics``."""
+    app.config.setdefault("METRICS_ENABLED", True)
+    app.extensions.setdefault("metrics", MetricsRegistry())
+    before_render_template.connect(_start_render, app)
+    template_rendered.connect(_finish_render, app)
+
+    @app.before_request
+    def start_request_timer():
+        if app.config["METRICS_ENABLED"]:
+            g.request_timings = RequestTimings()
+
+    @app.after_request
+    def record_request_metrics(response):
+        timings = g.pop("request_timings", None)
+        if timings is None:
+            return response
+        route = request.url_rule.rule if request.url_rule is not None else UNMATCHED_ROUTE
+        response.headers["Server-Timing"] = record_request(
+            request.method, route, response.status_code, timings
+        )
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        if not app.config["METRICS_ENABLED"]:
+            return Response("Metrics are disabled.\n", status=404, mimetype="text/plain")
+        return Response(metrics_registry().render(), mimetype="text/plain; version=0.0.4")
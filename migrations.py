@@ -0,0 +1,241 @@
+"""
+Versioned schema migrations.
+
+``db.create_all`` only creates missing tables, so changes to tables that
+already exist (indexes, columns) ship as numbered migrations recorded in
+``schema_migrations``. ``upgrade_database`` runs them on startup and through
+``flask schema upgrade``. A brand-new database is created from the models and
+stamped with every migration, so migrations only ever run against older
+deployments and must be written against the schema as it was at the time.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, NamedTuple
+
+from sqlalchemy import inspect, insert, select
+
+from models import db
+from search import create_search_index
+
+schema_migrations = db.Table(
+    "schema_migrations",
+    db.Column("version", db.Integer, primary_key=True),
+    db.Column("description", db.String(255), nullable=False),
+    db.Column("applied_at", db.DateTime, nullable=False),
+)
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    upgrade: Callable[[object], None]
+
+
+MIGRATIONS: Dict[int, Migration] = {}
+
+
+def migration(version: int, description: str):
+    """Register the decorated ``upgrade(connection)`` function as a migration."""
+
+    def decorator(upgrade):
+        if version in MIGRATIONS:
+            raise ValueError(f"Duplicate migration version {version}")
+        MIGRATIONS[version] = Migration(version, description, upgrade)
+        return upgrade
+
+    return decorator
+
+
+@migration(1, "Indexes for the hot sort, filter and aggregate paths")
+def _add_hot_path_indexes(connection) -> None:
+    for statement in (
+        "CREATE INDEX IF NOT EXISTS ix_people_lower_name ON people (lower(name))",
+        "CREATE INDEX IF NOT EXISTS ix_transactions_date_id ON transactions (date, id)",
+        "CREATE INDEX IF NOT EXISTS ix_transactions_amount_id ON transactions (amount, id)",
+        "CREATE INDEX IF NOT EXISTS ix_transactions_payer_id_amount"
+        " ON transactions (payer_id, amount)",
+        "CREATE INDEX IF NOT EXISTS ix_transaction_shares_person_id"
+        " ON transaction_shares (person_id, transaction_id, amount)",
+        # Refresh planner statistics so the new indexes are actually picked.
+        "ANALYZE",
+    ):
+        connection.exec_driver_sql(statement)
+
+
+@migration(2, "Store money as integer cents")
+def _store_amounts_as_cents(connection) -> None:
+    postgresql = connection.dialect.name == "postgresql"
+    for statement in (
+        "DROP INDEX IF EXISTS ix_transactions_amount_id",
+        "DROP INDEX IF EXISTS ix_transactions_payer_id_amount",
+        "DROP INDEX IF EXISTS ix_transaction_shares_person_id",
+    ):
+        connection.exec_driver_sql(statement)
+
+    for table in ("transactions", "transaction_shares"):
+        # SQLite can only add NOT NULL columns with a default.
+        connection.exec_driver_sql(
+            f"ALTER TABLE {table} ADD COLUMN amount_cents BIGINT NOT NULL DEFAULT 0"
+        )
+        connection.exec_driver_sql(
+            f"UPDATE {table} SET amount_cents = CAST(ROUND(amount * 100) AS BIGINT)"
+        )
+        connection.exec_driver_sql(f"ALTER TABLE {table} DROP COLUMN amount")
+        if postgresql:
+            connection.exec_driver_sql(
+                f"ALTER TABLE {table} ALTER COLUMN amount_cents DROP DEFAULT"
+            )
+
+    for statement in (
+        "CREATE INDEX ix_transactions_amount_id ON transactions (amount_cents, id)",
+        "CREATE INDEX ix_transactions_payer_id_amount ON transactions (payer_id, amount_cents)",
+        "CREATE INDEX ix_transaction_shares_person_id"
+        " ON transaction_shares (person_id, transaction_id, amount_cents)",
+        "ANALYZE",
+    ):
+        connection.exec_driver_sql(statement)
+
+
+@migration(3, "Compact storage for even splits")
+def _add_compact_split_columns(connection) -> None:
+    connection.exec_driver_sql("ALTER TABLE transactions ADD COLUMN participant_ids TEXT")
+    connection.exec_driver_sql("ALTER TABLE transactions ADD COLUMN participant_count INTEGER")
+    connection.exec_driver_sql(
+        "CREATE INDEX ix_transactions_participant_ids"
+        " ON transactions (participant_ids, payer_id, amount_cents, participant_count)"
+        " WHERE participant_ids IS NOT NULL"
+    )
+
+
+@migration(4, "Partition members, expenses and the ledger by room")
+def _add_rooms(connection) -> None:
+    # ``create_all`` has already made the empty rooms table; existing rows
+    # all move into the default room, which keeps the old ledger_state row.
+    if connection.exec_driver_sql("SELECT COUNT(*) FROM rooms").scalar() == 0:
+        connection.exec_driver_sql("INSERT INTO rooms (id, name) VALUES (1, 'Main room')")
+    if connection.dialect.name == "postgresql":
+        connection.exec_driver_sql(
+            "SELECT setval(pg_get_serial_sequence('rooms', 'id'), MAX(id)) FROM rooms"
+        )
+
+    for table in ("transactions", "transaction_shares", "member_balances", "pair_debts"):
+        # Ledger tables newer than this migration were just made by create_all.
+        if "room_id" in {column["name"] for column in inspect(connection).get_columns(table)}:
+            continue
+        connection.exec_driver_sql(
+            f"ALTER TABLE {table} ADD COLUMN room_id INTEGER NOT NULL DEFAULT 1"
+            " REFERENCES rooms (id)"
+        )
+
+    # Member names become unique per room instead of globally.
+    if connection.dialect.name == "sqlite":
+        # SQLite cannot drop the inline UNIQUE constraint, so rebuild the table.
+        connection.exec_driver_sql(
+            "CREATE TABLE people_new ("
+            " id INTEGER NOT NULL PRIMARY KEY,"
+            " room_id INTEGER NOT NULL DEFAULT 1 REFERENCES rooms (id),"
+            " name VARCHAR(80) NOT NULL,"
+            " CONSTRAINT uq_people_room_name UNIQUE (room_id, name))"
+        )
+        connection.exec_driver_sql("INSERT INTO people_new (id, name) SELECT id, name FROM people")
+        connection.exec_driver_sql("DROP TABLE people")
+        connection.exec_driver_sql("ALTER TABLE people_new RENAME TO people")
+    else:
+        connection.exec_driver_sql("ALTER TABLE people DROP CONSTRAINT IF EXISTS people_name_key")
+        connection.exec_driver_sql(
+            "ALTER TABLE people ADD COLUMN room_id INTEGER NOT NULL DEFAULT 1"
+            " REFERENCES rooms (id)"
+        )
+        connection.exec_driver_sql(
+            "ALTER TABLE people ADD CONSTRAINT uq_people_room_name UNIQUE (room_id, name)"
+        )
+
+    for statement in (
+        "DROP INDEX IF EXISTS ix_people_lower_name",
+        "DROP INDEX IF EXISTS ix_transactions_date_id",
+        "DROP INDEX IF EXISTS ix_transactions_amount_id",
+        "DROP INDEX IF EXISTS ix_transactions_payer_id_amount",
+        "DROP INDEX IF EXISTS ix_transactions_participant_ids",
+        "DROP INDEX IF EXISTS ix_transaction_shares_person_id",
+        "CREATE INDEX IF NOT EXISTS ix_people_room_lower_name ON people (room_id, lower(name))",
+        "CREATE INDEX IF NOT EXISTS ix_transactions_room_date_id ON transactions (room_id, date, id)",
+        "CREATE INDEX IF NOT EXISTS ix_transactions_room_amount_id ON transactions (room_id, amount_cents, id)",
+        "CREATE INDEX IF NOT EXISTS ix_transactions_room_payer_amount"
+        " ON transactions (room_id, payer_id, amount_cents)",
+        "CREATE INDEX IF NOT EXISTS ix_transactions_room_participant_ids"
+        " ON transactions (room_id, participant_ids, payer_id, amount_cents, participant_count)"
+        " WHERE participant_ids IS NOT NULL",
+        "CREATE INDEX IF NOT EXISTS ix_transaction_shares_room_person"
+        " ON transaction_shares (room_id, person_id, transaction_id, amount_cents)",
+        "CREATE INDEX IF NOT EXISTS ix_member_balances_room"
+        " ON member_balances (room_id, person_id, balance_cents)",
+        "CREATE INDEX IF NOT EXISTS ix_pair_debts_room"
+        " ON pair_debts (room_id, debtor_id, creditor_id, amount_cents)",
+        "ANALYZE",
+    ):
+        connection.exec_driver_sql(statement)
+
+
+@migration(5, "Full-text search over descriptions and comments")
+def _add_search_index(connection) -> None:
+    create_search_index(connection)
+
+
+@migration(6, "Spread the leftover cents of compact even splits")
+def _respread_even_split_cents(connection) -> None:
+    # Compact shares are derived, so only the ledger and its checkpoints hold
+    # the old amounts; dropping them makes ``sync_ledger`` rebuild the room.
+    rooms = "SELECT DISTINCT room_id FROM transactions WHERE participant_ids IS NOT NULL"
+    checkpoints = f"SELECT id FROM ledger_checkpoints WHERE room_id IN ({rooms})"
+    for statement in (
+        f"DELETE FROM checkpoint_balances WHERE checkpoint_id IN ({checkpoints})",
+        f"DELETE FROM checkpoint_pair_debts WHERE checkpoint_id IN ({checkpoints})",
+        f"DELETE FROM ledger_checkpoints WHERE room_id IN ({rooms})",
+        f"DELETE FROM member_balances WHERE room_id IN ({rooms})",
+        f"DELETE FROM pair_debts WHERE room_id IN ({rooms})",
+        f"UPDATE ledger_state SET version = version + 1 WHERE id IN ({rooms})",
+    ):
+        connection.exec_driver_sql(statement)
+
+
+def applied_versions() -> List[int]:
+    """Return the migration versions recorded in the database."""
+    if not inspect(db.engine).has_table(schema_migrations.name):
+        return []
+    with db.engine.connect() as connection:
+        return sorted(connection.execute(select(schema_migrations.c.version)).scalars())
+
+
+def pending_migrations() -> List[Migration]:
+    applied = set(applied_versions())
+    return [MIGRATIONS[version] for version in sorted(MIGRATIONS) if version not in applied]
+
+
+def _stamp(connection, item: Migration) -> None:
+    connection.execute(
+        insert(schema_migrations).values(
+            version=item.version,
+            description=item.description,
+            applied_at=datetime.now(timezone.utc).replace(tzinfo=None),
+        )
+    )
+
+
+def upgrade_database() -> List[Migration]:
+    """
+    Create missing tables and apply pending migrations, each in its own
+    transaction. Returns the migrations that were actually run.
+    """
+    fresh = not inspect(db.engine).has_table("transactions")
+    db.create_all()
+
+    ran = []
+    for item in pending_migrations():
+        with db.engine.begin() as connection:
+            if not fresh:
+                item.upgrade(connection)
+                ran.append(item)
+            _stamp(connection, item)
+    return ran
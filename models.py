@@ -1,14 +1,95 @@
+from contextlib import contextmanager
+from decimal import Decimal
+from typing import Iterable, Iterator, List, NamedTuple, Optional
+
+from flask import g, has_app_context
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Numeric
+from sqlalchemy import func
+
+from money import from_cents, split_cents, to_cents
 
 db = SQLAlchemy()
 
+DEFAULT_ROOM_ID = 1
+
+
+def current_room_id() -> int:
+    """Room of the current request (chosen in ``rooms.py``), else the default room."""
+    if has_app_context():
+        return g.get("room_id", DEFAULT_ROOM_ID)
+    return DEFAULT_ROOM_ID
+
+
+@contextmanager
+def use_room(room_id: int) -> Iterator[int]:
+    """Scope queries and new rows to ``room_id`` for the duration of the block."""
+    previous = g.get("room_id")
+    g.room_id = room_id
+    try:
+        yield room_id
+    finally:
+        if previous is None:
+            g.pop("room_id", None)
+        else:
+            g.room_id = previous
+
+
+def room_column():
+    """``room_id`` column; new rows default to the current room."""
+    return db.Column(
+        db.Integer, db.ForeignKey("rooms.id"), nullable=False, default=current_room_id
+    )
+
+
+def pack_member_ids(member_ids: Iterable[int]) -> str:
+    """Pack participant ids, in order, as ``",3,1,7,"`` for compact even splits."""
+    return "," + ",".join(str(member_id) for member_id in member_ids) + ","
+
+
+def unpack_member_ids(packed: str) -> List[int]:
+    return [int(part) for part in packed.strip(",").split(",") if part]
+
+
+def packed_member_pattern(person_id: int) -> str:
+    """``LIKE`` pattern matching packed participant lists that contain ``person_id``."""
+    return f"%,{int(person_id)},%"
+
+
+class ShareView(NamedTuple):
+    """One participant's share, whether stored as a row or derived on read."""
+
+    person_id: int
+    amount_cents: int
+
+    @property
+    def amount(self) -> Decimal:
+        return from_cents(self.amount_cents)
+
+
+class Room(db.Model):
+    """A group sharing expenses; every member, expense and ledger row has one."""
+
+    __tablename__ = "rooms"
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(80), unique=True, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<Room {self.name}>"
+
 
 class Person(db.Model):
     __tablename__ = "people"
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(80), unique=True, nullable=False)
+    room_id = room_column()
+    name = db.Column(db.String(80), nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint("room_id", "name", name="uq_people_room_name"),
+        # Serves the case-insensitive payer sort and rename duplicate check.
+        db.Index("ix_people_room_lower_name", room_id, func.lower(name)),
+    )
 
     def __repr__(self) -> str:
         return f"<Person {self.name}>"
@@ -18,13 +99,21 @@ class Transaction(db.Model):
     __tablename__ = "transactions"
 
     id = db.Column(db.Integer, primary_key=True)
+    room_id = room_column()
     date = db.Column(db.Date, nullable=False)
     description = db.Column(db.String(255), nullable=False)
-    amount = db.Column(Numeric(10, 2), nullable=False)
+    amount_cents = db.Column(db.BigInteger, nullable=False)
     comment = db.Column(db.Text)
+    # Compact even splits: packed participant ids instead of share rows.
+    participant_ids = db.Column(db.Text)
+    participant_count = db.Column(db.Integer)
 
     payer_id = db.Column(db.Integer, db.ForeignKey("people.id"), nullable=False)
-    payer = db.relationship("Person", backref=db.backref("payments", lazy=True))
+    # Members are only deleted once nothing references them, so deleting one
+    # need not load its payments (an unindexed lookup without the room).
+    payer = db.relationship(
+        "Person", backref=db.backref("payments", lazy=True, passive_deletes=True)
+    )
 
     shares = db.relationship(
         "TransactionShare",
@@ -33,6 +122,56 @@ class Transaction(db.Model):
         lazy=True,
     )
 
+    __table_args__ = (
+        # Keyset pagination orders by (sort key, id) within a room.
+        db.Index("ix_transactions_room_date_id", "room_id", "date", "id"),
+        db.Index("ix_transactions_room_amount_id", "room_id", "amount_cents", "id"),
+        # Per-payer aggregates (balances, stats) and the delete-member check.
+        db.Index("ix_transactions_room_payer_amount", "room_id", "payer_id", "amount_cents"),
+        # Covers the per-participant-set totals of compact even splits.
+        db.Index(
+            "ix_transactions_room_participant_ids",
+            "room_id",
+            "participant_ids",
+            "payer_id",
+            "amount_cents",
+            "participant_count",
+            sqlite_where=participant_ids.isnot(None),
+            postgresql_where=participant_ids.isnot(None),
+        ),
+    )
+
+    @property
+    def amount(self) -> Decimal:
+        return from_cents(self.amount_cents)
+
+    @amount.setter
+    def amount(self, value) -> None:
+        self.amount_cents = to_cents(value)
+
+    @property
+    def is_compact(self) -> bool:
+        return self.participant_ids is not None
+
+    def split(self) -> List[ShareView]:
+        """Every participant's share, derived for compact even splits."""
+        if self.participant_ids is not None:
+            member_ids = unpack_member_ids(self.participant_ids)
+            return [
+                ShareView(member_id, cents)
+                for member_id, cents in zip(
+                    member_ids, split_cents(self.amount_cents, len(member_ids))
+                )
+            ]
+        return [ShareView(share.person_id, share.amount_cents) for share in self.shares]
+
+    def is_even_split(self, split: Optional[List[ShareView]] = None) -> bool:
+        """Whether the shares are an even split of the amount, in any order."""
+        share_cents = sorted(share.amount_cents for share in (split or self.split()))
+        return bool(share_cents) and share_cents == sorted(
+            split_cents(self.amount_cents, len(share_cents))
+        )
+
     def __repr__(self) -> str:
         return f"<Transaction {self.description} {self.amount}>"
 
@@ -41,7 +180,8 @@ class TransactionShare(db.Model):
     __tablename__ = "transaction_shares"
 
     id = db.Column(db.Integer, primary_key=True)
-    amount = db.Column(Numeric(10, 2), nullable=False)
+    room_id = room_column()
+    amount_cents = db.Column(db.BigInteger, nullable=False)
 
     transaction_id = db.Column(
         db.Integer, db.ForeignKey("transactions.id"), nullable=False
@@ -55,5 +195,110 @@ class TransactionShare(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint("transaction_id", "person_id", name="uq_share_transaction"),
+        # member_id filter joins and per-person share aggregates.
+        db.Index(
+            "ix_transaction_shares_room_person",
+            "room_id",
+            "person_id",
+            "transaction_id",
+            "amount_cents",
+        ),
     )
 
+    @property
+    def amount(self) -> Decimal:
+        return from_cents(self.amount_cents)
+
+    @amount.setter
+    def amount(self, value) -> None:
+        self.amount_cents = to_cents(value)
+
+
+
+class MemberBalance(db.Model):
+    """Running net balance per member, kept in step with every ledger write."""
+
+    __tablename__ = "member_balances"
+
+    person_id = db.Column(db.Integer, db.ForeignKey("people.id"), primary_key=True)
+    room_id = room_column()
+    balance_cents = db.Column(db.BigInteger, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index("ix_member_balances_room", "room_id", "person_id", "balance_cents"),
+    )
+
+    def __repr__(self) -> str:
+        return f"<MemberBalance {self.person_id} {self.balance_cents}>"
+
+
+class PairDebt(db.Model):
+    """Gross amount ``debtor`` owes ``creditor``; only non-zero pairs are stored."""
+
+    __tablename__ = "pair_debts"
+
+    debtor_id = db.Column(db.Integer, db.ForeignKey("people.id"), primary_key=True)
+    creditor_id = db.Column(db.Integer, db.ForeignKey("people.id"), primary_key=True)
+    room_id = room_column()
+    amount_cents = db.Column(db.BigInteger, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index("ix_pair_debts_room", "room_id", "debtor_id", "creditor_id", "amount_cents"),
+    )
+
+    def __repr__(self) -> str:
+        return f"<PairDebt {self.debtor_id}->{self.creditor_id} {self.amount_cents}>"
+
+
+class LedgerState(db.Model):
+    """Per-room counter (``id`` is the room id) bumped by every ledger or member write."""
+
+    __tablename__ = "ledger_state"
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class LedgerCheckpoint(db.Model):
+    """Snapshot of a room's ledger covering every transaction dated up to ``through``."""
+
+    __tablename__ = "ledger_checkpoints"
+
+    id = db.Column(db.Integer, primary_key=True)
+    room_id = room_column()
+    through = db.Column(db.Date, nullable=False)
+
+    balances = db.relationship("CheckpointBalance", cascade="all, delete-orphan", lazy=True)
+    pair_debts = db.relationship("CheckpointPairDebt", cascade="all, delete-orphan", lazy=True)
+
+    __table_args__ = (
+        db.UniqueConstraint("room_id", "through", name="uq_ledger_checkpoints_room_through"),
+    )
+
+    def __repr__(self) -> str:
+        return f"<LedgerCheckpoint {self.room_id} {self.through}>"
+
+
+class CheckpointBalance(db.Model):
+    """Non-zero member balance at a checkpoint."""
+
+    __tablename__ = "checkpoint_balances"
+
+    checkpoint_id = db.Column(
+        db.Integer, db.ForeignKey("ledger_checkpoints.id"), primary_key=True
+    )
+    person_id = db.Column(db.Integer, db.ForeignKey("people.id"), primary_key=True)
+    balance_cents = db.Column(db.BigInteger, nullable=False)
+
+
+class CheckpointPairDebt(db.Model):
+    """Non-zero gross amount ``debtor`` owed ``creditor`` at a checkpoint."""
+
+    __tablename__ = "checkpoint_pair_debts"
+
+    checkpoint_id = db.Column(
+        db.Integer, db.ForeignKey("ledger_checkpoints.id"), primary_key=True
+    )
+    debtor_id = db.Column(db.Integer, db.ForeignKey("people.id"), primary_key=True)
+    creditor_id = db.Column(db.Integer, db.ForeignKey("people.id"), primary_key=True)
+    amount_cents = db.Column(db.BigInteger, nullable=False)
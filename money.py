@@ -0,0 +1,113 @@
+"""
+Money helpers.
+
+Amounts are stored and summed as integer cents; ``Decimal`` values only
+appear at the edges, when parsing input and when formatting output.
+"""
+
+from __future__ import annotations
+
+import itertools
+import random
+from decimal import ROUND_HALF_EVEN, Decimal
+from typing import List, Sequence
+
+CENT = Decimal("0.01")
+
+
+def to_cents(value) -> int:
+    """Convert a money amount (``Decimal``, float or string) to integer cents."""
+    return int((Decimal(str(value)) * 100).quantize(Decimal("1"), rounding=ROUND_HALF_EVEN))
+
+
+def from_cents(cents) -> Decimal:
+    """Convert integer cents back to a two-place ``Decimal``."""
+    return Decimal(int(cents or 0)).scaleb(-2)
+
+
+def split_cents(total_cents: int, portions: int) -> List[int]:
+    """
+    Split ``total_cents`` into ``portions`` even shares: every share is the
+    floor of the quotient and the leftover cents go one each to the first
+    participants, as ``allocate_cents(total_cents, [1] * portions)`` would.
+    """
+    if portions <= 0:
+        raise ValueError("portions must be a positive integer")
+
+    base, remainder = divmod(total_cents, portions)
+    return [base + 1] * remainder + [base] * (portions - remainder)
+
+
+def _largest_positions(values: List[int], count: int) -> List[int]:
+    """
+    Positions of the ``count`` largest ``values``, earlier positions first on
+    ties, in expected linear time (quickselect for the threshold value).
+    """
+    candidates, wanted = values, count
+    while True:
+        pivot = random.choice(candidates)
+        above = [value for value in candidates if value > pivot]
+        if wanted <= len(above):
+            candidates = above
+            continue
+        equal = sum(1 for value in candidates if value == pivot)
+        if wanted <= len(above) + equal:
+            threshold = pivot
+            break
+        wanted -= len(above) + equal
+        candidates = [value for value in candidates if value < pivot]
+
+    positions = [index for index, value in enumerate(values) if value > threshold]
+    ties = count - len(positions)
+    positions.extend(
+        itertools.islice((index for index, value in enumerate(values) if value == threshold), ties)
+    )
+    return positions
+
+
+def allocate_cents(total_cents: int, weights: Sequence[int]) -> List[int]:
+    """
+    Split ``total_cents`` in proportion to non-negative integer ``weights``
+    with the largest-remainder method.
+
+    Every share starts at its floor; the leftover cents (fewer than there are
+    weights) go one each to the shares with the largest remainders, earlier
+    positions first on ties. Runs in expected O(n).
+    """
+    if not weights:
+        raise ValueError("weights must not be empty")
+    weight_total = sum(weights)
+    if weight_total <= 0 or any(weight < 0 for weight in weights):
+        raise ValueError("weights must be non-negative and add up to more than zero")
+
+    shares: List[int] = []
+    remainders: List[int] = []
+    for weight in weights:
+        share, remainder = divmod(total_cents * weight, weight_total)
+        shares.append(share)
+        remainders.append(remainder)
+
+    leftover = total_cents - sum(shares)
+    if leftover:
+        for index in _largest_positions(remainders, leftover):
+            shares[index] += 1
+    return shares
+
+
+def allocate_cents_batch(
+    totals: Sequence[int], weights_list: Sequence[Sequence[int]]
+) -> List[List[int]]:
+    """
+    :func:`allocate_cents` for many expenses in one call, as importers split
+    a whole batch of rows: ``totals[i]`` is split by ``weights_list[i]``.
+    Even splits (all weights equal) skip the remainder pass.
+    """
+    if len(totals) != len(weights_list):
+        raise ValueError("totals and weights_list must have the same length")
+    allocations = []
+    for total_cents, weights in zip(totals, weights_list):
+        if weights and weights[0] > 0 and all(weight == weights[0] for weight in weights):
+            allocations.append(split_cents(total_cents, len(weights)))
+        else:
+            allocations.append(allocate_cents(total_cents, weights))
+    return allocations
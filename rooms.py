@@ -0,0 +1,123 @@
+"""
+Rooms: separate groups sharing expenses in one database.
+
+Every member, expense and ledger row belongs to a room, and every query is
+scoped to the room of the current request, so balances, caches and ETags of
+one room never depend on another's data. The room is taken, in order, from
+the ``X-Room-Id`` header (API clients), the ``room`` query argument (which is
+then remembered in the session), the session, or else the default room.
+"""
+
+from __future__ import annotations
+
+from flask import flash, g, jsonify, redirect, render_template, request, session, url_for
+from sqlalchemy import func
+
+from models import DEFAULT_ROOM_ID, Room, db
+
+ROOM_HEADER = "X-Room-Id"
+ROOM_ARG = "room"
+SESSION_ROOM_KEY = "room_id"
+
+
+def parse_room_id(raw) -> int | None:
+    """Room id from a header, query argument or session value (``None`` if absent)."""
+    if raw is None or raw == "":
+        return None
+    try:
+        room_id = int(raw)
+    except (TypeError, ValueError):
+        raise ValueError("Room id must be a positive integer.") from None
+    if room_id < 1:
+        raise ValueError("Room id must be a positive integer.")
+    return room_id
+
+
+def validate_room_name(name, existing_names) -> str:
+    name = (name or "").strip()
+    if not name:
+        raise ValueError("Room name is required.")
+    if len(name) > 80:
+        raise ValueError("Room name must be at most 80 characters.")
+    if name.lower() in existing_names:
+        raise ValueError(f"Room '{name}' already exists.")
+    return name
+
+
+def create_room(name) -> Room:
+    existing = {lowered for (lowered,) in db.session.query(func.lower(Room.name))}
+    room = Room(name=validate_room_name(name, existing))
+    db.session.add(room)
+    db.session.commit()
+    return room
+
+
+def register_rooms(app):
+    @app.before_request
+    def select_room():
+        try:
+            header_room = parse_room_id(request.headers.get(ROOM_HEADER))
+            arg_room = parse_room_id(request.args.get(ROOM_ARG))
+        except ValueError as exc:
+            return _room_not_found(str(exc))
+
+        explicit = header_room or arg_room
+        if explicit is not None:
+            if db.session.get(Room, explicit) is None:
+                return _room_not_found(f"Room {explicit} does not exist.")
+            if header_room is None:
+                session[SESSION_ROOM_KEY] = explicit
+            g.room_id = explicit
+            return None
+
+        remembered = session.get(SESSION_ROOM_KEY)
+        if remembered is not None and db.session.get(Room, remembered) is None:
+            session.pop(SESSION_ROOM_KEY, None)
+            remembered = None
+        g.room_id = remembered or DEFAULT_ROOM_ID
+        return None
+
+    @app.context_processor
+    def room_navigation():
+        # Only the rooms page lists every room, so other renders (including
+        # the partial table rows) stay a primary key lookup.
+        return {"current_room": db.session.get(Room, g.get("room_id", DEFAULT_ROOM_ID))}
+
+    @app.route("/rooms", methods=["GET", "POST"])
+    def rooms_page():
+        if request.method == "POST":
+            try:
+                room = create_room(request.form.get("name"))
+            except ValueError as exc:
+                flash(str(exc), "danger")
+            else:
+                session[SESSION_ROOM_KEY] = room.id
+                flash(f"Room '{room.name}' created.", "success")
+                return redirect(url_for("add_member"))
+        return render_template("rooms.html", rooms=Room.query.order_by(Room.name).all())
+
+    @app.post("/rooms/<int:room_id>/select")
+    def select_room_page(room_id):
+        room = db.get_or_404(Room, room_id)
+        session[SESSION_ROOM_KEY] = room.id
+        return redirect(url_for("index"))
+
+    @app.route("/api/rooms", methods=["GET", "POST"])
+    def api_rooms():
+        if request.method == "POST":
+            payload = request.get_json(silent=True) or {}
+            try:
+                room = create_room(payload.get("name") if isinstance(payload, dict) else None)
+            except ValueError as exc:
+                return jsonify({"error": str(exc)}), 400
+            return jsonify({"id": room.id, "name": room.name}), 201
+
+        return jsonify(
+            [{"id": room.id, "name": room.name} for room in Room.query.order_by(Room.id)]
+        )
+
+
+def _room_not_found(message: str):
+    if request.path.startswith("/api/"):
+        return jsonify({"error": message}), 404
+    return message, 404
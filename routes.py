@@ -1,24 +1,41 @@
 from __future__ import annotations
 
+import base64
+import json
 from datetime import date, datetime
+from functools import wraps
 from decimal import Decimal
-from typing import Dict, Iterable
+from typing import Dict, Iterable, Iterator, List, Tuple
 
-from flask import (flash,jsonify,redirect,render_template,request,url_for)
-from sqlalchemy import func
-from sqlalchemy.orm import joinedload
+from flask import (Response,abort,flash,g,jsonify,make_response,redirect,render_template,request,session,stream_with_context,url_for)
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import aliased, contains_eager, selectinload
 
-from models import Person, Transaction, TransactionShare, db
-from utils import (DEFAULT_CURRENCY_SYMBOL,build_transaction_from_form,compute_balances,compute_person_to_person_debts,split_amount,)
+from bulk import DEFAULT_BULK_CHUNK_SIZE, apply_bulk_operations
+from checkpoints import ledger_as_of
+from directory import invalidate_member_directory, member_directory
+from ledger import (current_ledger_version,forget_member,read_balances,read_net_debts,record_transaction,reverse_transaction,)
+from logger_setup import log_access
+from money import from_cents, split_cents
+from models import (Person,Transaction,TransactionShare,current_room_id,db,packed_member_pattern,unpack_member_ids,)
+from statements import member_statement, serialize_entry
+from search import search_matches, search_terms
+from stats import bucketed_totals, invalidate_stats, payer_totals
+from utils import (DEFAULT_CURRENCY_SYMBOL,build_transaction_from_form,payload_to_form,plan_settlements,split_amount,)
 
 
 def register_routes(app):
-    @app.before_request
-    def log_request_info():
-        client_ip = request.remote_addr
-        method = request.method
-        path = request.path
-        app.logger.info(f"before_request: {method} {path} from {client_ip}")
+    @app.after_request
+    def log_request_info(response):
+        timings = g.get("request_timings")
+        log_access(
+            request.method,
+            request.path,
+            response.status_code,
+            request.remote_addr,
+            timings.started if timings is not None else None,
+        )
+        return response
 
     @app.template_filter("currency")
     def format_currency(value: Decimal | None) -> str:
@@ -26,10 +43,14 @@ def register_routes(app):
             return "-"
         return f"{DEFAULT_CURRENCY_SYMBOL}{Decimal(value):,.2f}"
 
+    @app.template_global("member_name")
+    def member_name(person_id: int) -> str:
+        return member_directory().names.get(person_id, "")
+
 
     @app.route("/", methods=["GET", "POST"])
     def index():
-        members = Person.query.order_by(Person.name).all()
+        members = member_directory().members
         if request.method == "POST":
             try:
                 new_transaction = build_transaction_from_form(request.form, members)
@@ -37,6 +58,8 @@ def register_routes(app):
                 flash(str(exc), "danger")
             else:
                 db.session.add(new_transaction)
+                db.session.flush()
+                record_transaction(new_transaction)
                 db.session.commit()
                 flash("Transaction recorded successfully.", "success")
                 return redirect(url_for("transactions"))
@@ -48,150 +71,169 @@ def register_routes(app):
         )
 
     @app.route("/transactions")
+    @ledger_etag
     def transactions():
-        sort = request.args.get("sort", "-date")
-
-        sort_mapping = {
-            "date": Transaction.date.asc(),
-            "-date": Transaction.date.desc(),
-            "amount": Transaction.amount.asc(),
-            "-amount": Transaction.amount.desc(),
-            "payer": func.lower(Person.name).asc(),
-            "-payer": func.lower(Person.name).desc(),
-        }
-        order_by_clause = sort_mapping.get(sort, Transaction.date.desc())
-
-        query = (
-            Transaction.query.options(
-                joinedload(Transaction.shares).joinedload(TransactionShare.person),
-                joinedload(Transaction.payer),
+        search = request.args.get("q", "").strip()
+        sort = resolve_sort(request.args.get("sort"), search)
+        member_filter = request.args.get("member_id")
+        try:
+            transactions_list, next_cursor = paginate_transactions(
+                sort,
+                member_filter,
+                page_size(request.args.get("limit")),
+                request.args.get("cursor"),
+                search,
             )
-            .join(Person, Transaction.payer)
-            .order_by(order_by_clause)
-        )
+        except ValueError:
+            abort(400)
 
-        member_filter = request.args.get("member_id")
-        if member_filter:
-            query = query.join(
-                TransactionShare,
-                TransactionShare.transaction_id == Transaction.id,
-            ).filter(TransactionShare.person_id == int(member_filter))
+        if request.args.get("partial"):
+            # Rows for the "Load more" button; the next cursor travels in a header.
+            response = make_response(
+                render_template("_transaction_rows.html", transactions=transactions_list)
+            )
+            if next_cursor:
+                response.headers["X-Next-Cursor"] = next_cursor
+            return response
 
-        transactions_list = query.all()
-        members = Person.query.order_by(Person.name).all()
-        balances = compute_balances()
+        members = member_directory().members
+        balances = read_balances()
 
         return render_template(
             "transactions.html",
             transactions=transactions_list,
+            next_cursor=next_cursor,
             members=members,
             balances=balances,
             selected_sort=sort,
             selected_member=member_filter,
+            search=search,
             currency_symbol=DEFAULT_CURRENCY_SYMBOL,
         )
 
     @app.route("/transactions/<int:transaction_id>/edit", methods=["GET", "POST"])
     def edit_transaction(transaction_id):
-        transaction = Transaction.query.get_or_404(transaction_id)
-        members = Person.query.order_by(Person.name).all()
+        transaction = Transaction.query.filter_by(
+            id=transaction_id, room_id=current_room_id()
+        ).first_or_404()
+        members = member_directory().members
 
         if request.method == "POST":
             try:
                 updated_transaction = build_transaction_from_form(request.form, members)
+                reverse_transaction(transaction)
                 # Update existing transaction
                 transaction.date = updated_transaction.date
                 transaction.description = updated_transaction.description
-                transaction.amount = updated_transaction.amount
+                transaction.amount_cents = updated_transaction.amount_cents
                 transaction.comment = updated_transaction.comment
-                transaction.payer = updated_transaction.payer
+                transaction.payer_id = updated_transaction.payer_id
+                transaction.participant_ids = updated_transaction.participant_ids
+                transaction.participant_count = updated_transaction.participant_count
 
-                # Clear old shares and add new ones
+                # Clear old shares and add new ones (none for compact even splits)
                 transaction.shares.clear()
                 db.session.flush()
                 for share in updated_transaction.shares:
                     transaction.shares.append(
-                        TransactionShare(person_id=share.person_id, amount=share.amount)
+                        TransactionShare(
+                            person_id=share.person_id,
+                            room_id=transaction.room_id,
+                            amount_cents=share.amount_cents,
+                        )
                     )
-                
+                db.session.flush()
+                record_transaction(transaction)
                 db.session.commit()
                 flash("Transaction updated successfully.", "success")
                 return redirect(url_for("transactions"))
             except ValueError as exc:
                 flash(str(exc), "danger")
 
-        # Pre-fill form with existing data
-        participant_ids = [share.person_id for share in transaction.shares]
+        # Pre-fill form with existing data; uneven splits are shown as fixed amounts.
+        split = transaction.split()
+        participant_ids = [share.person_id for share in split]
+        even = transaction.is_even_split(split)
         return render_template(
             "edit_transaction.html",
             transaction=transaction,
             members=members,
             participant_ids=participant_ids,
+            split_mode=request.form.get("split_mode") or ("even" if even else "fixed"),
+            split_values={} if even else {
+                share.person_id: share.amount for share in split
+            },
             default_date=transaction.date.strftime("%Y-%m-%d"),
         )
 
     @app.route("/transactions/<int:transaction_id>/delete", methods=["POST"])
     def delete_transaction(transaction_id):
-        transaction = Transaction.query.get_or_404(transaction_id)
+        transaction = Transaction.query.filter_by(
+            id=transaction_id, room_id=current_room_id()
+        ).first_or_404()
+        reverse_transaction(transaction)
         db.session.delete(transaction)
         db.session.commit()
         flash("Transaction deleted successfully.", "success")
         return redirect(url_for("transactions"))
 
     @app.route("/balances")
+    @ledger_etag
     def balances():
         """Page showing person-to-person debt relationships."""
-        members = Person.query.order_by(Person.name).all()
-        debts_raw = compute_person_to_person_debts()
+        directory = member_directory()
+        members = directory.members
         settlements: Dict[int, Dict[str, list]] = {
             member.id: {"owes": [], "owed": []} for member in members
         }
 
-        for index, person in enumerate(members):
-            for other in members[index + 1 :]:
-                net = debts_raw[person.id][other.id] - debts_raw[other.id][person.id]
-                net = net.quantize(Decimal("0.01"))
-                if net > 0:
-                    settlements[person.id]["owes"].append(
-                        {"member": other, "amount": net}
-                    )
-                    settlements[other.id]["owed"].append(
-                        {"member": person, "amount": net}
-                    )
-                elif net < 0:
-                    amount = (-net).quantize(Decimal("0.01"))
-                    settlements[person.id]["owed"].append(
-                        {"member": other, "amount": amount}
-                    )
-                    settlements[other.id]["owes"].append(
-                        {"member": person, "amount": amount}
-                    )
-        balances_dict = compute_balances()
+        for debtor_id, creditor_id, amount in read_net_debts():
+            settlements[debtor_id]["owes"].append(
+                {"member": directory.get(creditor_id), "amount": amount}
+            )
+            settlements[creditor_id]["owed"].append(
+                {"member": directory.get(debtor_id), "amount": amount}
+            )
+        for settlement in settlements.values():
+            settlement["owes"].sort(key=lambda entry: entry["member"].name)
+            settlement["owed"].sort(key=lambda entry: entry["member"].name)
+        balances_dict = read_balances()
+        settlement_plan = [
+            {
+                "debtor": directory.get(debtor_id),
+                "creditor": directory.get(creditor_id),
+                "amount": amount,
+            }
+            for debtor_id, creditor_id, amount in plan_settlements(balances_dict)
+        ]
 
         return render_template(
             "balances.html",
             members=members,
             settlements=settlements,
+            settlement_plan=settlement_plan,
             balances=balances_dict,
             currency_symbol=DEFAULT_CURRENCY_SYMBOL,
         )
 
     @app.route("/members/add", methods=["GET", "POST"])
     def add_member():
-        members = Person.query.order_by(Person.name).all()
+        members = member_directory().members
         if request.method == "POST":
             name = (request.form.get("name") or "").strip()
             if not name:
                 flash("Name is required.", "danger")
             else:
                 # Check if member already exists
-                existing = Person.query.filter_by(name=name).first()
+                existing = Person.query.filter_by(room_id=current_room_id(), name=name).first()
                 if existing:
                     flash(f"Member '{name}' already exists.", "danger")
                 else:
-                    new_member = Person(name=name)
+                    new_member = Person(name=name, room_id=current_room_id())
                     db.session.add(new_member)
                     db.session.commit()
+                    invalidate_member_directory()
+                    invalidate_stats()
                     flash(f"Member '{name}' added successfully.", "success")
                     return redirect(url_for("add_member"))
 
@@ -199,30 +241,38 @@ def register_routes(app):
 
     @app.post("/members/<int:member_id>/edit")
     def edit_member(member_id):
-        member = Person.query.get_or_404(member_id)
+        member = Person.query.filter_by(id=member_id, room_id=current_room_id()).first_or_404()
         new_name = (request.form.get("name") or "").strip()
         if not new_name:
             flash("Name cannot be empty.", "danger")
             return redirect(url_for("add_member"))
 
         if Person.query.filter(
-            Person.id != member.id, func.lower(Person.name) == new_name.lower()
+            Person.room_id == member.room_id,
+            Person.id != member.id,
+            func.lower(Person.name) == new_name.lower(),
         ).first():
             flash(f"Member '{new_name}' already exists.", "danger")
             return redirect(url_for("add_member"))
 
         member.name = new_name
         db.session.commit()
+        invalidate_member_directory()
+        invalidate_stats()
         flash("Member renamed successfully.", "success")
         return redirect(url_for("add_member"))
 
     @app.post("/members/<int:member_id>/delete")
     def delete_member(member_id):
-        member = Person.query.get_or_404(member_id)
+        member = Person.query.filter_by(id=member_id, room_id=current_room_id()).first_or_404()
 
         has_transactions = (
-            Transaction.query.filter_by(payer_id=member.id).first()
-            or TransactionShare.query.filter_by(person_id=member.id).first()
+            Transaction.query.filter_by(room_id=member.room_id, payer_id=member.id).first()
+            or TransactionShare.query.filter_by(room_id=member.room_id, person_id=member.id).first()
+            or Transaction.query.filter(
+                Transaction.room_id == member.room_id,
+                Transaction.participant_ids.like(packed_member_pattern(member.id)),
+            ).first()
         )
         if has_transactions:
             flash(
@@ -231,25 +281,24 @@ def register_routes(app):
             )
             return redirect(url_for("add_member"))
 
+        forget_member(member.id, member.room_id)
         db.session.delete(member)
         db.session.commit()
+        invalidate_member_directory()
+        invalidate_stats()
         flash("Member deleted successfully.", "success")
         return redirect(url_for("add_member"))
 
     @app.route("/diagrams")
+    @ledger_etag
     def diagrams():
         """Page with circle diagrams for transactions count and volume paid."""
-        members = Person.query.order_by(Person.name).all()
-        
-        # Count transactions per person
-        transaction_counts = {}
-        transaction_volumes = {}
-        
-        for member in members:
-            count = Transaction.query.filter_by(payer_id=member.id).count()
-            total = db.session.query(func.sum(Transaction.amount)).filter_by(payer_id=member.id).scalar() or Decimal("0.00")
-            transaction_counts[member.name] = count
-            transaction_volumes[member.name] = float(total)
+        members = member_directory().members
+
+        # Count transactions and volume per person in one grouped query
+        totals = payer_totals()
+        transaction_counts = {row["name"]: row["count"] for row in totals}
+        transaction_volumes = {row["name"]: float(row["total"]) for row in totals}
 
         # Convert to lists for easier template rendering
         count_labels = list(transaction_counts.keys())
@@ -269,49 +318,205 @@ def register_routes(app):
             currency_symbol=DEFAULT_CURRENCY_SYMBOL,
         )
 
+    @app.route("/api/stats")
+    @ledger_etag
+    def api_stats():
+        try:
+            start = _parse_date_arg("start")
+            end = _parse_date_arg("end")
+            bucket = request.args.get("bucket")
+            series = bucketed_totals(bucket, start, end) if bucket else None
+        except ValueError as exc:
+            return jsonify({"error": str(exc)}), 400
+
+        body = {
+            "start": start.isoformat() if start else None,
+            "end": end.isoformat() if end else None,
+            "members": [
+                {
+                    "id": row["id"],
+                    "name": row["name"],
+                    "count": row["count"],
+                    "total": float(row["total"]),
+                }
+                for row in payer_totals(start, end)
+            ],
+        }
+        if series is not None:
+            body["bucket"] = bucket
+            body["series"] = [
+                {
+                    "start": entry["start"].isoformat(),
+                    "count": entry["count"],
+                    "total": float(entry["total"]),
+                    "by_member": {
+                        str(payer_id): {
+                            "count": figures["count"],
+                            "total": float(figures["total"]),
+                        }
+                        for payer_id, figures in entry["by_member"].items()
+                    },
+                }
+                for entry in series
+            ]
+        return jsonify(body)
+
     @app.route("/api/members")
+    @ledger_etag
     def api_members():
-        members = Person.query.order_by(Person.name).all()
+        members = member_directory().members
         return jsonify([{"id": member.id, "name": member.name} for member in members])
 
+    @app.route("/api/settlements")
+    @ledger_etag
+    def api_settlements():
+        names = member_directory().names
+        return jsonify(
+            [
+                {
+                    "from": {"id": debtor_id, "name": names[debtor_id]},
+                    "to": {"id": creditor_id, "name": names[creditor_id]},
+                    "amount": float(amount),
+                }
+                for debtor_id, creditor_id, amount in plan_settlements(read_balances())
+            ]
+        )
+
+    @app.route("/api/balances")
+    @ledger_etag
+    def api_balances():
+        """Balances and net debts now, or after every expense up to ``as_of``."""
+        try:
+            as_of = _parse_date_arg("as_of")
+        except ValueError as exc:
+            return jsonify({"error": str(exc)}), 400
+
+        names = member_directory().names
+        if as_of is None:
+            balances = read_balances()
+            debts = read_net_debts()
+        else:
+            snapshot = ledger_as_of(as_of)
+            balances = {
+                person_id: from_cents(snapshot.balances.get(person_id, 0)) for person_id in names
+            }
+            debts = snapshot.net_debts()
+        return jsonify(
+            {
+                "as_of": as_of.isoformat() if as_of else None,
+                "balances": [
+                    {"id": person_id, "name": name, "balance": float(balances[person_id])}
+                    for person_id, name in names.items()
+                ],
+                "debts": [
+                    {
+                        "from": {"id": debtor_id, "name": names.get(debtor_id, "")},
+                        "to": {"id": creditor_id, "name": names.get(creditor_id, "")},
+                        "amount": float(amount),
+                    }
+                    for debtor_id, creditor_id, amount in debts
+                ],
+            }
+        )
+
+    @app.route("/api/members/<int:member_id>/statement")
+    @ledger_etag
+    def api_member_statement(member_id):
+        """The member's expenses oldest first, with their running balance."""
+        member = Person.query.filter_by(id=member_id, room_id=current_room_id()).first()
+        if member is None:
+            return jsonify({"error": f"Member {member_id} does not exist."}), 404
+        try:
+            start = _parse_date_arg("start")
+            end = _parse_date_arg("end")
+            cursor = request.args.get("cursor")
+            after = decode_cursor(cursor, "date") if cursor else None
+            opening, entries, has_more = member_statement(
+                member_id, start, end, page_size(request.args.get("limit")), after
+            )
+        except ValueError as exc:
+            return jsonify({"error": str(exc)}), 400
+
+        names = member_directory().names
+        return jsonify(
+            {
+                "member": {"id": member.id, "name": member.name},
+                "start": start.isoformat() if start else None,
+                "end": end.isoformat() if end else None,
+                "opening_balance": opening / 100,
+                "entries": [serialize_entry(entry, names) for entry in entries],
+                "next_cursor": (
+                    encode_cursor("date", entries[-1].date, entries[-1].id) if has_more else None
+                ),
+            }
+        )
+
     @app.route("/api/transactions", methods=["GET", "POST"])
+    @ledger_etag
     def api_transactions():
         if request.method == "POST":
             payload = request.get_json(silent=True) or {}
-            form_like = _payload_to_form(payload)
             try:
                 transaction = build_transaction_from_form(
-                    form_like, Person.query.order_by(Person.name).all()
+                    payload_to_form(payload), member_directory().members
                 )
             except ValueError as exc:
                 return jsonify({"error": str(exc)}), 400
             db.session.add(transaction)
+            db.session.flush()
+            record_transaction(transaction)
             db.session.commit()
             return jsonify(serialize_transaction(transaction)), 201
 
-        sort = request.args.get("sort", "-date")
-        sort_mapping = {
-            "date": Transaction.date.asc(),
-            "-date": Transaction.date.desc(),
-            "amount": Transaction.amount.asc(),
-            "-amount": Transaction.amount.desc(),
-        }
-        order_by_clause = sort_mapping.get(sort, Transaction.date.desc())
-
-        query = Transaction.query.options(
-            joinedload(Transaction.shares).joinedload(TransactionShare.person),
-            joinedload(Transaction.payer),
-        ).order_by(order_by_clause)
-
-        member_filter = request.args.get("member_id")
-        if member_filter:
-            query = query.join(
-                TransactionShare,
-                TransactionShare.transaction_id == Transaction.id,
-            ).filter(TransactionShare.person_id == int(member_filter))
+        try:
+            transactions_list, next_cursor = paginate_transactions(
+                request.args.get("sort"),
+                request.args.get("member_id"),
+                page_size(request.args.get("limit")),
+                request.args.get("cursor"),
+                request.args.get("q"),
+            )
+        except ValueError as exc:
+            return jsonify({"error": str(exc)}), 400
+        return jsonify(
+            {
+                "transactions": [serialize_transaction(txn) for txn in transactions_list],
+                "next_cursor": next_cursor,
+            }
+        )
 
-        transactions_list = query.all()
-        return jsonify([serialize_transaction(txn) for txn in transactions_list])
+    @app.post("/api/transactions/bulk")
+    def api_transactions_bulk():
+        payload = request.get_json(silent=True) or {}
+        items = payload.get("items") if isinstance(payload, dict) else None
+        if not isinstance(items, list):
+            return jsonify({"error": "Provide an 'items' list."}), 400
+        try:
+            chunk_size = int(
+                payload.get("chunk_size")
+                or app.config.get("BULK_CHUNK_SIZE", DEFAULT_BULK_CHUNK_SIZE)
+            )
+            results = apply_bulk_operations(items, chunk_size)
+        except ValueError as exc:
+            return jsonify({"error": str(exc)}), 400
+
+        summary = {status: 0 for status in ("created", "updated", "deleted", "error")}
+        for result in results:
+            summary[result["status"]] += 1
+        return jsonify({"results": results, "summary": summary})
+
+    @app.route("/api/transactions/export")
+    def api_transactions_export():
+        export_format = request.args.get("format", "ndjson")
+        if export_format != "ndjson":
+            return jsonify({"error": "Only format=ndjson is supported."}), 400
+        return Response(
+            stream_with_context(
+                json.dumps(item) + "\n" for item in iter_exported_transactions()
+            ),
+            mimetype="application/x-ndjson",
+            headers={"Content-Disposition": "attachment; filename=transactions.ndjson"},
+        )
 
     @app.route("/health")
     def health():
@@ -323,56 +528,337 @@ def register_routes(app):
             return {"status": "error", "message": str(e)}, 500
 
 
-def serialize_transaction(txn: Transaction) -> Dict[str, object]:
+def ledger_etag_value(room_id: int, version: int) -> str:
+    return f"ledger-{room_id}-{version}"
+
+
+# The room is picked by header, query argument or the session cookie.
+LEDGER_VARY = ("X-Room-Id", "Cookie")
+
+
+def ledger_etag(view):
+    """
+    Tag GET responses with the room's ledger version and answer
+    ``If-None-Match`` with 304 before running the view, so an unchanged poll
+    costs one lookup.
+    """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        # Pending flash messages must be rendered, so never short-circuit them.
+        if request.method not in ("GET", "HEAD") or session.get("_flashes"):
+            return view(*args, **kwargs)
+
+        room_id = current_room_id()
+        etag = ledger_etag_value(room_id, current_ledger_version(room_id))
+        if request.if_none_match.contains_weak(etag):
+            response = make_response("", 304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag, weak=True)
+        response.headers["Cache-Control"] = "no-cache"
+        response.vary.update(LEDGER_VARY)
+        return response
+
+    return wrapper
+
+
+def _parse_date_arg(name: str) -> date | None:
+    raw = request.args.get(name)
+    if not raw:
+        return None
+    try:
+        return date.fromisoformat(raw)
+    except ValueError:
+        raise ValueError(f"{name} must be provided in YYYY-MM-DD format.") from None
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# sort name -> (sort key expression, descending, cursor value parser)
+SORT_KEYS = {
+    "date": (Transaction.date, False, date.fromisoformat),
+    "-date": (Transaction.date, True, date.fromisoformat),
+    "amount": (Transaction.amount_cents, False, int),
+    "-amount": (Transaction.amount_cents, True, int),
+    "payer": (func.lower(Person.name), False, str),
+    "-payer": (func.lower(Person.name), True, str),
+    # Search relevance; the key is the ``rank`` column of the search matches.
+    "rank": (None, False, float),
+}
+
+
+def resolve_sort(sort: str | None, search: str | None) -> str:
+    """
+    The requested sort if it is valid. Searches default to ``rank``, which
+    only exists for them; everything else defaults to ``-date``.
+    """
+    searching = bool(search_terms(search))
+    if sort in SORT_KEYS and (sort != "rank" or searching):
+        return sort
+    return "rank" if searching else "-date"
+
+
+def page_size(raw_limit: str | None) -> int:
+    try:
+        limit = int(raw_limit) if raw_limit else DEFAULT_PAGE_SIZE
+    except ValueError:
+        limit = DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def encode_cursor(sort: str, sort_value, transaction_id: int) -> str:
+    """Opaque cursor pointing just past the row with this sort key and id."""
+    if isinstance(sort_value, date):
+        sort_value = str(sort_value)
+    raw = json.dumps([sort, sort_value, transaction_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[object, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, sort_value, transaction_id = json.loads(
+            base64.urlsafe_b64decode(padded)
+        )
+        parse = SORT_KEYS[cursor_sort][2]
+        value = parse(sort_value)
+        transaction_id = int(transaction_id)
+    except Exception:  # noqa: BLE001 - any malformed cursor is a client error
+        raise ValueError("Invalid cursor.") from None
+    if cursor_sort != sort:
+        raise ValueError("Cursor does not match the requested sort.")
+    return value, transaction_id
+
+
+def transaction_page_query(
+    sort: str,
+    member_filter: str | None,
+    limit: int,
+    cursor: str | None = None,
+    search: str | None = None,
+):
+    """
+    Build the query for one page of ``(Transaction, sort value)`` rows ordered
+    by ``(sort key, id)``, fetching one extra row to detect the next page.
+    With ``search``, only the transactions matching it are included.
+
+    Pages are selected with a keyset condition instead of OFFSET, so every page
+    costs the same regardless of how deep into the ledger it is.
+    """
+    sort_key, descending, _ = SORT_KEYS[sort]
+
+    room_id = current_room_id()
+    terms = search_terms(search)
+    matches = (
+        search_matches(terms, room_id, db.engine.dialect.name, ranked=sort == "rank")
+        if terms
+        else None
+    )
+    if sort == "rank":
+        if matches is None:
+            raise ValueError("Sorting by rank needs a search query.")
+        sort_key = matches.c.rank
+
+    query = db.session.query(Transaction, sort_key)
+    if matches is not None:
+        query = query.join(matches, matches.c.id == Transaction.id)
+    query = (
+        query.join(Person, Transaction.payer)
+        # The payer filter is implied, but lets the payer sort walk the
+        # (room_id, lower(name)) index.
+        .filter(Transaction.room_id == room_id, Person.room_id == room_id)
+        .options(
+            contains_eager(Transaction.payer),
+            selectinload(Transaction.shares),
+        )
+    )
+
+    if member_filter:
+        try:
+            member_id = int(member_filter)
+        except ValueError:
+            raise ValueError("member_id must be an integer.") from None
+        # Larger ids cannot be bound as a 64-bit integer parameter.
+        if abs(member_id) >= 2**63:
+            raise ValueError("member_id is out of range.")
+        query = query.filter(
+            or_(
+                Transaction.id.in_(
+                    select(TransactionShare.transaction_id).where(
+                        TransactionShare.room_id == room_id,
+                        TransactionShare.person_id == member_id,
+                    )
+                ),
+                Transaction.participant_ids.like(packed_member_pattern(member_id)),
+            )
+        )
+
+    if cursor:
+        last_value, last_id = decode_cursor(cursor, sort)
+        if descending:
+            query = query.filter(
+                or_(
+                    sort_key < last_value,
+                    and_(sort_key == last_value, Transaction.id < last_id),
+                )
+            )
+        else:
+            query = query.filter(
+                or_(
+                    sort_key > last_value,
+                    and_(sort_key == last_value, Transaction.id > last_id),
+                )
+            )
+
+    if descending:
+        query = query.order_by(sort_key.desc(), Transaction.id.desc())
+    else:
+        query = query.order_by(sort_key.asc(), Transaction.id.asc())
+
+    return query.limit(limit + 1)
+
+
+def paginate_transactions(
+    sort: str | None,
+    member_filter: str | None,
+    limit: int,
+    cursor: str | None = None,
+    search: str | None = None,
+) -> Tuple[List[Transaction], str | None]:
+    """
+    Return one page of transactions and the cursor of the next page (``None``
+    on the last page).
+    """
+    sort = resolve_sort(sort, search)
+    rows = transaction_page_query(sort, member_filter, limit, cursor, search).all()
+    return split_page(rows, sort, limit)
+
+
+def split_page(
+    rows: List[Tuple[Transaction, object]], sort: str, limit: int
+) -> Tuple[List[Transaction], str | None]:
+    """Turn the ``limit + 1`` rows of a page query into a page and its next cursor."""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_txn, last_value = rows[-1]
+        next_cursor = encode_cursor(sort, last_value, last_txn.id)
+    return [txn for txn, _ in rows], next_cursor
+
+
+def serialize_transaction(
+    txn: Transaction, names: Dict[int, str] | None = None
+) -> Dict[str, object]:
+    if names is None:
+        names = member_directory().names
     return {
         "id": txn.id,
         "date": txn.date.isoformat(),
         "description": txn.description,
-        "amount": float(txn.amount),
+        "amount": txn.amount_cents / 100,
         "comment": txn.comment,
         "payer": {
-            "id": txn.payer.id,
-            "name": txn.payer.name,
+            "id": txn.payer_id,
+            "name": names.get(txn.payer_id, ""),
         },
         "shares": [
             {
                 "member": {
-                    "id": share.person.id,
-                    "name": share.person.name,
+                    "id": share.person_id,
+                    "name": names.get(share.person_id, ""),
                 },
-                "amount": float(share.amount),
+                "amount": share.amount_cents / 100,
             }
-            for share in txn.shares
+            for share in txn.split()
         ],
     }
 
 
-def _payload_to_form(payload: Dict[str, object]):
-    """Convert JSON payload to structure compatible with the form helper."""
-
-    class FormAdapter(dict):
-        def getlist(self, key):
-            value = self.get(key, [])
-            if isinstance(value, list):
-                return [str(item) for item in value]
-            return [str(value)]
-
-    adapter = FormAdapter()
-    adapter.update(
-        {
-            "description": payload.get("description", ""),
-            "date": payload.get("date", ""),
-            "amount": str(payload.get("amount", "")),
-            "comment": payload.get("comment", ""),
-        }
+EXPORT_BATCH_SIZE = 1000
+
+
+def iter_exported_transactions() -> Iterator[Dict[str, object]]:
+    """
+    Yield every transaction of the current room, with its shares, in the shape
+    of :func:`serialize_transaction`, ordered by id.
+
+    Reads one flat join of transactions and shares through a server-side cursor
+    in batches, so memory use does not depend on the size of the ledger.
+    Compact even splits have no share rows; their shares are derived from the
+    packed participant ids.
+    """
+    names = member_directory().names
+    payer = aliased(Person)
+    participant = aliased(Person)
+    stmt = (
+        select(
+            Transaction.id,
+            Transaction.date,
+            Transaction.description,
+            Transaction.amount_cents,
+            Transaction.comment,
+            Transaction.participant_ids,
+            payer.id,
+            payer.name,
+            participant.id,
+            participant.name,
+            TransactionShare.amount_cents,
+        )
+        .join(payer, Transaction.payer_id == payer.id)
+        .outerjoin(TransactionShare, TransactionShare.transaction_id == Transaction.id)
+        .outerjoin(participant, TransactionShare.person_id == participant.id)
+        .where(Transaction.room_id == current_room_id())
+        .order_by(Transaction.id, TransactionShare.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
     )
 
-    payer_id = payload.get("payer_id") or payload.get("payerId")
-    if payer_id is not None:
-        adapter["payer_id"] = str(payer_id)
-
-    participants = payload.get("participant_ids") or payload.get("participants") or []
-    adapter["participants"] = [str(member_id) for member_id in participants]
-
-    return adapter
-
+    current = None
+    for (
+        txn_id,
+        txn_date,
+        description,
+        amount_cents,
+        comment,
+        participant_ids,
+        payer_id,
+        payer_name,
+        member_id,
+        member_name,
+        share_cents,
+    ) in db.session.execute(stmt):
+        if current is None or current["id"] != txn_id:
+            if current is not None:
+                yield current
+            current = {
+                "id": txn_id,
+                "date": txn_date.isoformat(),
+                "description": description,
+                "amount": amount_cents / 100,
+                "comment": comment,
+                "payer": {"id": payer_id, "name": payer_name},
+                "shares": [],
+            }
+            if participant_ids is not None:
+                member_ids = unpack_member_ids(participant_ids)
+                current["shares"] = [
+                    {
+                        "member": {"id": person_id, "name": names.get(person_id, "")},
+                        "amount": cents / 100,
+                    }
+                    for person_id, cents in zip(
+                        member_ids, split_cents(amount_cents, len(member_ids))
+                    )
+                ]
+        if member_id is not None:
+            current["shares"].append(
+                {
+                    "member": {"id": member_id, "name": member_name},
+                    "amount": share_cents / 100,
+                }
+            )
+    if current is not None:
+        yield current
@@ -0,0 +1,153 @@
+"""
+Full-text search over expense descriptions and comments.
+
+On SQLite the text lives in ``transactions_fts``, an FTS5 table indexing the
+``transactions`` rows in place (``content='transactions'``), kept in sync by
+triggers on every insert, update and delete, including bulk and import
+writes. On PostgreSQL a generated ``search_vector`` tsvector column with a
+GIN index serves the same purpose. Both are created with the transactions
+table (``after_create``) and by migration 5 for existing databases.
+
+Every word of a query has to match as a whole word, ignoring case and
+accents. Matches are ranked by bm25 on SQLite and ``ts_rank``
+on PostgreSQL, best first, with descriptions weighing more than comments.
+Scoring touches every candidate, so a ranked search only scores the latest
+``SEARCH_RANK_WINDOW`` matches in the room; older matches follow them,
+newest first, so every match is still returned.
+"""
+
+from __future__ import annotations
+
+import re
+from typing import List
+
+from sqlalchemy import Double, case, cast, column, event, func, literal_column, select, table, text
+
+from models import Transaction
+
+SEARCH_TABLE = "transactions_fts"
+SEARCH_VECTOR = "search_vector"
+MAX_SEARCH_TERMS = 8
+# Ranking scores every candidate, so ranked searches only score the most
+# recent matches in the room and list the older ones after them by recency.
+SEARCH_RANK_WINDOW = 1000
+
+_SQLITE_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+    " description, comment, content='transactions', content_rowid='id',"
+    " tokenize='unicode61 remove_diacritics 2')",
+    # Descriptions weigh twice as much as comments.
+    f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rank) VALUES ('rank', 'bm25(2.0, 1.0)')",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_insert AFTER INSERT ON transactions BEGIN"
+    f" INSERT INTO {SEARCH_TABLE} (rowid, description, comment)"
+    " VALUES (new.id, new.description, new.comment); END",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_delete AFTER DELETE ON transactions BEGIN"
+    f" INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, description, comment)"
+    " VALUES ('delete', old.id, old.description, old.comment); END",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_update"
+    " AFTER UPDATE OF description, comment ON transactions BEGIN"
+    f" INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, description, comment)"
+    " VALUES ('delete', old.id, old.description, old.comment);"
+    f" INSERT INTO {SEARCH_TABLE} (rowid, description, comment)"
+    " VALUES (new.id, new.description, new.comment); END",
+)
+
+_POSTGRESQL_DDL = (
+    f"ALTER TABLE transactions ADD COLUMN IF NOT EXISTS {SEARCH_VECTOR} tsvector"
+    " GENERATED ALWAYS AS ("
+    " setweight(to_tsvector('simple', coalesce(description, '')), 'A') ||"
+    " setweight(to_tsvector('simple', coalesce(comment, '')), 'B')) STORED",
+    f"CREATE INDEX IF NOT EXISTS ix_transactions_search ON transactions USING GIN ({SEARCH_VECTOR})",
+)
+
+
+def create_search_index(connection) -> None:
+    """Create the search index of the transactions table and fill it."""
+    if connection.dialect.name == "sqlite":
+        for statement in _SQLITE_DDL:
+            connection.exec_driver_sql(statement)
+        connection.exec_driver_sql(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('rebuild')")
+    elif connection.dialect.name == "postgresql":
+        for statement in _POSTGRESQL_DDL:
+            connection.exec_driver_sql(statement)
+
+
+@event.listens_for(Transaction.__table__, "after_create")
+def _create_search_index(target, connection, **kw) -> None:
+    create_search_index(connection)
+
+
+@event.listens_for(Transaction.__table__, "after_drop")
+def _drop_search_index(target, connection, **kw) -> None:
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+def search_terms(query: str | None) -> List[str]:
+    """Lower-cased words of a search query; everything else is ignored."""
+    return re.findall(r"\w+", (query or "").lower())[:MAX_SEARCH_TERMS]
+
+
+def search_matches(terms: List[str], room_id: int, dialect: str, ranked: bool):
+    """
+    Subquery of the ``id`` of the transactions matching every term; with
+    ``ranked``, also their ``rank`` (lower is better). Only the room's latest
+    ``SEARCH_RANK_WINDOW`` matches are scored; older ones rank after them,
+    newest first.
+    """
+    if dialect == "postgresql":
+        tsquery = func.to_tsquery("simple", " & ".join(terms))
+        vector = literal_column(f"transactions.{SEARCH_VECTOR}")
+        matching = (Transaction.room_id == room_id, vector.op("@@")(tsquery))
+        if not ranked:
+            return select(Transaction.id.label("id")).where(*matching).subquery("matches")
+        window_start = (
+            select(Transaction.id)
+            .where(*matching)
+            .order_by(Transaction.id.desc())
+            .offset(SEARCH_RANK_WINDOW - 1)
+            .limit(1)
+            .scalar_subquery()
+        )
+        # ts_rank is a float4; keyset cursors compare it as a double.
+        score = -cast(func.ts_rank(vector, tsquery), Double())
+        return (
+            select(Transaction.id.label("id"), _windowed_rank(Transaction.id, window_start, score))
+            .where(*matching)
+            .subquery("matches")
+        )
+
+    fts = table(SEARCH_TABLE, column("rowid"), column("rank"))
+    # Quoted terms keep FTS5 operators in the input from being interpreted.
+    match = " ".join(f'"{term}"' for term in terms)
+    matching = text(f"{SEARCH_TABLE} MATCH :search_match").bindparams(search_match=match)
+    if not ranked:
+        return select(fts.c.rowid.label("id")).where(matching).subquery("matches")
+    # FTS5 returns matches newest first without scoring them; the room is
+    # checked by primary key.
+    window_start = (
+        select(fts.c.rowid)
+        .join(Transaction, Transaction.id == fts.c.rowid)
+        .where(matching, Transaction.room_id == room_id)
+        .order_by(fts.c.rowid.desc())
+        .offset(SEARCH_RANK_WINDOW - 1)
+        .limit(1)
+        .scalar_subquery()
+    )
+    return (
+        select(fts.c.rowid.label("id"), _windowed_rank(fts.c.rowid, window_start, fts.c.rank))
+        .where(matching)
+        .subquery("matches")
+    )
+
+
+def _windowed_rank(transaction_id, window_start, score):
+    """
+    ``score`` for the matches in the rank window and, past it, a rank above
+    any score (scores are never positive) that grows with age.
+    """
+    window_start = func.coalesce(window_start, 0)
+    return case(
+        (transaction_id >= window_start, score),
+        else_=cast(window_start - transaction_id, Double()),
+    ).label("rank")
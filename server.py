@@ -3,7 +3,11 @@ from pathlib import Path
 
 from flask import Flask
 
-from models import db
+from commands import register_commands
+from engine_profiles import engine_report, init_engine
+from ledger import sync_ledger
+from metrics import register_metrics
+from rooms import register_rooms
 from routes import register_routes
 from utils import initialize_database
 
@@ -43,17 +47,31 @@ else:
 app.config["SQLALCHEMY_DATABASE_URI"] = database_uri
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "dev-secret-key-change-in-production")
+app.config["BALANCE_ENGINE"] = os.getenv("BALANCE_ENGINE", "sql")
+app.config["COMPACT_EVEN_SPLITS"] = os.getenv("COMPACT_EVEN_SPLITS", "0") == "1"
+app.config["DB_ENGINE_PROFILE"] = os.getenv("DB_ENGINE_PROFILE", "web")
+app.config["LEDGER_CHECKPOINT_INTERVAL"] = os.getenv("LEDGER_CHECKPOINT_INTERVAL", "month")
 
-db.init_app(app)
+init_engine(app)
 
 # Register all routes
+register_metrics(app)
+register_rooms(app)
 register_routes(app)
+register_commands(app)
 
 # Initialize database
 try:
     with app.app_context():
         initialize_database()
+        sync_ledger()
         app.logger.info("Database initialized successfully")
+        app.logger.info(
+            "Database engine profile %s: %s",
+            app.config["DB_ENGINE_PROFILE"],
+            engine_report(),
+            extra={"engine_profile": app.config["DB_ENGINE_PROFILE"]},
+        )
 except Exception as e:
     app.logger.error(f"Error initializing database: {e}", exc_info=True)
     # Don't fail completely - let the app start and handle errors per request
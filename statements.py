@@ -0,0 +1,204 @@
+"""
+Member statements: every expense a member paid for or shared in, oldest
+first, with their running balance.
+
+A page is one SQL statement. The member's payments, share rows and compact
+even-split shares after the ``(date, id)`` keyset are combined with
+``UNION ALL`` (each kind limited to the page size), grouped per transaction,
+and a ``SUM(...) OVER (ORDER BY date, id)`` window adds up the running
+balance (SQLite 3.25+ or PostgreSQL). The balance before the page comes from
+the balance checkpoints (``checkpoints.ledger_before``) plus the expenses
+earlier on the cursor's day, so no page reads the older history.
+"""
+
+from __future__ import annotations
+
+from datetime import date
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import and_, func, literal, or_, select, union_all
+
+from checkpoints import ledger_before
+from compact import compact_share_cents
+from models import Transaction, TransactionShare, current_room_id, db, packed_member_pattern
+
+
+class StatementEntry(NamedTuple):
+    id: int
+    date: date
+    description: str
+    comment: Optional[str]
+    payer_id: int
+    amount_cents: int
+    paid_cents: int
+    share_cents: int
+    balance_cents: int
+
+    @property
+    def change_cents(self) -> int:
+        return self.paid_cents - self.share_cents
+
+
+def _member_rows(member_id: int, conditions, limit: Optional[int] = None):
+    """
+    ``(id, date, paid, owed)`` rows of the member's payments, share rows and
+    compact shares matching ``conditions``; with ``limit``, only the first
+    ``limit`` of each kind by ``(date, id)``.
+    """
+    paid = select(
+        Transaction.id.label("id"),
+        Transaction.date.label("date"),
+        Transaction.amount_cents.label("paid"),
+        literal(0).label("owed"),
+    ).where(Transaction.payer_id == member_id, *conditions)
+    shared = (
+        select(Transaction.id, Transaction.date, literal(0), TransactionShare.amount_cents)
+        .join_from(TransactionShare, Transaction, TransactionShare.transaction_id == Transaction.id)
+        .where(TransactionShare.person_id == member_id, *conditions)
+    )
+    compact = select(
+        Transaction.id, Transaction.date, literal(0), compact_share_cents(member_id)
+    ).where(Transaction.participant_ids.like(packed_member_pattern(member_id)), *conditions)
+
+    branches = [paid, shared, compact]
+    if limit is not None:
+        # A page of N transactions comes from the first N rows of each kind.
+        branches = [
+            select(*branch.order_by(Transaction.date, Transaction.id).limit(limit).subquery().c)
+            for branch in branches
+        ]
+    return union_all(*branches).subquery("rows")
+
+
+def opening_balance_cents(member_id: int, after: Tuple[date, int]) -> int:
+    """The member's balance after every expense up to the ``(date, id)`` keyset ``after``."""
+    after_date, after_id = after
+    balance = ledger_before(after_date).balances.get(member_id, 0)
+    same_day = _member_rows(
+        member_id,
+        [
+            Transaction.room_id == current_room_id(),
+            Transaction.date == after_date,
+            Transaction.id <= after_id,
+        ],
+    )
+    return balance + int(
+        db.session.query(func.coalesce(func.sum(same_day.c.paid - same_day.c.owed), 0)).scalar()
+    )
+
+
+def statement_query(
+    member_id: int,
+    start: Optional[date],
+    end: Optional[date],
+    limit: int,
+    after: Optional[Tuple[date, int]] = None,
+):
+    """
+    The first ``limit + 1`` statement rows of ``member_id`` in the current
+    room, dated ``start``..``end`` and after the ``(date, id)`` keyset
+    ``after``. ``balance`` starts from zero; the caller adds the opening
+    balance.
+    """
+    conditions = [Transaction.room_id == current_room_id()]
+    if start is not None:
+        conditions.append(Transaction.date >= start)
+    if end is not None:
+        conditions.append(Transaction.date <= end)
+    if after is not None:
+        after_date, after_id = after
+        conditions.append(
+            or_(
+                Transaction.date > after_date,
+                and_(Transaction.date == after_date, Transaction.id > after_id),
+            )
+        )
+    rows = _member_rows(member_id, conditions, limit + 1)
+
+    change = func.sum(rows.c.paid) - func.sum(rows.c.owed)
+    entries = (
+        select(
+            rows.c.id,
+            rows.c.date,
+            func.sum(rows.c.paid).label("paid"),
+            func.sum(rows.c.owed).label("owed"),
+            func.sum(change)
+            .over(order_by=(rows.c.date, rows.c.id), rows=(None, 0))
+            .label("balance"),
+        )
+        .group_by(rows.c.id, rows.c.date)
+        .subquery("entries")
+    )
+    return (
+        select(
+            entries.c.id,
+            entries.c.date,
+            Transaction.description,
+            Transaction.comment,
+            Transaction.payer_id,
+            Transaction.amount_cents,
+            entries.c.paid,
+            entries.c.owed,
+            entries.c.balance,
+        )
+        .join(Transaction, Transaction.id == entries.c.id)
+        .order_by(entries.c.date, entries.c.id)
+        .limit(limit + 1)
+    )
+
+
+def member_statement(
+    member_id: int,
+    start: Optional[date],
+    end: Optional[date],
+    limit: int,
+    after: Optional[Tuple[date, int]] = None,
+) -> Tuple[int, List[StatementEntry], bool]:
+    """
+    Return the balance before the page, up to ``limit`` entries with their
+    running balance, and whether more entries follow.
+    """
+    if start is not None and end is not None and start > end:
+        raise ValueError("start must not be after end.")
+    if after is not None and start is not None and after[0] < start:
+        raise ValueError("Cursor is outside the requested range.")
+
+    if after is not None:
+        opening = opening_balance_cents(member_id, after)
+    elif start is not None:
+        opening = ledger_before(start).balances.get(member_id, 0)
+    else:
+        opening = 0
+    rows = db.session.execute(statement_query(member_id, start, end, limit, after)).all()
+    entries = [
+        StatementEntry(
+            txn_id,
+            txn_date,
+            description,
+            comment,
+            payer_id,
+            amount_cents,
+            int(paid),
+            int(owed),
+            opening + int(balance),
+        )
+        for txn_id, txn_date, description, comment, payer_id, amount_cents, paid, owed, balance in rows[
+            :limit
+        ]
+    ]
+    return opening, entries, len(rows) > limit
+
+
+def serialize_entry(entry: StatementEntry, names: Dict[int, str]) -> Dict[str, object]:
+    return {
+        "id": entry.id,
+        "date": entry.date.isoformat(),
+        "description": entry.description,
+        "comment": entry.comment,
+        "amount": entry.amount_cents / 100,
+        "payer": {"id": entry.payer_id, "name": names.get(entry.payer_id, "")},
+        "paid": entry.paid_cents / 100,
+        "share": entry.share_cents / 100,
+        "change": entry.change_cents / 100,
+        "balance": entry.balance_cents / 100,
+    }
@@ -0,0 +1,170 @@
+"""
+Aggregate payment statistics for the diagrams page and ``GET /api/stats``.
+
+Per-member totals come from one grouped query instead of two queries per
+member, and time series are folded into day/week/month buckets from one
+``GROUP BY date, payer_id`` aggregate so the SQL stays portable between SQLite
+and PostgreSQL. Results are cached per application in each worker process,
+keyed on the room and its ledger version, so a write on any worker is seen by
+the next request; this worker's commits also drop the room's entries at once.
+``STATS_CACHE_TTL`` and ``STATS_CACHE_SIZE`` only bound the memory a worker
+spends on them (least recently used first out).
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from flask import current_app, has_app_context
+from sqlalchemy import and_, func
+
+from ledger import current_ledger_version, on_ledger_commit
+from models import Person, Transaction, current_room_id, db
+from money import from_cents
+
+STATS_BUCKETS = ("day", "week", "month")
+STATS_CACHE_TTL = 60.0
+STATS_CACHE_SIZE = 256
+
+_cache_lock = threading.Lock()
+
+
+def _app_cache() -> OrderedDict[Hashable, Tuple[float, object]]:
+    return current_app.extensions.setdefault("stats_cache", OrderedDict())
+
+
+@on_ledger_commit
+def invalidate_stats(room_id: Optional[int] = None) -> None:
+    """Forget the cached statistics of ``room_id`` (the current room by default)."""
+    if has_app_context():
+        room_id = room_id or current_room_id()
+        with _cache_lock:
+            cache = _app_cache()
+            for key in [key for key in cache if key[0] == room_id]:
+                del cache[key]
+
+
+def _cached(key: Tuple[Hashable, ...], compute):
+    room_id = current_room_id()
+    key = (room_id, current_ledger_version(room_id), *key)
+    now = time.monotonic()
+    ttl = current_app.config.get("STATS_CACHE_TTL", STATS_CACHE_TTL)
+    with _cache_lock:
+        entry = _app_cache().get(key)
+        if entry is not None and now - entry[0] < ttl:
+            _app_cache().move_to_end(key)
+            return entry[1]
+    value = compute()
+    with _cache_lock:
+        cache = _app_cache()
+        cache[key] = (now, value)
+        cache.move_to_end(key)
+        # Drop expired results, then the least recently used over the limit.
+        for stale in [stale for stale, (stored, _) in cache.items() if now - stored >= ttl]:
+            del cache[stale]
+        while len(cache) > current_app.config.get("STATS_CACHE_SIZE", STATS_CACHE_SIZE):
+            cache.popitem(last=False)
+    return value
+
+
+def _date_filters(start: Optional[date], end: Optional[date]) -> list:
+    conditions = []
+    if start is not None:
+        conditions.append(Transaction.date >= start)
+    if end is not None:
+        conditions.append(Transaction.date <= end)
+    return conditions
+
+
+def bucket_start(day: date, bucket: str) -> date:
+    """First day of the day/week (ISO, Monday)/month bucket containing ``day``."""
+    if bucket == "day":
+        return day
+    if bucket == "week":
+        return day - timedelta(days=day.weekday())
+    if bucket == "month":
+        return day.replace(day=1)
+    raise ValueError(f"bucket must be one of {', '.join(STATS_BUCKETS)}")
+
+
+def payer_totals(
+    start: Optional[date] = None, end: Optional[date] = None
+) -> List[Dict[str, object]]:
+    """
+    Return ``{"id", "name", "count", "total"}`` per member of the current room
+    (ordered by name):
+    how many transactions they paid for and the total amount, in one query.
+    """
+
+    def compute():
+        rows = (
+            db.session.query(
+                Person.id,
+                Person.name,
+                func.count(Transaction.id),
+                func.coalesce(func.sum(Transaction.amount_cents), 0),
+            )
+            .outerjoin(
+                Transaction,
+                and_(Transaction.payer_id == Person.id, *_date_filters(start, end)),
+            )
+            .filter(Person.room_id == current_room_id())
+            .group_by(Person.id, Person.name)
+            .order_by(Person.name)
+        )
+        return [
+            {"id": person_id, "name": name, "count": count, "total": from_cents(cents)}
+            for person_id, name, count, cents in rows
+        ]
+
+    return _cached(("payer_totals", start, end), compute)
+
+
+def bucketed_totals(
+    bucket: str, start: Optional[date] = None, end: Optional[date] = None
+) -> List[Dict[str, object]]:
+    """
+    Return one entry per non-empty bucket, oldest first, with the bucket start
+    date, overall count and total, and the same figures per paying member.
+    """
+    bucket_start(date.today(), bucket)  # validate early, outside the cache
+
+    def compute():
+        rows = (
+            db.session.query(
+                Transaction.date,
+                Transaction.payer_id,
+                func.count(Transaction.id),
+                func.sum(Transaction.amount_cents),
+            )
+            .filter(Transaction.room_id == current_room_id(), *_date_filters(start, end))
+            .group_by(Transaction.date, Transaction.payer_id)
+        )
+        buckets: Dict[date, Dict[str, object]] = {}
+        for day, payer_id, count, cents in rows:
+            key = bucket_start(day, bucket)
+            entry = buckets.setdefault(key, {"count": 0, "cents": 0, "by_member": {}})
+            entry["count"] += count
+            entry["cents"] += int(cents)
+            member = entry["by_member"].setdefault(payer_id, {"count": 0, "cents": 0})
+            member["count"] += count
+            member["cents"] += int(cents)
+
+        return [
+            {
+                "start": key,
+                "count": entry["count"],
+                "total": from_cents(entry["cents"]),
+                "by_member": {
+                    payer_id: {"count": member["count"], "total": from_cents(member["cents"])}
+                    for payer_id, member in sorted(entry["by_member"].items())
+                },
+            }
+            for key, entry in sorted(buckets.items())
+        ]
+
+    return _cached(("bucketed_totals", bucket, start, end), compute)
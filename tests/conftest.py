@@ -5,9 +5,12 @@ import tempfile
 import pytest
 from flask import Flask
 
-from models import db
+from commands import register_commands
+from metrics import register_metrics
+from models import Person, db
+from rooms import register_rooms
 from routes import register_routes
-from utils import initialize_database
+from utils import ensure_default_room, initialize_database
 
 
 @pytest.fixture
@@ -16,17 +19,25 @@ def app():
     # Create temporary database
     db_fd, db_path = tempfile.mkstemp()
     
-    app = Flask(__name__, instance_relative_config=True)
+    app = Flask(
+        __name__,
+        instance_relative_config=True,
+        template_folder=os.path.join(os.path.dirname(__file__), "..", "templates"),
+    )
     app.config["TESTING"] = True
     app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     app.config["SECRET_KEY"] = "test-secret-key"
     
     db.init_app(app)
+    register_metrics(app)
+    register_rooms(app)
     register_routes(app)
+    register_commands(app)
     
     with app.app_context():
         db.create_all()
+        ensure_default_room()
         # Don't seed default members in tests - let tests create their own
     
     yield app
@@ -48,3 +59,31 @@ def runner(app):
     return app.test_cli_runner()
 
 
+
+
+@pytest.fixture
+def members(request, app):
+    """Create the class's ``MEMBER_NAMES`` (default Alice, Bob, Carol) and return their ids."""
+    names = getattr(request.cls, "MEMBER_NAMES", ("Alice", "Bob", "Carol"))
+    with app.app_context():
+        people = [Person(name=name) for name in names]
+        db.session.add_all(people)
+        db.session.commit()
+        return [person.id for person in people]
+
+
+@pytest.fixture
+def expense():
+    """Build the JSON payload of an expense for the transactions API."""
+
+    def build(payer_id, participant_ids, amount="10.00", **fields):
+        return {
+            "description": "Groceries",
+            "date": "2025-03-01",
+            "amount": amount,
+            "payer_id": payer_id,
+            "participant_ids": participant_ids,
+            **fields,
+        }
+
+    return build
@@ -1,10 +1,25 @@
 """Integration tests for API endpoints."""
 
+import asyncio
+import json
+import logging
+import re
+
 import pytest
 from datetime import date
 from decimal import Decimal
 
-from models import Person, Transaction, TransactionShare, db
+from sqlalchemy import event, func, insert, inspect
+
+import checkpoints
+from checkpoints import ledger_as_of
+from directory import member_directory
+from ledger import bump_ledger_version, check_consistency, read_balances, read_net_debts, sync_ledger
+from logger_setup import ACCESS_LOGGER
+from migrations import MIGRATIONS, applied_versions, upgrade_database
+from models import LedgerCheckpoint, MemberBalance, Person, Room, Transaction, TransactionShare, db, use_room
+from routes import paginate_transactions, transaction_page_query
+from utils import compute_balances
 
 
 class TestAPIMembers:
@@ -39,6 +54,111 @@ class TestAPIMembers:
         assert "name" in data[0]
 
 
+class TestMemberDirectory:
+    """Test the cached member directory."""
+
+    def _directory_queries(self, app, client, url):
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            if "WHERE people.room_id = ? ORDER BY people.name" in statement:
+                statements.append(statement)
+
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            client.get(url)
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+        return len(statements)
+
+    def test_directory_is_shared_and_invalidated(self, client, app):
+        with app.app_context():
+            db.session.add_all([Person(name="Alice"), Person(name="Bob")])
+            db.session.commit()
+            alice_id = Person.query.filter_by(name="Alice").one().id
+
+        assert self._directory_queries(app, client, "/transactions") == 1
+        assert self._directory_queries(app, client, "/transactions") == 0
+        assert self._directory_queries(app, client, "/balances") == 0
+
+        client.post(f"/members/{alice_id}/edit", data={"name": "Alicia"})
+        assert [m["name"] for m in client.get("/api/members").get_json()] == ["Alicia", "Bob"]
+
+        client.post("/members/add", data={"name": "Carol"})
+        assert len(client.get("/api/members").get_json()) == 3
+
+    def test_directory_follows_other_workers(self, app):
+        with app.app_context():
+            db.session.add(Person(name="Alice"))
+            db.session.commit()
+        # Every app context stands for one request of this worker.
+        with app.app_context():
+            assert list(member_directory().names.values()) == ["Alice"]
+        with app.app_context():
+            # Another worker's write: no local invalidation, only the version bump.
+            db.session.execute(insert(Person).values(name="Bob", room_id=1))
+            bump_ledger_version()
+            db.session.commit()
+        with app.app_context():
+            assert list(member_directory().names.values()) == ["Alice", "Bob"]
+
+
+class TestLedgerETags:
+    """Test ETag / 304 handling driven by the ledger version."""
+
+    def test_unchanged_poll_returns_304(self, client, app):
+        with app.app_context():
+            alice = Person(name="Alice")
+            db.session.add(alice)
+            db.session.commit()
+            alice_id = alice.id
+
+        first = client.get("/api/transactions")
+        etag = first.headers["ETag"]
+        assert first.status_code == 200
+
+        statements = []
+        with app.app_context():
+            engine = db.engine
+
+        def listener(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(engine, "before_cursor_execute", listener)
+        try:
+            again = client.get("/api/transactions", headers={"If-None-Match": etag})
+        finally:
+            event.remove(engine, "before_cursor_execute", listener)
+        assert again.status_code == 304
+        assert again.headers["ETag"] == etag
+        assert len(statements) == 1
+        assert "transactions" not in statements[0]
+
+        client.post(
+            "/api/transactions",
+            json={
+                "description": "Tea",
+                "date": "2025-01-01",
+                "amount": "3.00",
+                "payer_id": alice_id,
+                "participants": [alice_id],
+            },
+        )
+        changed = client.get("/api/transactions", headers={"If-None-Match": etag})
+        assert changed.status_code == 200
+        assert changed.headers["ETag"] != etag
+
+    def test_member_changes_bump_version(self, client, app):
+        etag = client.get("/api/members").headers["ETag"]
+        client.post("/members/add", data={"name": "Dana"})
+        client.get("/members/add")  # consume the flash message
+        response = client.get("/api/members", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.get_json()[0]["name"] == "Dana"
+
+
 class TestAPITransactions:
     """Test /api/transactions endpoint."""
 
@@ -94,7 +214,7 @@ class TestAPITransactions:
         response = client.get("/api/transactions")
         assert response.status_code == 200
         
-        data = response.get_json()
+        data = response.get_json()["transactions"]
         assert isinstance(data, list)
         assert len(data) >= 1
         
@@ -173,7 +293,7 @@ class TestAPITransactions:
         response = client.get(f"/api/transactions?member_id={sample_data['participant_id']}")
         assert response.status_code == 200
         
-        data = response.get_json()
+        data = response.get_json()["transactions"]
         assert isinstance(data, list)
         # Should return transactions where this member is a participant
         if len(data) > 0:
@@ -184,3 +304,1634 @@ class TestAPITransactions:
             )
 
 
+
+
+class TestTransactionPagination:
+    """Test keyset pagination of the transaction listings."""
+
+    @pytest.fixture
+    def ledger(self, app):
+        with app.app_context():
+            people = [Person(name="alice"), Person(name="Bob"), Person(name="carol")]
+            db.session.add_all(people)
+            db.session.commit()
+            for i in range(11):
+                db.session.add(
+                    Transaction(
+                        description=f"Expense {i}",
+                        date=date(2025, 1, 1 + i % 3),
+                        amount=Decimal(f"{10 + i % 4}.50"),
+                        payer_id=people[i % 3].id,
+                        shares=[
+                            TransactionShare(person_id=people[0].id, amount=Decimal("1.00"))
+                        ],
+                    )
+                )
+            db.session.commit()
+
+    @pytest.mark.parametrize("sort", ["date", "-date", "amount", "-amount", "payer", "-payer"])
+    def test_pages_cover_every_row_once(self, client, ledger, sort):
+        """Walking the cursors returns the same rows as one large page."""
+        everything = client.get(f"/api/transactions?sort={sort}&limit=100").get_json()
+        assert everything["next_cursor"] is None
+        expected = [txn["id"] for txn in everything["transactions"]]
+
+        seen = []
+        url = f"/api/transactions?sort={sort}&limit=4"
+        while url:
+            page = client.get(url).get_json()
+            assert len(page["transactions"]) <= 4
+            seen.extend(txn["id"] for txn in page["transactions"])
+            cursor = page["next_cursor"]
+            url = f"/api/transactions?sort={sort}&limit=4&cursor={cursor}" if cursor else None
+
+        assert seen == expected
+        assert len(seen) == 11
+
+    def test_invalid_cursor(self, client, ledger):
+        """A malformed or mismatched cursor is rejected."""
+        assert client.get("/api/transactions?cursor=garbage").status_code == 400
+
+        page = client.get("/api/transactions?sort=amount&limit=2").get_json()
+        response = client.get(f"/api/transactions?sort=date&cursor={page['next_cursor']}")
+        assert response.status_code == 400
+
+    def test_invalid_member_filter(self, client, ledger):
+        """A non-numeric member filter is rejected with a clean message."""
+        response = client.get("/api/transactions?member_id=abc")
+        assert response.status_code == 400
+        assert response.get_json() == {"error": "member_id must be an integer."}
+        assert client.get("/transactions?member_id=abc").status_code == 400
+        response = client.get(f"/api/transactions?member_id={2**63}")
+        assert response.get_json() == {"error": "member_id is out of range."}
+
+    def test_html_loads_more_rows(self, client, ledger):
+        """The HTML table renders one page and serves further rows on demand."""
+        response = client.get("/transactions?limit=5")
+        assert response.status_code == 200
+        assert response.get_data(as_text=True).count("<tr>") == 5 + 1  # plus header row
+        assert "load-more" in response.get_data(as_text=True)
+
+        cursor = client.get("/api/transactions?limit=5").get_json()["next_cursor"]
+        partial = client.get(f"/transactions?limit=5&partial=1&cursor={cursor}")
+        assert partial.get_data(as_text=True).count("<tr>") == 5
+        assert partial.headers.get("X-Next-Cursor")
+
+
+class TestTransactionSearch:
+    """Test full-text search over descriptions and comments."""
+
+    MEMBER_NAMES = ("Alice", "Bob")
+
+    @pytest.fixture
+    def members(self, client, members, expense):
+        for description, comment in [
+            ("Pizza night", "Pizza, pizza and more pizza"),
+            ("Groceries", "Milk and pizza dough"),
+            ("Café visit", None),
+            ("Electricity bill", "March"),
+            ("Pizza", None),
+        ]:
+            client.post(
+                "/api/transactions",
+                json=expense(members[0], members, description=description, comment=comment),
+            )
+        return members
+
+    def _search(self, client, query, **params):
+        response = client.get("/api/transactions", query_string={"q": query, **params})
+        assert response.status_code == 200
+        return [txn["description"] for txn in response.get_json()["transactions"]]
+
+    def test_ranked_matches(self, client, members):
+        # Best match first; descriptions weigh more than comments.
+        assert self._search(client, "pizza") == ["Pizza", "Pizza night", "Groceries"]
+        # Every word must match.
+        assert self._search(client, "pizza dough") == ["Groceries"]
+        # Case and accents are ignored; words match whole.
+        assert self._search(client, "CAFE") == ["Café visit"]
+        assert self._search(client, "electr") == []
+        # FTS syntax in the input is treated as plain words.
+        assert self._search(client, 'march" OR "pizza') == []
+        assert self._search(client, "NEAR(") == []
+        # An explicit sort still applies to the matches.
+        assert len(self._search(client, "pizza", sort="-date")) == 3
+        # Without search words the full listing is returned.
+        assert len(self._search(client, " ?! ")) == 5
+        assert client.get("/api/transactions?sort=rank").status_code == 200
+
+    def test_room_and_rank_window(self, app, client, members, monkeypatch):
+        room_id = client.post("/api/rooms", json={"name": "Upstairs"}).get_json()["id"]
+        with app.app_context():
+            person = Person(name="Dana", room_id=room_id)
+            db.session.add(person)
+            db.session.commit()
+            dana = person.id
+        client.post(
+            "/api/transactions",
+            headers={"X-Room-Id": str(room_id)},
+            json={
+                "description": "Pizza upstairs",
+                "date": "2025-03-01",
+                "amount": "10.00",
+                "payer_id": dana,
+                "participant_ids": [dana],
+            },
+        )
+        assert "Pizza upstairs" not in self._search(client, "pizza")
+        upstairs = client.get("/api/transactions?q=pizza", headers={"X-Room-Id": str(room_id)})
+        assert [txn["description"] for txn in upstairs.get_json()["transactions"]] == [
+            "Pizza upstairs"
+        ]
+
+        # Ranked searches score the room's latest matches only; older ones follow.
+        monkeypatch.setattr("search.SEARCH_RANK_WINDOW", 2)
+        assert self._search(client, "pizza") == ["Pizza", "Groceries", "Pizza night"]
+        pages = [self._search(client, "pizza", limit=2)]
+        cursor = client.get("/api/transactions?q=pizza&limit=2").get_json()["next_cursor"]
+        pages.append(self._search(client, "pizza", limit=2, cursor=cursor))
+        assert pages == [["Pizza", "Groceries"], ["Pizza night"]]
+
+    def test_rank_pages_cover_every_match_once(self, client, members):
+        expected = self._search(client, "pizza", limit=100)
+        seen = []
+        url = "/api/transactions?q=pizza&limit=1"
+        while url:
+            page = client.get(url).get_json()
+            seen.extend(txn["description"] for txn in page["transactions"])
+            cursor = page["next_cursor"]
+            url = f"/api/transactions?q=pizza&limit=1&cursor={cursor}" if cursor else None
+        assert seen == expected
+
+    def test_index_follows_writes(self, app, client, members):
+        alice, bob = members
+        with app.app_context():
+            bill = Transaction.query.filter_by(description="Electricity bill").one().id
+            pizza = Transaction.query.filter_by(description="Pizza").one().id
+
+        client.post(
+            f"/transactions/{bill}/edit",
+            data={
+                "description": "Gas bill",
+                "comment": "April",
+                "date": "2025-03-01",
+                "amount": "10.00",
+                "payer_id": str(alice),
+                "participants": [str(alice), str(bob)],
+            },
+        )
+        assert self._search(client, "electricity") == []
+        assert self._search(client, "april") == ["Gas bill"]
+
+        client.post(f"/transactions/{pizza}/delete")
+        assert "Pizza" not in self._search(client, "pizza")
+
+        client.post(
+            "/api/transactions/bulk",
+            json={
+                "items": [
+                    {
+                        "description": "Bulk pizza order",
+                        "date": "2025-03-02",
+                        "amount": "30.00",
+                        "payer_id": bob,
+                        "participants": [alice, bob],
+                    }
+                ]
+            },
+        )
+        assert "Bulk pizza order" in self._search(client, "pizza")
+
+    def test_html_search(self, client, members):
+        body = client.get("/transactions?q=groceries").get_data(as_text=True)
+        assert "Groceries" in body and "Pizza night" not in body
+        assert 'value="rank" selected' in body
+        assert "No transactions match" in client.get("/transactions?q=sushi").get_data(as_text=True)
+
+
+class TestTransactionExport:
+    """Test the streaming NDJSON export."""
+
+    def test_export_streams_one_transaction_per_line(self, client, app):
+        with app.app_context():
+            alice, bob = Person(name="Alice"), Person(name="Bob")
+            db.session.add_all([alice, bob])
+            db.session.commit()
+            for i in range(3):
+                db.session.add(
+                    Transaction(
+                        description=f"Expense {i}",
+                        date=date(2025, 1, 1 + i),
+                        amount=Decimal("10.00"),
+                        payer_id=alice.id,
+                        shares=[
+                            TransactionShare(person_id=alice.id, amount=Decimal("5.00")),
+                            TransactionShare(person_id=bob.id, amount=Decimal("5.00")),
+                        ],
+                    )
+                )
+            db.session.add(
+                Transaction(
+                    description="No shares",
+                    date=date(2025, 1, 9),
+                    amount=Decimal("1.00"),
+                    payer_id=bob.id,
+                )
+            )
+            db.session.commit()
+
+        response = client.get("/api/transactions/export?format=ndjson")
+        assert response.status_code == 200
+        assert response.mimetype == "application/x-ndjson"
+
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert [line["description"] for line in lines] == [
+            "Expense 0",
+            "Expense 1",
+            "Expense 2",
+            "No shares",
+        ]
+        assert [share["member"]["name"] for share in lines[0]["shares"]] == ["Alice", "Bob"]
+        assert lines[3]["shares"] == []
+
+        listed = client.get("/api/transactions?sort=date").get_json()["transactions"]
+        assert lines[0] == listed[0]
+
+    def test_export_rejects_unknown_format(self, client):
+        assert client.get("/api/transactions/export?format=xml").status_code == 400
+
+
+class TestBulkTransactions:
+    """Test the bulk create/update/delete endpoint."""
+
+    MEMBER_NAMES = ("Alice", "Bob")
+
+    def test_bulk_create_in_chunks(self, client, app, members, expense):
+        alice, bob = members
+        items = [expense(alice, [alice, bob]) for _ in range(25)]
+        items.insert(3, expense(alice, [999]))
+
+        response = client.post(
+            "/api/transactions/bulk", json={"items": items, "chunk_size": 7}
+        )
+        assert response.status_code == 200
+        body = response.get_json()
+        assert body["summary"] == {"created": 25, "updated": 0, "deleted": 0, "error": 1}
+        assert body["results"][3] == {
+            "index": 3,
+            "status": "error",
+            "error": "Some participants are invalid.",
+        }
+        created_ids = [r["id"] for r in body["results"] if r["status"] == "created"]
+        assert len(set(created_ids)) == 25
+
+        with app.app_context():
+            assert Transaction.query.count() == 25
+            assert TransactionShare.query.count() == 50
+            assert read_balances()[bob] == Decimal("-125.00")
+            assert check_consistency() == []
+
+    def test_bulk_rejects_wrong_json_types(self, client, app, members, expense):
+        alice, bob = members
+        items = [
+            expense(alice, 5),
+            expense(alice, [alice, bob], description=5),
+            expense(alice, [alice, bob], split_mode="fixed", split_values=7),
+            expense(alice, [alice, bob]),
+        ]
+        body = client.post("/api/transactions/bulk", json={"items": items}).get_json()
+        assert [result.get("error") for result in body["results"]] == [
+            "participant_ids must be a list of member ids.",
+            "description must be a string.",
+            "split_values must be an object or a list.",
+            None,
+        ]
+        response = client.post("/api/transactions", json=expense(alice, [alice], date=[1]))
+        assert response.status_code == 400
+
+    def test_bulk_update_and_delete(self, client, app, members, expense):
+        alice, bob = members
+        created = client.post(
+            "/api/transactions/bulk",
+            json={"items": [expense(alice, [alice, bob]) for _ in range(3)]},
+        ).get_json()["results"]
+        first, second, third = (result["id"] for result in created)
+
+        response = client.post(
+            "/api/transactions/bulk",
+            json={
+                "items": [
+                    expense(bob, [alice], amount="4.00", action="update", id=first),
+                    {"action": "delete", "id": second},
+                    {"action": "delete", "id": 12345},
+                    {"action": "archive", "id": third},
+                ]
+            },
+        )
+        results = response.get_json()["results"]
+        assert [result["status"] for result in results] == [
+            "updated",
+            "deleted",
+            "error",
+            "error",
+        ]
+
+        with app.app_context():
+            assert db.session.get(Transaction, second) is None
+            updated = db.session.get(Transaction, first)
+            assert updated.payer_id == bob
+            assert [share.person_id for share in updated.shares] == [alice]
+            assert check_consistency() == []
+
+    def test_bulk_requires_items(self, client):
+        assert client.post("/api/transactions/bulk", json={}).status_code == 400
+
+
+class TestLedgerImport:
+    """Test the ``flask ledger import`` command."""
+
+    MEMBER_NAMES = ("Alice", "Bob")
+
+    def test_import_csv(self, app, runner, members, tmp_path):
+        path = tmp_path / "history.csv"
+        path.write_text(
+            "date,description,amount,payer,participants,comment\n"
+            "2024-01-05,Rent,900.00,alice,Alice;Bob,January\n"
+            "2024-01-06,Milk,3.10,Bob,bob,\n"
+            "2024-01-07,Broken,abc,Bob,Alice,\n"
+            "2024-01-08,Ghost,5.00,Zed,Alice,\n",
+            encoding="utf-8",
+        )
+
+        result = runner.invoke(args=["ledger", "import", str(path), "--batch-size", "1"])
+        assert result.exit_code == 0, result.output
+        assert "Imported 2 of 4 rows" in result.output
+        assert "rows/sec" in result.output
+        assert "line 4: Amount must be a valid number." in result.output
+        assert "line 5: Unknown member 'Zed'." in result.output
+
+        with app.app_context():
+            rent = Transaction.query.filter_by(description="Rent").one()
+            assert rent.comment == "January"
+            assert sorted(share.amount for share in rent.shares) == [
+                Decimal("450.00"),
+                Decimal("450.00"),
+            ]
+            assert check_consistency() == []
+
+    def test_import_ndjson(self, app, runner, members, tmp_path):
+        alice, bob = members
+        path = tmp_path / "history.ndjson"
+        lines = [
+            {
+                "date": "2024-02-01",
+                "description": f"Item {i}",
+                "amount": "10.00",
+                "payer_id": alice,
+                "participant_ids": [alice, bob],
+            }
+            for i in range(5)
+        ]
+        path.write_text("\n".join(json.dumps(line) for line in lines) + "\n{oops\n")
+
+        result = runner.invoke(args=["ledger", "import", str(path)])
+        assert result.exit_code == 0, result.output
+        assert "Imported 5 of 6 rows" in result.output
+        with app.app_context():
+            assert Transaction.query.count() == 5
+            assert read_balances()[bob] == Decimal("-25.00")
+
+    def test_import_reports_wrongly_typed_lines(self, app, runner, members, tmp_path):
+        alice, bob = members
+        good = {
+            "date": "2024-02-01",
+            "description": "Lunch",
+            "amount": "10.00",
+            "payer_id": alice,
+            "participant_ids": [alice, bob],
+        }
+        path = tmp_path / "history.ndjson"
+        lines = [
+            {**good, "description": 5},
+            [1, 2],
+            {**good, "split_mode": "weighted", "split_values": 3},
+            {**good, "split_mode": 7},
+            good,
+        ]
+        path.write_text("\n".join(json.dumps(line) for line in lines) + "\n")
+
+        result = runner.invoke(args=["ledger", "import", str(path)])
+        assert result.exit_code == 0, result.output
+        assert "Imported 1 of 5 rows" in result.output
+        for message in (
+            "description must be a string.",
+            "Each record must be a JSON object.",
+            "split_values must be a list",
+            "split_mode must be a string.",
+        ):
+            assert message in result.output
+        with app.app_context():
+            assert Transaction.query.count() == 1
+
+    def test_import_weighted_split(self, app, runner, members, tmp_path):
+        path = tmp_path / "history.csv"
+        path.write_text(
+            "date,description,amount,payer,participants,split_mode,split_values\n"
+            "2024-01-05,Rent,900.00,Alice,Alice;Bob,weighted,2;1\n",
+            encoding="utf-8",
+        )
+        result = runner.invoke(args=["ledger", "import", str(path)])
+        assert "Imported 1 of 1 rows" in result.output
+        with app.app_context():
+            rent = Transaction.query.one()
+            assert [share.amount for share in rent.shares] == [
+                Decimal("600.00"),
+                Decimal("300.00"),
+            ]
+            assert check_consistency() == []
+
+
+class TestSplitModes:
+    """Test uneven splits through the API and the edit form."""
+
+    def test_api_percentage_split(self, client, app, members):
+        alice, bob, carol = members
+        response = client.post(
+            "/api/transactions",
+            json={
+                "description": "Holiday",
+                "date": "2025-03-01",
+                "amount": "100.01",
+                "payer_id": alice,
+                "participant_ids": [alice, bob, carol],
+                "split_mode": "percentage",
+                "split_values": {str(alice): 50, str(bob): 25, str(carol): 25},
+            },
+        )
+        assert response.status_code == 201
+        assert [share["amount"] for share in response.get_json()["shares"]] == [50.01, 25.0, 25.0]
+        with app.app_context():
+            assert read_balances()[bob] == Decimal("-25.00")
+            assert check_consistency() == []
+
+    def test_api_rejects_bad_split(self, client, members):
+        alice, bob, _ = members
+        response = client.post(
+            "/api/transactions",
+            json={
+                "description": "Holiday",
+                "date": "2025-03-01",
+                "amount": "100.00",
+                "payer_id": alice,
+                "participant_ids": [alice, bob],
+                "split_mode": "fixed",
+                "split_values": [60, 30],
+            },
+        )
+        assert response.status_code == 400
+        assert "add up to the total" in response.get_json()["error"]
+
+    def test_edit_prefills_fixed_amounts(self, client, app, members):
+        alice, bob, _ = members
+        client.post(
+            "/",
+            data={
+                "description": "Dinner",
+                "date": "2025-03-02",
+                "amount": "30.00",
+                "payer_id": str(alice),
+                "participants": [str(alice), str(bob)],
+                "split_mode": "fixed",
+                f"split_value_{alice}": "10",
+                f"split_value_{bob}": "20",
+            },
+        )
+        with app.app_context():
+            txn = Transaction.query.one()
+            assert [share.amount_cents for share in txn.shares] == [1000, 2000]
+            txn_id = txn.id
+
+        page = client.get(f"/transactions/{txn_id}/edit").get_data(as_text=True)
+        assert '<option value="fixed" selected>' in page
+        assert f'name="split_value_{bob}" value="20.00"' in page
+
+
+class TestCompactSplits:
+    """Test compact storage of even splits."""
+
+    @pytest.fixture(autouse=True)
+    def compact(self, app):
+        app.config["COMPACT_EVEN_SPLITS"] = True
+
+    def test_even_splits_store_no_share_rows(self, client, app, members, expense):
+        alice, bob, carol = members
+        for amount in ("10.00", "0.05", "7.01"):
+            response = client.post(
+                "/api/transactions", json=expense(alice, [bob, alice, carol], amount)
+            )
+            assert response.status_code == 201
+        response = client.post(
+            "/api/transactions",
+            json=expense(
+                bob, [alice, bob], split_mode="fixed", split_values=[1, 9]
+            ),
+        )
+        assert response.status_code == 201
+        client.post(
+            "/api/transactions/bulk",
+            json={"items": [expense(carol, [alice, carol], "3.33")]},
+        )
+
+        with app.app_context():
+            assert TransactionShare.query.count() == 2
+            compact = (
+                Transaction.query.filter(Transaction.participant_ids.isnot(None))
+                .order_by(Transaction.id)
+                .all()
+            )
+            assert len(compact) == 4
+            assert [share.person_id for share in compact[0].split()] == [bob, alice, carol]
+            assert sum(share.amount_cents for share in compact[1].split()) == 5
+
+            compact_balances = compute_balances()
+            assert check_consistency() == []
+            assert sum(compact_balances.values()) == 0
+
+            # Expanding every compact row into share rows gives the same totals.
+            for txn in compact:
+                for share in txn.split():
+                    db.session.add(TransactionShare(transaction_id=txn.id, **share._asdict()))
+                txn.participant_ids = txn.participant_count = None
+            db.session.commit()
+            assert compute_balances() == compact_balances
+            assert check_consistency() == []
+
+    def test_filter_export_edit_and_delete(self, client, app, members, expense):
+        alice, bob, carol = members
+        txn_id = client.post(
+            "/api/transactions", json=expense(alice, [alice, bob])
+        ).get_json()["id"]
+
+        listed = client.get(f"/api/transactions?member_id={bob}").get_json()["transactions"]
+        assert [txn["id"] for txn in listed] == [txn_id]
+        assert client.get(f"/api/transactions?member_id={carol}").get_json()["transactions"] == []
+        assert b"Bob" in client.get(f"/transactions?member_id={bob}").data
+
+        exported = json.loads(client.get("/api/transactions/export").data)
+        assert [(share["member"]["name"], share["amount"]) for share in exported["shares"]] == [
+            ("Alice", 5.0),
+            ("Bob", 5.0),
+        ]
+
+        client.post(f"/members/{bob}/delete")
+        with app.app_context():
+            assert db.session.get(Person, bob) is not None
+
+        client.post(
+            f"/transactions/{txn_id}/edit",
+            data={
+                "description": "Groceries",
+                "date": "2025-03-01",
+                "amount": "12.00",
+                "payer_id": str(alice),
+                "participants": [str(alice), str(carol)],
+                "split_mode": "fixed",
+                f"split_value_{alice}": "2",
+                f"split_value_{carol}": "10",
+            },
+        )
+        with app.app_context():
+            txn = db.session.get(Transaction, txn_id)
+            assert not txn.is_compact
+            assert [(share.person_id, share.amount_cents) for share in txn.split()] == [
+                (alice, 200),
+                (carol, 1000),
+            ]
+            assert read_balances()[carol] == Decimal("-10.00")
+            assert check_consistency() == []
+
+    def test_migration_rebuilds_old_even_split_ledger(self, client, app, members, expense):
+        alice, bob, carol = members
+        client.post("/api/transactions", json=expense(alice, [bob, alice, carol]))
+        with app.app_context():
+            # The ledger as the old rule left it: the last participant paid 3.34.
+            MemberBalance.query.filter_by(person_id=bob).update({"balance_cents": -333})
+            MemberBalance.query.filter_by(person_id=carol).update({"balance_cents": -334})
+            db.session.commit()
+            assert check_consistency() != []
+
+            with db.engine.begin() as connection:
+                MIGRATIONS[6].upgrade(connection)
+            db.session.expire_all()
+            sync_ledger()
+            assert check_consistency() == []
+            assert read_balances() == {
+                alice: Decimal("6.67"),
+                bob: Decimal("-3.34"),
+                carol: Decimal("-3.33"),
+            }
+
+
+class TestStats:
+    """Test the aggregate statistics behind /diagrams and /api/stats."""
+
+    MEMBER_NAMES = ("Alice", "Bob")
+
+    @pytest.fixture
+    def post(self, client, expense):
+        def post(payer_id, participants, day, amount):
+            response = client.post(
+                "/api/transactions", json=expense(payer_id, participants, amount, date=day)
+            )
+            assert response.status_code == 201
+
+        return post
+
+    def test_stats_buckets_and_invalidation(self, client, members, post):
+        alice, bob = members
+        post(alice, [alice, bob], "2025-01-30", "10.00")
+        post(alice, [alice, bob], "2025-02-03", "5.50")
+        post(bob, [alice, bob], "2025-02-04", "2.25")
+
+        body = client.get("/api/stats?bucket=month").get_json()
+        assert [(m["name"], m["count"], m["total"]) for m in body["members"]] == [
+            ("Alice", 2, 15.5),
+            ("Bob", 1, 2.25),
+        ]
+        assert [(e["start"], e["count"], e["total"]) for e in body["series"]] == [
+            ("2025-01-01", 1, 10.0),
+            ("2025-02-01", 2, 7.75),
+        ]
+        assert body["series"][1]["by_member"][str(bob)] == {"count": 1, "total": 2.25}
+
+        weekly = client.get("/api/stats?bucket=week&start=2025-02-01").get_json()
+        assert [(e["start"], e["count"]) for e in weekly["series"]] == [("2025-02-03", 2)]
+        assert weekly["members"][0]["count"] == 1
+
+        # A new write drops the cached figures.
+        post(bob, [bob], "2025-02-05", "1.00")
+        body = client.get("/api/stats?bucket=month").get_json()
+        assert body["members"][1]["count"] == 2
+
+    def test_stats_follow_other_workers(self, app, client, members, post):
+        alice, bob = members
+        post(alice, [alice, bob], "2025-01-30", "10.00")
+        assert client.get("/api/stats").get_json()["members"][0]["count"] == 1
+
+        with app.app_context():
+            # Another worker's write: only the ledger version tells this worker.
+            db.session.execute(
+                insert(Transaction).values(
+                    room_id=1,
+                    date=date(2025, 1, 31),
+                    description="Elsewhere",
+                    amount_cents=500,
+                    payer_id=alice,
+                )
+            )
+            bump_ledger_version()
+            db.session.commit()
+        assert client.get("/api/stats").get_json()["members"][0]["count"] == 2
+
+    def test_stats_cache_is_bounded(self, app, client, members):
+        app.config["STATS_CACHE_SIZE"] = 3
+        for day in range(1, 8):
+            assert client.get(f"/api/stats?start=2025-01-{day:02d}").status_code == 200
+        # The most recently used ranges are kept.
+        assert client.get("/api/stats?start=2025-01-06").status_code == 200
+        starts = [key[-2] for key in app.extensions["stats_cache"]]
+        assert starts == [date(2025, 1, 5), date(2025, 1, 7), date(2025, 1, 6)]
+
+    def test_stats_rejects_bad_arguments(self, client):
+        assert client.get("/api/stats?bucket=year").status_code == 400
+        assert client.get("/api/stats?start=yesterday").status_code == 400
+
+    def test_diagrams_page(self, client, members, post):
+        alice, bob = members
+        post(bob, [alice, bob], "2025-01-30", "12.00")
+        response = client.get("/diagrams")
+        assert response.status_code == 200
+        assert "[0, 1]" in response.get_data(as_text=True)
+
+
+class TestSchemaMigrations:
+    """Test the versioned migrations and that the hot paths use indexes."""
+
+    LEGACY_SCHEMA = (
+        "CREATE TABLE people (id INTEGER NOT NULL, name VARCHAR(80) NOT NULL,"
+        " PRIMARY KEY (id), UNIQUE (name))",
+        "CREATE TABLE transactions (id INTEGER NOT NULL, date DATE NOT NULL,"
+        " description VARCHAR(255) NOT NULL, amount NUMERIC(10, 2) NOT NULL,"
+        " comment TEXT, payer_id INTEGER NOT NULL, PRIMARY KEY (id),"
+        " FOREIGN KEY(payer_id) REFERENCES people (id))",
+        "CREATE TABLE transaction_shares (id INTEGER NOT NULL,"
+        " amount NUMERIC(10, 2) NOT NULL, transaction_id INTEGER NOT NULL,"
+        " person_id INTEGER NOT NULL, PRIMARY KEY (id),"
+        " CONSTRAINT uq_share_transaction UNIQUE (transaction_id, person_id),"
+        " FOREIGN KEY(transaction_id) REFERENCES transactions (id),"
+        " FOREIGN KEY(person_id) REFERENCES people (id))",
+    )
+
+    def test_upgrade_legacy_database(self, app, runner):
+        with app.app_context():
+            db.drop_all()
+            with db.engine.begin() as connection:
+                for statement in self.LEGACY_SCHEMA:
+                    connection.exec_driver_sql(statement)
+                connection.exec_driver_sql("INSERT INTO people (id, name) VALUES (1, 'Alice')")
+                connection.exec_driver_sql("INSERT INTO people (id, name) VALUES (2, 'Bob')")
+                connection.exec_driver_sql(
+                    "INSERT INTO transactions (id, date, description, amount, payer_id)"
+                    " VALUES (1, '2024-01-01', 'Dinner', 10.01, 1)"
+                )
+                connection.exec_driver_sql(
+                    "INSERT INTO transaction_shares (transaction_id, person_id, amount)"
+                    " VALUES (1, 1, 5.01), (1, 2, 5.00)"
+                )
+
+            assert [item.version for item in upgrade_database()] == sorted(MIGRATIONS)
+            assert applied_versions() == sorted(MIGRATIONS)
+            assert upgrade_database() == []
+
+            index_names = {
+                index["name"] for index in inspect(db.engine).get_indexes("transactions")
+            }
+            assert {"ix_transactions_room_date_id", "ix_transactions_room_amount_id"} <= index_names
+            assert "amount" not in {
+                column["name"] for column in inspect(db.engine).get_columns("transactions")
+            }
+
+            dinner = db.session.get(Transaction, 1)
+            assert dinner.amount_cents == 1001
+            assert sorted(share.amount_cents for share in dinner.shares) == [500, 501]
+            assert compute_balances() == {1: Decimal("5.00"), 2: Decimal("-5.00")}
+            # Existing expenses are in the new search index.
+            assert [txn.id for txn in paginate_transactions(None, None, 10, search="dinner")[0]] == [1]
+
+            # Names are now unique per room only.
+            room = Room(name="Upstairs")
+            db.session.add(room)
+            db.session.flush()
+            db.session.add(Person(name="Alice", room_id=room.id))
+            db.session.commit()
+            assert Person.query.filter_by(name="Alice").count() == 2
+
+        result = runner.invoke(args=["schema", "status"])
+        assert "Pending" not in result.output
+
+    def test_fresh_database_is_stamped(self, app):
+        with app.app_context():
+            db.drop_all()
+            assert upgrade_database() == []
+            assert applied_versions() == sorted(MIGRATIONS)
+
+    def _plan(self, query) -> str:
+        compiled = query.statement.compile(dialect=db.engine.dialect)
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+        with db.engine.connect() as connection:
+            rows = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + str(compiled), params)
+            return " | ".join(row[3] for row in rows)
+
+    def test_hot_queries_use_indexes(self, app):
+        with app.app_context():
+            people = [Person(name=f"Member {i}") for i in range(10)]
+            db.session.add_all(people)
+            db.session.commit()
+            db.session.execute(
+                Transaction.__table__.insert(),
+                [
+                    {
+                        "date": date(2024, 1, 1 + i % 28),
+                        "description": "Expense",
+                        "amount_cents": (i % 97) * 100 + 50,
+                        "payer_id": people[i % 10].id,
+                    }
+                    for i in range(2000)
+                ],
+            )
+            db.session.commit()
+            with db.engine.begin() as connection:
+                connection.exec_driver_sql("ANALYZE")
+
+            expected = {
+                "date": "ix_transactions_room_date_id",
+                "-date": "ix_transactions_room_date_id",
+                "amount": "ix_transactions_room_amount_id",
+                "-amount": "ix_transactions_room_amount_id",
+                "payer": "ix_people_room_lower_name",
+                "-payer": "ix_people_room_lower_name",
+            }
+            for sort, index_name in expected.items():
+                plan = self._plan(transaction_page_query(sort, None, 50))
+                assert index_name in plan, (sort, plan)
+                assert "TEMP B-TREE FOR ORDER BY" not in plan, (sort, plan)
+
+            plan = self._plan(transaction_page_query("-date", str(people[0].id), 50))
+            assert "ix_transaction_shares_room_person" in plan
+
+            paid = (
+                db.session.query(Transaction.payer_id, func.sum(Transaction.amount_cents))
+                .filter(Transaction.room_id == 1)
+                .group_by(Transaction.payer_id)
+            )
+            assert "COVERING INDEX ix_transactions_room_payer_amount" in self._plan(paid)
+
+    def test_member_delete_uses_room_indexes(self, app, client):
+        with app.app_context():
+            person = Person(name="Dana")
+            db.session.add(person)
+            db.session.commit()
+            person_id = person.id
+            engine = db.engine
+
+        statements = []
+
+        def record(conn, cursor, statement, parameters, *args):
+            tables = ("transactions", "transaction_shares", "pair_debts", "member_balances")
+            if any(f"FROM {table} " in statement for table in tables):
+                statements.append((statement, parameters))
+
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            client.post(f"/members/{person_id}/delete")
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+
+        with engine.connect() as connection:
+            for statement, parameters in statements:
+                if statement.lstrip().startswith("INSERT"):
+                    continue
+                plan = " | ".join(
+                    row[3]
+                    for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)
+                )
+                # SQLite reports a full table scan as a bare "SCAN <table>".
+                assert not re.search(r"\bSCAN \w+(?! USING)( |$)", plan), (statement, plan)
+
+
+class TestBalanceLedger:
+    """Test the incrementally maintained balance ledger."""
+
+    def test_ledger_follows_every_write(self, client, app, members):
+        """Create, edit and delete keep stored balances equal to a full recompute."""
+        alice, bob, carol = members
+        response = client.post(
+            "/api/transactions",
+            json={
+                "description": "Rent",
+                "date": "2025-02-01",
+                "amount": "100.00",
+                "payer_id": alice,
+                "participants": [alice, bob, carol],
+            },
+        )
+        transaction_id = response.get_json()["id"]
+        client.post(
+            "/",
+            data={
+                "description": "Snacks",
+                "date": "2025-02-02",
+                "amount": "9.99",
+                "payer_id": str(bob),
+                "participants": [str(bob), str(carol)],
+            },
+        )
+
+        with app.app_context():
+            assert read_balances()[alice] == Decimal("66.66")
+            assert sorted(read_net_debts()) == sorted(
+                [
+                    (bob, alice, Decimal("33.33")),
+                    (carol, alice, Decimal("33.33")),
+                    (carol, bob, Decimal("4.99")),
+                ]
+            )
+            assert check_consistency() == []
+
+        response = client.get("/balances")
+        assert response.status_code == 200
+        assert "£66.66" in response.get_data(as_text=True)
+
+        client.post(
+            f"/transactions/{transaction_id}/edit",
+            data={
+                "description": "Rent",
+                "date": "2025-02-01",
+                "amount": "120.00",
+                "payer_id": str(carol),
+                "participants": [str(alice), str(bob)],
+            },
+        )
+        with app.app_context():
+            assert read_balances() == compute_balances()
+            assert check_consistency() == []
+
+        client.post(f"/transactions/{transaction_id}/delete")
+        with app.app_context():
+            assert read_balances() == compute_balances()
+            assert read_balances()[bob] == Decimal("4.99")
+
+    def test_api_settlements(self, client, members):
+        """The settlement plan is exposed as JSON."""
+        alice, bob, carol = members
+        client.post(
+            "/api/transactions",
+            json={
+                "description": "Rent",
+                "date": "2025-02-01",
+                "amount": "90.00",
+                "payer_id": alice,
+                "participants": [alice, bob, carol],
+            },
+        )
+
+        response = client.get("/api/settlements")
+        assert response.status_code == 200
+        plan = response.get_json()
+        transfers = sorted(
+            (item["from"]["id"], item["to"]["id"], item["amount"]) for item in plan
+        )
+        assert transfers == sorted([(bob, alice, 30.0), (carol, alice, 30.0)])
+
+    def test_check_reports_drift(self, app, runner, members):
+        """Transactions written behind the ledger's back are reported as drift."""
+        alice, bob, _ = members
+        with app.app_context():
+            db.session.add(
+                Transaction(
+                    description="Untracked",
+                    date=date(2025, 1, 1),
+                    amount=Decimal("10.00"),
+                    payer_id=alice,
+                    shares=[TransactionShare(person_id=bob, amount=Decimal("10.00"))],
+                )
+            )
+            db.session.commit()
+            drift = check_consistency()
+            assert {entry.get("person_id") for entry in drift if entry["kind"] == "balance"} == {alice, bob}
+            assert [entry["kind"] for entry in drift].count("debt") == 1
+
+        result = runner.invoke(args=["ledger", "check"])
+        assert result.exit_code == 1
+
+        result = runner.invoke(args=["ledger", "rebuild"])
+        assert result.exit_code == 0
+        with app.app_context():
+            assert check_consistency() == []
+
+
+class TestBenchmarkLedger:
+    """Test the synthetic ledger generator and the benchmark report."""
+
+    def test_generated_ledger_is_consistent(self, app):
+        from benchmarks.ledger_factory import generate_ledger
+
+        with app.app_context():
+            generated = generate_ledger(300, members=6, participants=(2, 4), seed=3)
+            assert Transaction.query.count() == 300
+            assert TransactionShare.query.count() == generated["shares"]
+            assert check_consistency() == []
+            assert sum(read_balances().values()) == Decimal("0.00")
+
+    def test_report_and_compare(self, tmp_path):
+        from benchmarks.bench_ledger import compare, main
+
+        output = tmp_path / "results.json"
+        assert main(["--sizes", "50", "--members", "5", "--repeat", "1", "--output", str(output)]) == 0
+        report = json.loads(output.read_text())
+        cases = report["results"][0]["cases"]
+        assert report["results"][0]["size"] == 50
+        assert {"compute_balances", "GET /balances", "GET /api/transactions"} <= set(cases)
+
+        slower = json.loads(output.read_text())
+        for case in slower["results"][0]["cases"].values():
+            case["median_ms"] *= 2
+        assert compare(report, slower, 0.2) == []
+        assert len(compare(slower, report, 0.2)) == len(cases)
+
+
+class TestEngineProfiles:
+    """Test the backend-aware engine profiles."""
+
+    def test_web_profile_pragmas(self, tmp_path):
+        from benchmarks.ledger_factory import create_benchmark_app
+        from engine_profiles import engine_report
+
+        app = create_benchmark_app(f"sqlite:///{tmp_path / 'web.db'}", "web")
+        with app.app_context():
+            report = engine_report()
+        assert report["journal_mode"] == "wal"
+        assert report["synchronous"] == "NORMAL"
+        assert report["busy_timeout"] == 5000
+        assert report["mmap_size"] == 256 * 1024 * 1024
+
+        response = app.test_client().get("/balances")
+        assert response.status_code == 200
+
+    def test_profile_options(self):
+        from engine_profiles import engine_options, engine_profile
+
+        web = engine_profile(None)
+        assert web.name == "web"
+        options = engine_options(web, "postgresql://app@db/expenses")
+        assert options["pool_pre_ping"] is True
+        assert options["pool_recycle"] == 1800
+        assert engine_options(web, "sqlite:///expenses.db") == {}
+        assert engine_options(engine_profile("Default"), "postgresql://app@db/expenses") == {}
+        with pytest.raises(ValueError, match="Unknown engine profile"):
+            engine_profile("turbo")
+
+    def test_report_command(self, runner):
+        result = runner.invoke(args=["engine", "report"])
+        assert result.exit_code == 0
+        assert "journal_mode: delete" in result.output
+
+
+class TestAsyncApi:
+    """Test the async ASGI API against the Flask endpoints."""
+
+    @pytest.fixture
+    def asgi_client(self, app):
+        pytest.importorskip("starlette")
+        pytest.importorskip("aiosqlite")
+        pytest.importorskip("a2wsgi")
+        httpx = pytest.importorskip("httpx")
+        from async_api import create_asgi_app
+
+        transport = httpx.ASGITransport(app=create_asgi_app(app))
+        return lambda: httpx.AsyncClient(transport=transport, base_url="http://testserver")
+
+    def test_matches_flask_endpoints(self, app, client, asgi_client, members):
+        alice, bob, carol = members
+        for amount in ("10.00", "25.50", "7.01"):
+            client.post(
+                "/api/transactions",
+                json={
+                    "description": "Groceries",
+                    "date": "2025-03-01",
+                    "amount": amount,
+                    "payer_id": alice,
+                    "participant_ids": [alice, bob, carol],
+                },
+            )
+
+        async def run():
+            async with asgi_client() as api:
+                for path in (
+                    "/api/transactions?sort=-amount&limit=2",
+                    f"/api/transactions?member_id={bob}",
+                    "/api/transactions?q=groc&limit=2",
+                    "/api/members",
+                    "/api/settlements",
+                ):
+                    response = await api.get(path)
+                    expected = client.get(path)
+                    assert response.status_code == 200
+                    assert response.json() == expected.get_json()
+                    assert response.headers["ETag"] == expected.headers["ETag"]
+
+                cached = await api.get(
+                    "/api/members", headers={"If-None-Match": response.headers["ETag"]}
+                )
+                assert cached.status_code == 304
+                assert (await api.get("/api/transactions?cursor=bogus")).status_code == 400
+                assert (await api.get("/balances")).status_code == 200
+
+        asyncio.run(run())
+
+    def test_create_updates_ledger(self, app, client, asgi_client, members):
+        alice, bob, _ = members
+
+        async def run():
+            async with asgi_client() as api:
+                created = await api.post(
+                    "/api/transactions",
+                    json={
+                        "description": "Dinner",
+                        "date": "2025-03-02",
+                        "amount": "30.00",
+                        "payer_id": alice,
+                        "participant_ids": [alice, bob],
+                    },
+                )
+                rejected = await api.post("/api/transactions", json={"description": "Dinner"})
+                return created, rejected
+
+        created, rejected = asyncio.run(run())
+        assert created.status_code == 201
+        assert created.json()["shares"][1] == {"member": {"id": bob, "name": "Bob"}, "amount": 15.0}
+        assert rejected.status_code == 400
+        assert "Date must be provided" in rejected.json()["error"]
+        with app.app_context():
+            assert read_balances()[bob] == Decimal("-15.00")
+            assert check_consistency() == []
+        assert client.get(f"/api/transactions?member_id={bob}").get_json()["transactions"][0][
+            "id"
+        ] == created.json()["id"]
+
+    def test_metrics_and_access_log(self, app, client, asgi_client, members, caplog):
+        caplog.set_level(logging.INFO, logger=ACCESS_LOGGER)
+
+        async def run():
+            async with asgi_client() as api:
+                return await api.get("/api/members")
+
+        response = asyncio.run(run())
+        timing = response.headers["Server-Timing"]
+        assert int(timing.split('desc="')[1].split(" ")[0]) >= 1
+        body = client.get("/metrics").get_data(as_text=True)
+        assert 'http_requests_total{method="GET",route="/api/members",status="200"} 1' in body
+        logged = [record for record in caplog.records if record.name == ACCESS_LOGGER]
+        assert [(record.path, record.status) for record in logged][0] == ("/api/members", 200)
+        assert logged[0].duration_ms is not None
+
+    def test_async_database_uri(self):
+        pytest.importorskip("starlette")
+        pytest.importorskip("a2wsgi")
+        from async_api import async_database_uri
+
+        assert async_database_uri("sqlite:////tmp/x.db").drivername == "sqlite+aiosqlite"
+        assert async_database_uri("postgresql://u@h/db").drivername == "postgresql+asyncpg"
+        with pytest.raises(ValueError):
+            async_database_uri("mysql://u@h/db")
+
+    def test_room_header_scopes_requests(self, app, client, asgi_client, members):
+        alice, bob, _ = members
+        with app.app_context():
+            room = Room(name="Upstairs")
+            db.session.add(room)
+            db.session.commit()
+            room_id = room.id
+
+        async def run():
+            async with asgi_client() as api:
+                headers = {"X-Room-Id": str(room_id)}
+                members_page = await api.get("/api/members", headers=headers)
+                rejected = await api.post(
+                    "/api/transactions",
+                    headers=headers,
+                    json={
+                        "description": "Dinner",
+                        "date": "2025-03-02",
+                        "amount": "30.00",
+                        "payer_id": alice,
+                        "participant_ids": [alice, bob],
+                    },
+                )
+                missing = await api.get("/api/members", headers={"X-Room-Id": "999"})
+                return members_page, rejected, missing
+
+        members_page, rejected, missing = asyncio.run(run())
+        assert members_page.json() == []
+        assert members_page.headers["ETag"] == f'W/"ledger-{room_id}-0"'
+        assert rejected.status_code == 400
+        assert missing.status_code == 404
+
+
+class TestBalanceCheckpoints:
+    """Test as-of balances served from checkpoints plus the transactions after them."""
+
+    EXPENSES = [
+        ("2024-01-05", "30.00", 0, [0, 1, 2]),
+        ("2024-01-20", "10.01", 1, [0, 1]),
+        ("2024-02-11", "45.00", 2, [0, 1, 2]),
+        ("2024-03-03", "7.00", 0, [1]),
+        ("2024-03-30", "12.34", 1, [0, 1, 2]),
+        ("2024-05-09", "99.99", 2, [0, 2]),
+    ]
+
+    @pytest.fixture(params=[False, True], ids=["shares", "compact"])
+    def members(self, request, app, client, members, expense):
+        app.config["COMPACT_EVEN_SPLITS"] = request.param
+        for day, amount, payer, participants in self.EXPENSES:
+            client.post(
+                "/api/transactions",
+                json=expense(
+                    members[payer], [members[index] for index in participants], amount, date=day
+                ),
+            )
+        return members
+
+    def _replay(self, day):
+        balances = {}
+        for txn in Transaction.query.filter(Transaction.date <= day):
+            balances[txn.payer_id] = balances.get(txn.payer_id, 0) + txn.amount_cents
+            for share in txn.split():
+                balances[share.person_id] = balances.get(share.person_id, 0) - share.amount_cents
+        return {person_id: cents for person_id, cents in balances.items() if cents}
+
+    def test_as_of_matches_replay(self, app, members):
+        with app.app_context():
+            for day in ("2023-12-31", "2024-01-19", "2024-01-31", "2024-03-15", "2024-06-30"):
+                snapshot = ledger_as_of(date.fromisoformat(day))
+                assert snapshot.balances == self._replay(date.fromisoformat(day)), day
+            # One checkpoint per finished month with expenses.
+            assert [checkpoint.through.isoformat() for checkpoint in LedgerCheckpoint.query.order_by(
+                LedgerCheckpoint.through
+            )] == ["2024-01-31", "2024-02-29", "2024-03-31", "2024-05-31"]
+
+            # Reads after the latest checkpoint start from its stored rows.
+            checkpoint = db.session.get(LedgerCheckpoint, 1)
+            row = checkpoint.balances[0]
+            row.balance_cents += 1
+            db.session.commit()
+            assert ledger_as_of(date(2024, 1, 31)).balances[row.person_id] == (
+                self._replay(date(2024, 1, 31))[row.person_id] + 1
+            )
+
+    def test_back_dated_edit_invalidates_checkpoints(self, app, client, members):
+        alice, bob, carol = members
+        with app.app_context():
+            ledger_as_of(date(2024, 6, 30))
+            march = Transaction.query.filter_by(date=date(2024, 3, 3)).one().id
+
+        client.post(
+            f"/transactions/{march}/edit",
+            data={
+                "description": "Moved",
+                "date": "2024-01-10",
+                "amount": "70.00",
+                "payer_id": str(alice),
+                "participants": [str(bob)],
+            },
+        )
+        with app.app_context():
+            assert [checkpoint.through for checkpoint in LedgerCheckpoint.query] == []
+            for day in (date(2024, 1, 31), date(2024, 3, 31)):
+                assert ledger_as_of(day).balances == self._replay(day)
+
+        # A new back-dated expense drops the checkpoints from its date on.
+        client.post(
+            "/api/transactions",
+            json={
+                "description": "Late receipt",
+                "date": "2024-02-02",
+                "amount": "5.00",
+                "payer_id": carol,
+                "participant_ids": [alice],
+            },
+        )
+        with app.app_context():
+            assert [checkpoint.through.isoformat() for checkpoint in LedgerCheckpoint.query] == [
+                "2024-01-31"
+            ]
+
+        response = client.get("/api/balances?as_of=2024-02-29")
+        body = response.get_json()
+        with app.app_context():
+            expected = self._replay(date(2024, 2, 29))
+        assert {entry["id"]: round(entry["balance"] * 100) for entry in body["balances"]} == {
+            person_id: expected.get(person_id, 0) for person_id in members
+        }
+        assert sum(entry["balance"] for entry in body["balances"]) == pytest.approx(0)
+        assert client.get("/api/balances").get_json()["as_of"] is None
+        assert client.get("/api/balances?as_of=March").status_code == 400
+        for day in ("0001-01-01", "9999-12-31"):
+            assert client.get(f"/api/balances?as_of={day}").status_code == 200
+        statement = client.get(f"/api/members/{alice}/statement?start=0001-01-01")
+        assert statement.status_code == 200
+
+    def test_checkpoints_built_during_a_write_are_discarded(self, app, members, monkeypatch):
+        deltas_by_day = checkpoints._deltas_by_day
+
+        def concurrent_write(*args):
+            deltas = deltas_by_day(*args)
+            bump_ledger_version()
+            db.session.commit()
+            return deltas
+
+        with app.app_context():
+            monkeypatch.setattr(checkpoints, "_deltas_by_day", concurrent_write)
+            assert checkpoints.create_checkpoints(date(2024, 6, 30)) == []
+            assert LedgerCheckpoint.query.count() == 0
+            monkeypatch.undo()
+            assert len(checkpoints.create_checkpoints(date(2024, 6, 30))) == 4
+
+    def test_reads_without_missing_checkpoints_do_not_lock(self, app, members):
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with app.app_context():
+            assert len(checkpoints.create_checkpoints()) == 4
+            event.listen(db.engine, "before_cursor_execute", record)
+            try:
+                # The months since the last expense have nothing to snapshot.
+                assert checkpoints.create_checkpoints() == []
+            finally:
+                event.remove(db.engine, "before_cursor_execute", record)
+        assert not any("FOR UPDATE" in statement or "INSERT" in statement for statement in statements)
+        assert sum("ledger_state" in statement for statement in statements) == 1
+
+    def test_checkpoint_command(self, app, runner, members):
+        result = runner.invoke(args=["ledger", "checkpoint", "--through", "2024-02-15"])
+        assert "Created 1 checkpoints." in result.output
+        with app.app_context():
+            assert [checkpoint.through for checkpoint in LedgerCheckpoint.query] == [date(2024, 1, 31)]
+
+
+class TestMemberStatement:
+    """Test member statements with a window-function running balance."""
+
+    EXPENSES = [
+        ("2024-01-05", "30.00", 0, [0, 1, 2]),
+        ("2024-01-20", "10.01", 1, [0, 1]),
+        ("2024-01-20", "0.05", 0, [2, 0]),
+        ("2024-02-11", "45.00", 2, [0, 1, 2]),
+        ("2024-03-03", "7.00", 0, [1]),
+        ("2024-03-30", "12.34", 1, [0, 1, 2]),
+        ("2024-05-09", "99.99", 2, [0, 2]),
+    ]
+
+    @pytest.fixture(params=[False, True], ids=["shares", "compact"])
+    def members(self, request, app, client, members, expense):
+        app.config["COMPACT_EVEN_SPLITS"] = request.param
+        for day, amount, payer, participants in self.EXPENSES:
+            client.post(
+                "/api/transactions",
+                json=expense(
+                    members[payer], [members[index] for index in participants], amount, date=day
+                ),
+            )
+        return members
+
+    def _replay(self, member_id):
+        """(id, date, change, balance) in cents for every expense of the member."""
+        entries = []
+        balance = 0
+        for txn in Transaction.query.order_by(Transaction.date, Transaction.id):
+            change = txn.amount_cents if txn.payer_id == member_id else 0
+            shares = [share for share in txn.split() if share.person_id == member_id]
+            if txn.payer_id != member_id and not shares:
+                continue
+            change -= sum(share.amount_cents for share in shares)
+            balance += change
+            entries.append((txn.id, txn.date.isoformat(), change, balance))
+        return entries
+
+    def _pages(self, client, member_id, query=""):
+        url = f"/api/members/{member_id}/statement?limit=2{query}"
+        pages = []
+        while url:
+            body = client.get(url).get_json()
+            pages.append(body)
+            url = (
+                f"/api/members/{member_id}/statement?limit=2{query}&cursor={body['next_cursor']}"
+                if body["next_cursor"]
+                else None
+            )
+        return pages
+
+    def test_statement_matches_replay(self, app, client, members):
+        for member_id in members:
+            with app.app_context():
+                expected = self._replay(member_id)
+            pages = self._pages(client, member_id)
+            entries = [entry for page in pages for entry in page["entries"]]
+            assert [
+                (entry["id"], entry["date"], round(entry["change"] * 100), round(entry["balance"] * 100))
+                for entry in entries
+            ] == expected
+            # Every page opens at the balance the previous one closed with.
+            closing = 0
+            for page in pages:
+                assert round(page["opening_balance"] * 100) == closing
+                closing = round(page["entries"][-1]["balance"] * 100)
+            with app.app_context():
+                assert closing == round(read_balances()[member_id] * 100)
+
+    def test_date_range(self, app, client, members):
+        alice = members[0]
+        with app.app_context():
+            expected = [
+                entry for entry in self._replay(alice) if "2024-01-20" <= entry[1] <= "2024-03-30"
+            ]
+            opening = ledger_as_of(date(2024, 1, 19)).balances.get(alice, 0)
+        pages = self._pages(client, alice, "&start=2024-01-20&end=2024-03-30")
+        entries = [entry for page in pages for entry in page["entries"]]
+        assert [(entry["id"], round(entry["balance"] * 100)) for entry in entries] == [
+            (txn_id, balance) for txn_id, _, _, balance in expected
+        ]
+        assert round(pages[0]["opening_balance"] * 100) == opening
+        assert pages[0]["start"] == "2024-01-20"
+        assert entries[0]["payer"]["name"] == "Bob"
+
+    def test_errors(self, client, members):
+        alice = members[0]
+        assert client.get("/api/members/999/statement").status_code == 404
+        assert client.get(f"/api/members/{alice}/statement?start=May").status_code == 400
+        assert (
+            client.get(f"/api/members/{alice}/statement?start=2024-05-01&end=2024-01-01").status_code
+            == 400
+        )
+        assert client.get(f"/api/members/{alice}/statement?cursor=nope").status_code == 400
+
+
+class TestRooms:
+    """Test that rooms partition members, expenses, the ledger and caches."""
+
+    def _create_room(self, client, name):
+        response = client.post("/api/rooms", json={"name": name})
+        assert response.status_code == 201
+        return response.get_json()["id"]
+
+    def _add_expense(self, client, room_id, payer_id, participant_ids, amount):
+        return client.post(
+            "/api/transactions",
+            headers={"X-Room-Id": str(room_id)},
+            json={
+                "description": "Groceries",
+                "date": "2025-04-01",
+                "amount": amount,
+                "payer_id": payer_id,
+                "participant_ids": participant_ids,
+            },
+        )
+
+    def test_rooms_are_isolated(self, app, client):
+        upstairs = self._create_room(client, "Upstairs")
+        downstairs = self._create_room(client, "Downstairs")
+        assert client.post("/api/rooms", json={"name": "upstairs"}).status_code == 400
+        assert client.post("/api/rooms", json={"name": " "}).status_code == 400
+
+        with app.app_context():
+            # The same names in two rooms are two different members.
+            up = [Person(name="Alice", room_id=upstairs), Person(name="Bob", room_id=upstairs)]
+            down = [Person(name="Alice", room_id=downstairs), Person(name="Bob", room_id=downstairs)]
+            db.session.add_all(up + down)
+            db.session.commit()
+            up_ids = [person.id for person in up]
+            down_ids = [person.id for person in down]
+
+        up_etag = client.get("/api/members", headers={"X-Room-Id": str(upstairs)}).headers["ETag"]
+        assert self._add_expense(client, upstairs, up_ids[0], up_ids, "20.00").status_code == 201
+        assert self._add_expense(client, downstairs, down_ids[1], down_ids, "9.00").status_code == 201
+        # A member of another room is not a valid participant.
+        assert self._add_expense(client, upstairs, up_ids[0], down_ids, "5.00").status_code == 400
+
+        up_page = client.get("/api/transactions", headers={"X-Room-Id": str(upstairs)})
+        down_page = client.get("/api/transactions", headers={"X-Room-Id": str(downstairs)})
+        assert [txn["amount"] for txn in up_page.get_json()["transactions"]] == [20.0]
+        assert [txn["amount"] for txn in down_page.get_json()["transactions"]] == [9.0]
+        assert up_page.headers["ETag"] != down_page.headers["ETag"]
+        assert "X-Room-Id" in up_page.headers["Vary"]
+
+        # Writing downstairs leaves the upstairs ETag and stats untouched.
+        up_etag = up_page.headers["ETag"]
+        up_stats = client.get("/api/stats", headers={"X-Room-Id": str(upstairs)}).get_json()
+        self._add_expense(client, downstairs, down_ids[0], down_ids, "4.00")
+        cached = client.get(
+            "/api/transactions",
+            headers={"X-Room-Id": str(upstairs), "If-None-Match": up_etag},
+        )
+        assert cached.status_code == 304
+        assert client.get("/api/stats", headers={"X-Room-Id": str(upstairs)}).get_json() == up_stats
+
+        with app.app_context():
+            with use_room(upstairs):
+                assert read_balances() == {up_ids[0]: Decimal("10.00"), up_ids[1]: Decimal("-10.00")}
+                assert check_consistency() == []
+            with use_room(downstairs):
+                assert read_balances() == {down_ids[0]: Decimal("-2.50"), down_ids[1]: Decimal("2.50")}
+                assert check_consistency() == []
+            # The default room has neither members nor expenses.
+            assert read_balances() == {}
+
+        settlements = client.get("/api/settlements", headers={"X-Room-Id": str(downstairs)})
+        assert settlements.get_json() == [
+            {
+                "from": {"id": down_ids[0], "name": "Alice"},
+                "to": {"id": down_ids[1], "name": "Bob"},
+                "amount": 2.5,
+            }
+        ]
+
+    def test_room_selection(self, app, client):
+        room_id = self._create_room(client, "Upstairs")
+        with app.app_context():
+            db.session.add(Person(name="Dana", room_id=room_id))
+            db.session.commit()
+
+        assert client.get("/api/members").get_json() == []
+        # A ``room`` argument is remembered for the following requests.
+        assert [m["name"] for m in client.get(f"/api/members?room={room_id}").get_json()] == ["Dana"]
+        assert [m["name"] for m in client.get("/api/members").get_json()] == ["Dana"]
+        response = client.post("/rooms/1/select", data={"next": "https://example.com/"})
+        assert response.headers["Location"] == "/"
+        assert client.get("/api/members").get_json() == []
+
+        assert client.get("/api/members?room=999").status_code == 404
+        assert client.get("/api/members", headers={"X-Room-Id": "abc"}).status_code == 404
+        assert client.post("/rooms/999/select").status_code == 404
+
+        page = client.get("/rooms").get_data(as_text=True)
+        assert "Main room" in page and "Upstairs" in page
+        response = client.post("/rooms", data={"name": "Attic"})
+        assert response.status_code == 302
+        assert [room["name"] for room in client.get("/api/rooms").get_json()] == [
+            "Main room",
+            "Upstairs",
+            "Attic",
+        ]
+        # Creating a room switches to it; members are added there.
+        client.post("/members/add", data={"name": "Dana"})
+        assert [m["name"] for m in client.get("/api/members").get_json()] == ["Dana"]
+
+    def test_only_rooms_page_lists_rooms(self, app, client):
+        """Renders other than the rooms page do not load the room list."""
+        self._create_room(client, "Upstairs")
+        with app.app_context():
+            engine = db.engine
+        listings = []
+
+        def record(conn, cursor, statement, *args):
+            if "FROM rooms ORDER BY" in statement:
+                listings.append(statement)
+
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            for url in ("/", "/transactions", "/transactions?partial=1", "/balances"):
+                assert client.get(url).status_code == 200
+            assert not listings
+            assert "Upstairs" in client.get("/rooms").get_data(as_text=True)
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+        assert len(listings) == 1
+
+    def test_member_routes_stay_in_room(self, app, client):
+        room_id = self._create_room(client, "Upstairs")
+        with app.app_context():
+            stranger = Person(name="Eve", room_id=room_id)
+            db.session.add(stranger)
+            db.session.commit()
+            stranger_id = stranger.id
+
+        assert client.post(f"/members/{stranger_id}/edit", data={"name": "Mallory"}).status_code == 404
+        assert client.post(f"/members/{stranger_id}/delete").status_code == 404
+        with app.app_context():
+            assert db.session.get(Person, stranger_id).name == "Eve"
+
+
+class TestRequestMetrics:
+    """Test the Server-Timing header and the /metrics endpoint."""
+
+    def test_server_timing_header(self, client, app):
+        with app.app_context():
+            db.session.add(Person(name="Alice"))
+            db.session.commit()
+
+        response = client.get("/balances")
+        timing = response.headers["Server-Timing"]
+        assert timing.startswith("app;dur=")
+        assert "db;dur=" in timing and "render;dur=" in timing
+        queries = int(timing.split('desc="')[1].split(" ")[0])
+        assert queries >= 1
+
+    def test_metrics_by_route(self, client):
+        client.get("/api/members")
+        client.get("/api/members")
+        client.get("/api/transactions/999999/missing")
+
+        body = client.get("/metrics").get_data(as_text=True)
+        assert "# TYPE http_request_duration_seconds histogram" in body
+        assert 'http_request_duration_seconds_count{method="GET",route="/api/members"} 2' in body
+        assert 'http_requests_total{method="GET",route="/api/members",status="200"} 2' in body
+        assert 'http_requests_total{method="GET",route="<unmatched>",status="404"} 1' in body
+        assert 'db_queries_total{method="GET",route="/api/members"}' in body
+        assert 'template_render_seconds_total{method="GET",route="/api/members"} 0' in body
+
+    def test_metrics_can_be_disabled(self, client, app):
+        app.config["METRICS_ENABLED"] = False
+        assert "Server-Timing" not in client.get("/api/members").headers
+        assert client.get("/metrics").status_code == 404
+
+
+class TestLoggingPipeline:
+    """Test that log records reach the files through the background writer."""
+
+    def test_access_and_sql_logs_are_written_as_json(self, app, client, tmp_path):
+        from logger_setup import setup_logger, shutdown_logger
+
+        app.config.update(
+            LOG_DIR=str(tmp_path), LOG_SQL_SAMPLE_RATE=1.0, LOG_ACCESS_SAMPLE_RATE=1.0
+        )
+        setup_logger(app)
+        try:
+            assert client.get("/api/members").status_code == 200
+        finally:
+            shutdown_logger(app)
+            for name in ("room_expenses.access", "sqlalchemy.engine", "werkzeug"):
+                logging.getLogger(name).handlers.clear()
+            logging.getLogger("sqlalchemy.engine").setLevel(logging.WARNING)
+            app.logger.handlers.clear()
+
+        app_lines = [json.loads(line) for line in (tmp_path / "app.log").read_text().splitlines()]
+        access = [line for line in app_lines if line["logger"] == "room_expenses.access"]
+        assert access[0]["path"] == "/api/members"
+        assert access[0]["status"] == 200
+        assert access[0]["duration_ms"] is not None
+
+        db_lines = [json.loads(line) for line in (tmp_path / "db.log").read_text().splitlines()]
+        assert any("SELECT" in line["message"] for line in db_lines)
+        assert all(line["logger"].startswith("sqlalchemy.engine") for line in db_lines)
@@ -1,10 +1,34 @@
 """Unit tests for input validation and error handling."""
 
+import json
+import logging
+import random
+
 import pytest
+from datetime import date
 from decimal import Decimal
 
-from utils import split_amount, build_transaction_from_form
-from models import Person, db
+from utils import (
+    balance_engine,
+    build_transaction_from_form,
+    compute_balances,
+    compute_person_to_person_debts,
+    payload_to_form,
+    plan_settlements,
+    replay_balances,
+    split_amount,
+)
+from checkpoints import LedgerSnapshot, last_closed_period_end, period_end
+from logger_setup import JsonFormatter, LoggerNameFilter, SamplingFilter
+from models import (
+    Person,
+    Transaction,
+    db,
+    pack_member_ids,
+    packed_member_pattern,
+    unpack_member_ids,
+)
+from money import allocate_cents, allocate_cents_batch, from_cents, split_cents, to_cents
 
 
 class TestSplitAmount:
@@ -22,10 +46,10 @@ class TestSplitAmount:
         result = split_amount(Decimal("100.00"), 3)
         assert len(result) == 3
         assert sum(result) == Decimal("100.00")
-        # First two should be equal, last one gets remainder
-        assert result[0] == result[1]
-        assert result[0] == Decimal("33.33")
-        assert result[2] == Decimal("33.34")
+        # The leftover cent goes to the first share
+        assert result[1] == result[2]
+        assert result[0] == Decimal("33.34")
+        assert result[1] == Decimal("33.33")
 
     def test_split_amount_invalid_portions(self):
         """Test error handling for invalid portion count."""
@@ -45,6 +69,160 @@ class TestSplitAmount:
         assert result[1] == Decimal("0.01")
         assert result[2] == Decimal("0.01")
 
+    def test_split_cents_spreads_leftover_cents(self):
+        """Leftover cents go one each to the first participants, never below zero."""
+        assert split_cents(10000, 3) == [3334, 3333, 3333]
+        assert split_cents(5, 2) == [3, 2]
+        assert split_cents(7, 2) == [4, 3]
+        assert sum(split_cents(123457, 7)) == 123457
+        assert split_cents(6, 10) == [1] * 6 + [0] * 4
+        assert split_cents(200, 300) == [1] * 200 + [0] * 100
+        assert split_cents(1_000_001, 5000) == allocate_cents(1_000_001, [1] * 5000)
+
+    def test_cents_conversions(self):
+        """Test conversion between Decimal amounts and integer cents."""
+        assert to_cents(Decimal("12.34")) == 1234
+        assert to_cents("0.005") == 0
+        assert from_cents(-5) == Decimal("-0.05")
+        assert str(from_cents(100)) == "1.00"
+        txn = Transaction(amount=Decimal("19.99"))
+        assert txn.amount_cents == 1999
+        assert txn.amount == Decimal("19.99")
+
+
+class TestAllocateCents:
+    """Test the largest-remainder allocator."""
+
+    def test_proportional_shares_add_up(self):
+        """Shares follow the weights and always add up to the total."""
+        assert allocate_cents(1000, [1, 1, 2]) == [250, 250, 500]
+        assert allocate_cents(100, [1, 1, 1]) == [34, 33, 33]
+        assert allocate_cents(1001, [50, 25, 25]) == [501, 250, 250]
+        shares = allocate_cents(999_999, [3, 7, 11, 13])
+        assert sum(shares) == 999_999
+
+    def test_leftover_goes_to_largest_remainders(self):
+        """Leftover cents go to the largest remainders, not the last share."""
+        # Exact shares 3.3, 3.3, 3.4 -> the 0.4 remainder gets the cent.
+        assert allocate_cents(10, [33, 33, 34]) == [3, 3, 4]
+        assert allocate_cents(10, [34, 33, 33]) == [4, 3, 3]
+
+    def test_zero_weights_get_nothing(self):
+        assert allocate_cents(500, [0, 1, 0]) == [0, 500, 0]
+
+    def test_thousands_of_participants(self):
+        """A one-cent-per-head leftover is spread over many participants."""
+        shares = allocate_cents(1_000_001, [1] * 5000)
+        assert sum(shares) == 1_000_001
+        assert max(shares) - min(shares) <= 1
+
+    def test_invalid_weights(self):
+        with pytest.raises(ValueError, match="weights"):
+            allocate_cents(100, [])
+        with pytest.raises(ValueError, match="weights"):
+            allocate_cents(100, [0, 0])
+        with pytest.raises(ValueError, match="weights"):
+            allocate_cents(100, [2, -1])
+
+    def test_matches_sorting_by_remainder(self):
+        """The linear selection picks the same shares as a full sort would."""
+        rng = random.Random(0)
+        for _ in range(200):
+            weights = [rng.randint(0, 9) for _ in range(rng.randint(1, 40))] + [1]
+            total = rng.randint(0, 10_000)
+            weight_total = sum(weights)
+            floors = [total * weight // weight_total for weight in weights]
+            order = sorted(
+                range(len(weights)), key=lambda i: (-(total * weights[i] % weight_total), i)
+            )
+            expected = floors[:]
+            for index in order[: total - sum(floors)]:
+                expected[index] += 1
+            assert allocate_cents(total, weights) == expected
+
+    def test_batch(self):
+        totals = [100, 7, 1000, 5]
+        weights_list = [[1, 1, 1], [1, 6], [3, 0, 2], [2, 2]]
+        assert allocate_cents_batch(totals, weights_list) == [
+            allocate_cents(total, weights) for total, weights in zip(totals, weights_list)
+        ]
+        assert allocate_cents_batch([], []) == []
+        with pytest.raises(ValueError, match="same length"):
+            allocate_cents_batch([100], [])
+
+
+class TestSplitModes:
+    """Test weighted, percentage and fixed splits in the form helper."""
+
+    def _shares(self, app, members, mode, values, amount="100.00"):
+        with app.app_context():
+            people = Person.query.all()
+            form_data = {
+                "description": "Rent",
+                "date": "2025-01-01",
+                "amount": amount,
+                "payer_id": str(members[0]),
+                "participants": [str(member_id) for member_id in members],
+                "split_mode": mode,
+            }
+            for member_id, value in zip(members, values):
+                if value is not None:
+                    form_data[f"split_value_{member_id}"] = value
+            txn = build_transaction_from_form(form_data, people)
+            return [share.amount for share in txn.shares]
+
+    def test_weighted(self, app, members):
+        assert self._shares(app, members, "weighted", ["2", "1", "1"]) == [
+            Decimal("50.00"),
+            Decimal("25.00"),
+            Decimal("25.00"),
+        ]
+        # Missing weights count as 1, decimal weights are allowed.
+        assert self._shares(app, members, "weighted", ["1.5", None, "0.5"]) == [
+            Decimal("50.00"),
+            Decimal("33.33"),
+            Decimal("16.67"),
+        ]
+
+    def test_percentage(self, app, members):
+        assert self._shares(app, members, "percentage", ["50", "33.33", "16.67"]) == [
+            Decimal("50.00"),
+            Decimal("33.33"),
+            Decimal("16.67"),
+        ]
+        with pytest.raises(ValueError, match="add up to 100"):
+            self._shares(app, members, "percentage", ["50", "30", "10"])
+        with pytest.raises(ValueError, match="every participant"):
+            self._shares(app, members, "percentage", ["50", "50", None])
+
+    def test_fixed(self, app, members):
+        assert self._shares(app, members, "fixed", ["70", "20.50", "9.50"]) == [
+            Decimal("70.00"),
+            Decimal("20.50"),
+            Decimal("9.50"),
+        ]
+        with pytest.raises(ValueError, match="add up to the total"):
+            self._shares(app, members, "fixed", ["70", "20", "9"])
+        with pytest.raises(ValueError, match="whole cents"):
+            self._shares(app, members, "fixed", ["70.005", "20", "9.995"])
+
+    def test_invalid_mode_and_values(self, app, members):
+        with pytest.raises(ValueError, match="Split mode"):
+            self._shares(app, members, "random", [])
+        with pytest.raises(ValueError, match="must not be negative"):
+            self._shares(app, members, "weighted", ["2", "-1", "1"])
+        with pytest.raises(ValueError, match="greater than zero"):
+            self._shares(app, members, "weighted", ["0", "0", "0"])
+
+    def test_payload_split_values(self):
+        form = payload_to_form(
+            {"participant_ids": [3, 1], "split_mode": "weighted", "split_values": [2, 1]}
+        )
+        assert form["split_mode"] == "weighted"
+        assert form["split_value_3"] == "2" and form["split_value_1"] == "1"
+        form = payload_to_form({"participant_ids": [3], "split_values": {"3": "1.5"}})
+        assert form["split_value_3"] == "1.5"
+
 
 class TestBuildTransactionValidation:
     """Test transaction form validation."""
@@ -132,6 +310,47 @@ class TestBuildTransactionValidation:
             with pytest.raises(ValueError, match="Amount must be greater than zero"):
                 build_transaction_from_form(form_data, members)
 
+    def test_amount_rounding_to_zero_cents(self, app, sample_members):
+        """Test validation error for amounts below half a cent."""
+        with app.app_context():
+            members = Person.query.filter(Person.id.in_(sample_members)).all()
+            for amount in ("0.001", "0.005", "-Infinity", "NaN"):
+                form_data = {
+                    "description": "Test",
+                    "date": "2025-01-01",
+                    "amount": amount,
+                    "payer_id": str(sample_members[0]),
+                    "participants": [str(sample_members[0])],
+                }
+                with pytest.raises(ValueError, match="Amount must be greater than zero"):
+                    build_transaction_from_form(form_data, members)
+
+            form_data["amount"] = "0.006"
+            assert build_transaction_from_form(form_data, members).amount == Decimal("0.01")
+
+    def test_amount_too_large(self, app, sample_members):
+        """Test validation error for amounts beyond the supported maximum."""
+        with app.app_context():
+            members = Person.query.filter(Person.id.in_(sample_members)).all()
+            for amount in ("99999999999999999999999", "1e400"):
+                form_data = {
+                    "description": "Test",
+                    "date": "2025-01-01",
+                    "amount": amount,
+                    "payer_id": str(sample_members[0]),
+                    "participants": [str(sample_members[0])],
+                }
+                with pytest.raises(ValueError, match="Amount must not exceed"):
+                    build_transaction_from_form(form_data, members)
+
+            form_data.update(
+                amount="10.00",
+                split_mode="fixed",
+                **{f"split_value_{sample_members[0]}": "1e400"},
+            )
+            with pytest.raises(ValueError, match="too large"):
+                build_transaction_from_form(form_data, members)
+
     def test_missing_participants(self, app, sample_members):
         """Test validation error when no participants selected."""
         with app.app_context():
@@ -148,3 +367,202 @@ class TestBuildTransactionValidation:
             with pytest.raises(ValueError, match="Select at least one participant"):
                 build_transaction_from_form(form_data, members)
 
+
+
+class TestComputeBalances:
+    """Test the aggregate balance engine against the row-by-row replay."""
+
+    def test_matches_replay(self, app):
+        """Aggregated balances equal the replayed ones on a random ledger."""
+        rng = random.Random(42)
+        with app.app_context():
+            members = [Person(name=f"Member {i}") for i in range(6)]
+            db.session.add_all(members)
+            db.session.commit()
+
+            for i in range(200):
+                participants = rng.sample(members, rng.randint(1, len(members)))
+                form_data = {
+                    "description": f"Expense {i}",
+                    "date": "2025-01-01",
+                    "amount": f"{rng.randint(1, 50000) / 100:.2f}",
+                    "payer_id": str(rng.choice(members).id),
+                    "participants": [str(member.id) for member in participants],
+                }
+                db.session.add(build_transaction_from_form(form_data, members))
+            db.session.commit()
+
+            balances = compute_balances()
+            assert balances == replay_balances()
+            assert sum(balances.values()) == Decimal("0.00")
+
+    def test_members_without_transactions(self, app):
+        """Members with no activity get a zero balance."""
+        with app.app_context():
+            db.session.add(Person(name="Idle"))
+            db.session.commit()
+
+            assert list(compute_balances().values()) == [Decimal("0.00")]
+
+
+class TestPackedMemberIds:
+    """Test the packed participant lists of compact even splits."""
+
+    def test_round_trip_and_pattern(self):
+        packed = pack_member_ids([3, 1, 17])
+        assert packed == ",3,1,17,"
+        assert unpack_member_ids(packed) == [3, 1, 17]
+        assert packed_member_pattern(1) == "%,1,%"
+        assert ",1," in packed and ",7," not in packed
+
+
+class TestNumpyEngine:
+    """Test that the NumPy engine matches the Decimal replay exactly."""
+
+    def _random_ledger(self, members, count, seed):
+        rng = random.Random(seed)
+        for i in range(count):
+            participants = rng.sample(members, rng.randint(1, len(members)))
+            form_data = {
+                "description": f"Expense {i}",
+                "date": "2025-01-01",
+                "amount": f"{rng.randint(1, 50000) / 100:.2f}",
+                "payer_id": str(rng.choice(members).id),
+                "participants": [str(member.id) for member in participants],
+            }
+            db.session.add(build_transaction_from_form(form_data, members))
+        db.session.commit()
+
+    @pytest.mark.parametrize("compact", [False, True])
+    def test_matches_decimal_replay(self, app, compact):
+        """Balances and pairwise debts equal a Decimal replay of every share."""
+        pytest.importorskip("numpy")
+        app.config["COMPACT_EVEN_SPLITS"] = compact
+        with app.app_context():
+            members = [Person(name=f"Member {i}") for i in range(7)]
+            members.append(Person(name="Idle"))
+            db.session.add_all(members)
+            db.session.commit()
+            self._random_ledger(members[:-1], 300, seed=7)
+
+            expected_debts = {}
+            assert Transaction.query.filter(
+                Transaction.participant_ids.isnot(None)
+            ).count() == (300 if compact else 0)
+            for txn in Transaction.query:
+                for share in txn.split():
+                    if share.person_id != txn.payer_id:
+                        row = expected_debts.setdefault(share.person_id, {})
+                        row[txn.payer_id] = row.get(txn.payer_id, Decimal("0.00")) + share.amount
+
+            app.config["BALANCE_ENGINE"] = "numpy"
+            assert balance_engine() == "numpy"
+            balances = compute_balances()
+            assert balances == replay_balances()
+            assert balances[members[-1].id] == Decimal("0.00")
+            assert compute_person_to_person_debts() == expected_debts
+
+            app.config["BALANCE_ENGINE"] = "sql"
+            assert compute_balances() == balances
+            assert compute_person_to_person_debts() == expected_debts
+
+    def test_empty_ledger(self, app):
+        """The NumPy engine handles a database without transactions."""
+        pytest.importorskip("numpy")
+        app.config["BALANCE_ENGINE"] = "numpy"
+        with app.app_context():
+            assert compute_balances() == {}
+            assert compute_person_to_person_debts() == {}
+
+    def test_unknown_engine(self, app):
+        app.config["BALANCE_ENGINE"] = "fortran"
+        with app.app_context():
+            with pytest.raises(ValueError, match="BALANCE_ENGINE"):
+                compute_balances()
+
+
+class TestPlanSettlements:
+    """Test the minimum-transfers settlement planner."""
+
+    def test_plan_settles_everyone(self):
+        """Applying the planned transfers brings every balance to zero."""
+        rng = random.Random(7)
+        cents = [rng.randint(-10000, 10000) for _ in range(49)]
+        cents.append(-sum(cents))
+        balances = {
+            person_id: Decimal(value) / 100 for person_id, value in enumerate(cents, 1)
+        }
+
+        transfers = plan_settlements(balances)
+
+        remaining = dict(balances)
+        for debtor_id, creditor_id, amount in transfers:
+            assert amount > 0
+            remaining[debtor_id] += amount
+            remaining[creditor_id] -= amount
+        assert all(value == 0 for value in remaining.values())
+        assert len(transfers) <= len(balances) - 1
+
+    def test_plan_prefers_single_transfer(self):
+        """One creditor and one debtor settle with a single transfer."""
+        balances = {1: Decimal("12.50"), 2: Decimal("-12.50"), 3: Decimal("0.00")}
+        assert plan_settlements(balances) == [(2, 1, Decimal("12.50"))]
+
+
+class TestCheckpointPeriods:
+    """Test the period boundaries and netting used by balance checkpoints."""
+
+    def test_period_end(self):
+        assert period_end(date(2024, 2, 10), "month") == date(2024, 2, 29)
+        assert period_end(date(2024, 12, 31), "month") == date(2024, 12, 31)
+        assert period_end(date(2024, 5, 15), "week") == date(2024, 5, 19)
+        assert period_end(date(2024, 5, 15), "day") == date(2024, 5, 15)
+
+    def test_last_closed_period_end(self):
+        assert last_closed_period_end(date(2024, 3, 31), "month") == date(2024, 3, 31)
+        assert last_closed_period_end(date(2024, 3, 30), "month") == date(2024, 2, 29)
+        assert last_closed_period_end(date(2024, 5, 15), "week") == date(2024, 5, 12)
+
+    def test_periods_at_the_ends_of_the_calendar(self):
+        assert period_end(date(9999, 12, 30), "month") == date.max
+        assert period_end(date(9999, 12, 30), "week") == date.max
+        assert last_closed_period_end(date.max, "week") == date.max
+        assert last_closed_period_end(date(1, 1, 15), "month") is None
+        assert last_closed_period_end(date.min, "day") == date.min
+
+    def test_net_debts(self):
+        snapshot = LedgerSnapshot(date(2024, 1, 1), {}, {(1, 2): 500, (2, 1): 200, (3, 1): 100})
+        assert snapshot.net_debts() == [(1, 2, Decimal("3.00")), (3, 1, Decimal("1.00"))]
+
+
+class TestLoggingPipeline:
+    """Test the JSON formatter and the sampling filters."""
+
+    def _record(self, level=logging.INFO, name="app", **extra):
+        record = logging.LogRecord(name, level, __file__, 1, "hello %s", ("world",), None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_json_formatter_includes_extra_fields(self):
+        entry = json.loads(JsonFormatter().format(self._record(status=200, path="/")))
+        assert entry["message"] == "hello world"
+        assert entry["level"] == "INFO"
+        assert entry["logger"] == "app"
+        assert entry["status"] == 200 and entry["path"] == "/"
+        assert "args" not in entry and "msg" not in entry
+
+    def test_sampling_rates(self):
+        records = [self._record() for _ in range(2000)]
+        assert all(SamplingFilter(1.0).filter(record) for record in records)
+        assert not any(SamplingFilter(0).filter(record) for record in records)
+        kept = sum(SamplingFilter(0.25).filter(record) for record in records)
+        assert 300 < kept < 700
+
+    def test_warnings_are_never_sampled_out(self):
+        assert SamplingFilter(0).filter(self._record(level=logging.WARNING))
+
+    def test_logger_name_filter(self):
+        sql = LoggerNameFilter("sqlalchemy.engine")
+        assert sql.filter(self._record(name="sqlalchemy.engine.Engine"))
+        assert not sql.filter(self._record(name="sqlalchemy.engineering"))
+        assert LoggerNameFilter("sqlalchemy.engine", exclude=True).filter(self._record())
@@ -1,15 +1,37 @@
 from __future__ import annotations
 
-from datetime import datetime
+import heapq
+from datetime import date, datetime
 from decimal import Decimal, ROUND_HALF_EVEN # to the closest Z number 
-from typing import Dict, Iterable, List
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Tuple
 
+from flask import current_app, has_app_context
+from sqlalchemy import func
 from sqlalchemy.orm import joinedload
 
-from models import Person, Transaction, TransactionShare, db
+import analytics
+from compact import compact_columns, compact_pair_totals, compact_share_totals
+from migrations import upgrade_database
+from models import DEFAULT_ROOM_ID, Person, Room, Transaction, TransactionShare, current_room_id, db
+from money import CENT, allocate_cents_batch, from_cents, split_cents, to_cents
 
 DEFAULT_MEMBERS = ["Valentine", "Savel", "Sasha", "Matvei"]
+DEFAULT_ROOM_NAME = "Main room"
 DEFAULT_CURRENCY_SYMBOL = "£"
+BALANCE_ENGINES = ("sql", "numpy")
+SPLIT_MODES = ("even", "weighted", "percentage", "fixed")
+MAX_WEIGHT_PLACES = 6
+# Largest amount (and split value) accepted for one expense.
+MAX_AMOUNT = Decimal("99999999.99")
+
+
+def ensure_default_room() -> None:
+    """Create the default room if the database has none."""
+    if Room.query.count():
+        return
+
+    db.session.add(Room(name=DEFAULT_ROOM_NAME))
+    db.session.commit()
 
 
 def ensure_default_members() -> None:
@@ -18,48 +40,123 @@ def ensure_default_members() -> None:
         return
 
     for member_name in DEFAULT_MEMBERS:
-        person = Person(name=member_name)
+        person = Person(name=member_name, room_id=DEFAULT_ROOM_ID)
         db.session.add(person)
     db.session.commit()
 
 
 def split_amount(total: Decimal, portions: int) -> List[Decimal]:
     """
-    Evenly split ``total`` into ``portions`` pieces using bankers rounding and
-    keep the sum equal to the original total.
+    Evenly split ``total`` into ``portions`` pieces, the leftover cents going
+    to the first ones, and keep the sum equal to the original total.
     """
-    if portions <= 0:
-        raise ValueError("portions must be a positive integer")
+    return [from_cents(cents) for cents in split_cents(to_cents(total), portions)]
 
-    quantizer = Decimal("0.01")
-    base_share = (total / portions).quantize(quantizer, rounding=ROUND_HALF_EVEN)
-    shares = [base_share for _ in range(portions)]
 
-    difference = total - sum(shares)
-    if difference:
-        # If there is any small leftover 
-        # adjust the last share to ensure the sum matches the total
-        shares[-1] = (shares[-1] + difference).quantize(
-            quantizer, rounding=ROUND_HALF_EVEN
-        )
-    return shares
+def balance_engine() -> str:
+    """Return the configured ``BALANCE_ENGINE`` (``sql`` unless set)."""
+    engine = current_app.config.get("BALANCE_ENGINE", "sql") if has_app_context() else "sql"
+    if engine not in BALANCE_ENGINES:
+        raise ValueError(f"BALANCE_ENGINE must be one of {', '.join(BALANCE_ENGINES)}")
+    if engine == "numpy" and not analytics.numpy_available():
+        raise RuntimeError("BALANCE_ENGINE=numpy requires NumPy to be installed")
+    return engine
+
+
+def compute_balance_cents() -> Dict[int, int]:
+    """
+    Return net balance per person of the current room in cents.
+
+    Uses two grouped aggregates (payments by payer, shares by person) so no
+    ``Transaction`` objects are loaded, or the NumPy engine when configured.
+    """
+    if balance_engine() == "numpy":
+        return analytics.balance_cents()
+
+    room_id = current_room_id()
+    balance_cents: Dict[int, int] = {
+        person_id: 0
+        for (person_id,) in db.session.query(Person.id).filter(Person.room_id == room_id)
+    }
+
+    paid = (
+        db.session.query(Transaction.payer_id, func.sum(Transaction.amount_cents))
+        .filter(Transaction.room_id == room_id)
+        .group_by(Transaction.payer_id)
+    )
+    for payer_id, cents in paid:
+        balance_cents[payer_id] = balance_cents.get(payer_id, 0) + int(cents)
+
+    owed = (
+        db.session.query(TransactionShare.person_id, func.sum(TransactionShare.amount_cents))
+        .filter(TransactionShare.room_id == room_id)
+        .group_by(TransactionShare.person_id)
+    )
+    for person_id, cents in owed:
+        balance_cents[person_id] = balance_cents.get(person_id, 0) - int(cents)
+    for person_id, cents in compact_share_totals():
+        balance_cents[person_id] = balance_cents.get(person_id, 0) - cents
+
+    return balance_cents
 
 
 def compute_balances() -> Dict[int, Decimal]:
     """Return net balance per person."""
-    balances: Dict[int, Decimal] = {
-        member.id: Decimal("0.00") for member in Person.query.all()
+    return {person_id: from_cents(cents) for person_id, cents in compute_balance_cents().items()}
+
+
+def replay_balances() -> Dict[int, Decimal]:
+    """Reference implementation of :func:`compute_balances` replaying every row."""
+    room_id = current_room_id()
+    balance_cents: Dict[int, int] = {
+        member.id: 0 for member in Person.query.filter_by(room_id=room_id)
     }
 
-    transactions = Transaction.query.options(
-        joinedload(Transaction.shares).joinedload(TransactionShare.person),
-        joinedload(Transaction.payer),
+    transactions = Transaction.query.filter_by(room_id=room_id).options(
+        joinedload(Transaction.shares)
     )
     for txn in transactions:
-        balances[txn.payer_id] += Decimal(txn.amount)
-        for share in txn.shares:
-            balances[share.person_id] -= Decimal(share.amount)
-    return balances
+        balance_cents[txn.payer_id] += txn.amount_cents
+        for share in txn.split():
+            balance_cents[share.person_id] -= share.amount_cents
+    return {person_id: from_cents(cents) for person_id, cents in balance_cents.items()}
+
+
+def compute_pair_debt_cents() -> Dict[int, Dict[int, int]]:
+    """
+    Compute debt relationships in cents: ``debts[a][b]`` is what ``a`` owes
+    ``b`` in total.
+
+    The result is sparse: pairs without any debt are left out, and it is built
+    from one grouped aggregate over shares joined to their payer (or by the
+    NumPy engine when configured).
+    """
+    if balance_engine() == "numpy":
+        return analytics.pair_debt_cents()
+
+    rows = (
+        db.session.query(
+            TransactionShare.person_id,
+            Transaction.payer_id,
+            func.sum(TransactionShare.amount_cents),
+        )
+        .join(Transaction, TransactionShare.transaction_id == Transaction.id)
+        .filter(
+            TransactionShare.room_id == current_room_id(),
+            TransactionShare.person_id != Transaction.payer_id,
+        )
+        .group_by(TransactionShare.person_id, Transaction.payer_id)
+    )
+
+    debts: Dict[int, Dict[int, int]] = {}
+    for debtor_id, creditor_id, cents in rows:
+        if cents:
+            debts.setdefault(debtor_id, {})[creditor_id] = int(cents)
+    for debtor_id, creditor_id, cents in compact_pair_totals():
+        if debtor_id != creditor_id and cents:
+            row = debts.setdefault(debtor_id, {})
+            row[creditor_id] = row.get(creditor_id, 0) + cents
+    return debts
 
 
 def compute_person_to_person_debts() -> Dict[int, Dict[int, Decimal]]:
@@ -67,29 +164,196 @@ def compute_person_to_person_debts() -> Dict[int, Dict[int, Decimal]]:
     Compute debt relationships: debts[person_a_id][person_b_id] = amount
     means person_a owes person_b that amount.
     """
-    all_people = Person.query.all()
-    debts: Dict[int, Dict[int, Decimal]] = {
-        person.id: {p.id: Decimal("0.00") for p in all_people} for person in all_people
+    return {
+        debtor_id: {creditor_id: from_cents(cents) for creditor_id, cents in row.items()}
+        for debtor_id, row in compute_pair_debt_cents().items()
     }
 
-    transactions = Transaction.query.options(
-        joinedload(Transaction.shares).joinedload(TransactionShare.person),
-        joinedload(Transaction.payer),
+
+def plan_settlements(balances: Dict[int, Decimal]) -> List[Tuple[int, int, Decimal]]:
+    """
+    Turn net balances into a short list of ``(debtor_id, creditor_id, amount)``
+    transfers that settles everybody.
+
+    Greedily matches the largest debtor with the largest creditor using two
+    heaps; every transfer clears at least one side, so there are at most
+    P - 1 transfers and the plan is built in O(P log P).
+    """
+    creditors: List[Tuple[int, int]] = []
+    debtors: List[Tuple[int, int]] = []
+    for person_id, balance in balances.items():
+        cents = to_cents(balance)
+        if cents > 0:
+            creditors.append((-cents, person_id))
+        elif cents < 0:
+            debtors.append((cents, person_id))
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers: List[Tuple[int, int, Decimal]] = []
+    while creditors and debtors:
+        credit, creditor_id = heapq.heappop(creditors)
+        debt, debtor_id = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+        transfers.append((debtor_id, creditor_id, from_cents(amount)))
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor_id))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, debtor_id))
+    return transfers
+
+
+def require_text_fields(record: Mapping[str, object], fields: Iterable[str]) -> None:
+    """Raise ``ValueError`` unless each of ``fields`` is missing, empty or a string."""
+    for field in fields:
+        if not isinstance(record.get(field) or "", str):
+            raise ValueError(f"{field} must be a string.")
+
+
+def payload_to_form(payload: Dict[str, object]):
+    """
+    Convert JSON payload to structure compatible with the form helper.
+    Values of the wrong JSON type raise ``ValueError``.
+    """
+
+    class FormAdapter(dict):
+        def getlist(self, key):
+            value = self.get(key, [])
+            if isinstance(value, list):
+                return [str(item) for item in value]
+            return [str(value)]
+
+    if not isinstance(payload, dict):
+        raise ValueError("Expected a JSON object.")
+    require_text_fields(payload, ("description", "date", "comment"))
+
+    adapter = FormAdapter()
+    adapter.update(
+        {
+            "description": payload.get("description", ""),
+            "date": payload.get("date", ""),
+            "amount": str(payload.get("amount", "")),
+            "comment": payload.get("comment", ""),
+        }
     )
 
-    for txn in transactions:
-        payer_id = txn.payer_id
-        for share in txn.shares:
-            debtor_id = share.person_id
-            if debtor_id == payer_id:
-                continue
-            amount = Decimal(share.amount)
-            debts[debtor_id][payer_id] += amount
+    payer_id = payload.get("payer_id") or payload.get("payerId")
+    if payer_id is not None:
+        adapter["payer_id"] = str(payer_id)
 
-    return debts
+    participants = payload.get("participant_ids") or payload.get("participants") or []
+    if not isinstance(participants, list):
+        raise ValueError("participant_ids must be a list of member ids.")
+    adapter["participants"] = [str(member_id) for member_id in participants]
 
+    if payload.get("split_mode"):
+        adapter["split_mode"] = str(payload["split_mode"])
+    split_values = payload.get("split_values") or {}
+    if isinstance(split_values, list):
+        # A list lines up with the participants, in order.
+        split_values = dict(zip(adapter["participants"], split_values))
+    if not isinstance(split_values, dict):
+        raise ValueError("split_values must be an object or a list.")
+    for member_id, value in split_values.items():
+        adapter[f"split_value_{member_id}"] = str(value)
 
-def build_transaction_from_form(form_data, members: Iterable[Person]) -> Transaction:
+    return adapter
+
+
+class TransactionData(NamedTuple):
+    """Validated, database-independent content of one expense."""
+
+    description: str
+    date: date
+    amount_cents: int
+    comment: str
+    payer_id: int
+    shares: List[Tuple[int, int]]  # (person_id, amount in cents)
+    split_mode: str = "even"
+
+
+def _parse_split_value(raw, member_id: int) -> Decimal:
+    try:
+        value = Decimal(str(raw).strip().replace(",", "."))
+    except Exception:  # noqa: BLE001 - broad to wrap invalid decimal
+        raise ValueError(f"Split value for member {member_id} must be a number.") from None
+    if not value.is_finite() or value < 0:
+        raise ValueError(f"Split value for member {member_id} must not be negative.")
+    if value > MAX_AMOUNT:
+        raise ValueError(f"Split value for member {member_id} is too large.")
+    return value
+
+
+def _integer_weights(values: List[Decimal]) -> List[int]:
+    """Scale decimal weights by a common power of ten so they become integers."""
+    places = max(max(0, -value.normalize().as_tuple().exponent) for value in values)
+    if places > MAX_WEIGHT_PLACES:
+        raise ValueError(f"Split values can have at most {MAX_WEIGHT_PLACES} decimal places.")
+    return [int(value.scaleb(places)) for value in values]
+
+
+def split_weights(
+    amount_cents: int, participant_ids: List[int], split_mode: str, form_data
+) -> List[int]:
+    """
+    Return integer weights whose largest-remainder allocation of
+    ``amount_cents`` gives each participant's share for the given split mode.
+
+    ``even`` weighs everyone 1; ``weighted`` and ``percentage`` use
+    ``split_value_<member id>`` (weights default to 1, percentages must add up
+    to 100); ``fixed`` weighs by the given amounts, which must add up to the
+    total.
+    """
+    if split_mode not in SPLIT_MODES:
+        raise ValueError(f"Split mode must be one of {', '.join(SPLIT_MODES)}.")
+    if split_mode == "even":
+        return [1] * len(participant_ids)
+
+    values = []
+    for member_id in participant_ids:
+        raw = form_data.get(f"split_value_{member_id}")
+        if raw in (None, ""):
+            if split_mode != "weighted":
+                raise ValueError(f"Enter a {split_mode} value for every participant.")
+            raw = "1"
+        values.append(_parse_split_value(raw, member_id))
+
+    if split_mode == "fixed":
+        if any(value != value.quantize(CENT) for value in values):
+            raise ValueError("Fixed shares must be whole cents.")
+        shares = [to_cents(value) for value in values]
+        if sum(shares) != amount_cents:
+            raise ValueError("Fixed shares must add up to the total amount.")
+        return shares
+    if split_mode == "percentage" and sum(values) != 100:
+        raise ValueError("Percentages must add up to 100.")
+    if not any(values):
+        raise ValueError("At least one weight must be greater than zero.")
+    return _integer_weights(values)
+
+
+def split_shares(
+    amount_cents: int, participant_ids: List[int], split_mode: str, form_data
+) -> List[int]:
+    """Return each participant's share in cents for the given split mode."""
+    weights = split_weights(amount_cents, participant_ids, split_mode, form_data)
+    return allocate_cents_batch([amount_cents], [weights])[0]
+
+
+def _parse_member_id(raw, message: str) -> int:
+    try:
+        return int(raw)
+    except (TypeError, ValueError):
+        raise ValueError(message) from None
+
+
+def _validate_fields(
+    form_data, members_by_id: Mapping[int, object]
+) -> Tuple[TransactionData, List[int]]:
+    """
+    Validate everything but the allocation: the cleaned data with zero shares
+    and the split weights of its participants.
+    """
     description = (form_data.get("description") or "").strip()
     if not description:
         raise ValueError("Description is required.")
@@ -106,15 +370,21 @@ def build_transaction_from_form(form_data, members: Iterable[Person]) -> Transac
     except Exception as exc:  # noqa: BLE001 - broad to wrap invalid decimal
         raise ValueError("Amount must be a valid number.") from exc
 
-    if amount <= 0:
+    if amount.is_finite() and amount > MAX_AMOUNT:
+        raise ValueError(f"Amount must not exceed {MAX_AMOUNT:,}.")
+    amount_cents = 0
+    if amount.is_finite() and amount > 0:
+        amount_cents = to_cents(amount.quantize(CENT, rounding=ROUND_HALF_EVEN))
+    # Check the rounded cents, so fractions of a cent cannot store a free expense.
+    if amount_cents <= 0:
         raise ValueError("Amount must be greater than zero.")
 
     payer_id = form_data.get("payer_id")
     if not payer_id:
         raise ValueError("Select who paid for this expense.")
 
-    payer = db.session.get(Person, int(payer_id))
-    if not payer:
+    payer_id = _parse_member_id(payer_id, "Selected payer does not exist.")
+    if payer_id not in members_by_id:
         raise ValueError("Selected payer does not exist.")
 
     # Support both Flask request.form (has getlist) and plain dicts
@@ -124,38 +394,111 @@ def build_transaction_from_form(form_data, members: Iterable[Person]) -> Transac
         participants_raw = form_data.get("participants", [])
         if not isinstance(participants_raw, list):
             participants_raw = [participants_raw] if participants_raw else []
-    
-    participant_ids = [int(pid) for pid in participants_raw]
+
+    participant_ids = [
+        _parse_member_id(pid, "Some participants are invalid.") for pid in participants_raw
+    ]
     participant_ids = list(dict.fromkeys(participant_ids))  # Remove duplicates
 
     if len(participant_ids) == 0:
         raise ValueError("Select at least one participant to split the expense.")
 
-    known_member_ids = {member.id for member in members}
-    if not set(participant_ids).issubset(known_member_ids):
+    if not all(member_id in members_by_id for member_id in participant_ids):
         raise ValueError("Some participants are invalid.")
 
     comment = (form_data.get("comment") or "").strip()
-    shares = split_amount(amount, len(participant_ids))
+    split_mode = (form_data.get("split_mode") or "even").strip().lower()
+    weights = split_weights(amount_cents, participant_ids, split_mode, form_data)
 
-    transaction = Transaction(
+    data = TransactionData(
         description=description,
         date=txn_date,
-        amount=amount,
+        amount_cents=amount_cents,
         comment=comment,
-        payer=payer,
+        payer_id=payer_id,
+        shares=[(member_id, 0) for member_id in participant_ids],
+        split_mode=split_mode,
+    )
+    return data, weights
+
+
+def _with_shares(data: TransactionData, shares: List[int]) -> TransactionData:
+    return data._replace(
+        shares=[(member_id, cents) for (member_id, _), cents in zip(data.shares, shares, strict=True)]
+    )
+
+
+def validate_transaction_form(form_data, members_by_id: Mapping[int, object]) -> TransactionData:
+    """
+    Validate an expense form (or form-like dict) against a preloaded map of
+    member ids and return the cleaned data with the split already computed.
+    """
+    (result,) = validate_transaction_forms([form_data], members_by_id)
+    if isinstance(result, ValueError):
+        raise result
+    return result
+
+
+def validate_transaction_forms(
+    forms: Iterable, members_by_id: Mapping[int, object]
+) -> List[TransactionData | ValueError]:
+    """
+    Validate many expense forms, allocating all their splits in one
+    ``allocate_cents_batch`` call (importers and bulk writes). An invalid form
+    gives its ``ValueError`` in place of the data instead of stopping the batch.
+    """
+    results: List[TransactionData | ValueError] = []
+    pending: List[Tuple[int, TransactionData, List[int]]] = []
+    for form_data in forms:
+        try:
+            data, weights = _validate_fields(form_data, members_by_id)
+        except ValueError as exc:
+            results.append(exc)
+            continue
+        pending.append((len(results), data, weights))
+        results.append(data)
+
+    allocations = allocate_cents_batch(
+        [data.amount_cents for _, data, _ in pending], [weights for _, _, weights in pending]
+    )
+    for (index, data, _), shares in zip(pending, allocations):
+        results[index] = _with_shares(data, shares)
+    return results
+
+
+def build_transaction_from_form(form_data, members: Iterable[Person]) -> Transaction:
+    data = validate_transaction_form(form_data, {member.id: member for member in members})
+    return transaction_from_data(data)
+
+
+def transaction_from_data(data: TransactionData) -> Transaction:
+    """A new, unsaved ``Transaction`` (with share rows unless stored compactly)."""
+    participant_ids, participant_count = compact_columns(data.split_mode, data.shares)
+    room_id = current_room_id()
+    transaction = Transaction(
+        room_id=room_id,
+        description=data.description,
+        date=data.date,
+        amount_cents=data.amount_cents,
+        comment=data.comment,
+        payer_id=data.payer_id,
+        participant_ids=participant_ids,
+        participant_count=participant_count,
     )
+    if participant_ids is not None:
+        return transaction
 
-    for member_id, share_amount in zip(participant_ids, shares, strict=True):
+    for member_id, share_cents in data.shares:
         transaction.shares.append(
-            TransactionShare(person_id=member_id, amount=share_amount)
+            TransactionShare(person_id=member_id, room_id=room_id, amount_cents=share_cents)
         )
 
     return transaction
 
 
 def initialize_database() -> None:
-    """Create tables and seed default members if needed."""
-    db.create_all()
+    """Create or upgrade the schema and seed the default room and members if needed."""
+    upgrade_database()
+    ensure_default_room()
     ensure_default_members()
 